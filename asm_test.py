@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 # note https://www.chess-poster.com/english/fen/fen_epd_viewer.htm is a handy
 # web page for visualizing FEN/EPD strings used to represent chess positions
+#
+# python asm_test.py -j 4 runs tests on a pool of 4 worker processes and
+# reports the wall time and simulated cycles of each test.
+import argparse
+import concurrent.futures
+import os
+import sys
+import tempfile
+import time
 import unittest
 from subprocess import run, PIPE, Popen
 from game import Board, Position, Square, Move
@@ -16,16 +25,79 @@ KING_SCORE=25
 # defined in update_center_score
 CENTER_SCORE=1
 
+class BatchSimulator(object):
+  """A long-lived chsim -b process that runs decks against one program.
+
+  The program is loaded once, and each deck runs from reset, so tests don't
+  pay for starting chsim and parsing the .e file every time.
+  """
+  def __init__(self, program):
+    self.process = Popen(['./chsim/chsim', '-b', program], stdin=PIPE, stdout=PIPE,
+                         universal_newlines=True)
+
+  def run(self, deck, max_cycles):
+    """Returns (status, output, cycles) from running deck.
+
+    status is 'halt', 'break', 'error' or 'timeout' and output is a list of
+    what the program printed.
+    """
+    self.process.stdin.write(f'{deck}\nrun {max_cycles}\n')
+    self.process.stdin.flush()
+    output = []
+    for line in self.process.stdout:
+      if line.startswith('done'):
+        _, status, cycles, _ = line.split()
+        return status, output, int(cycles)
+      output.extend(line.split())
+    raise RuntimeError('chsim exited')
+
+  def close(self):
+    self.process.stdin.close()
+    self.process.wait()
+
+
+_simulators = {}
+# Scratch directories by process id.  Forked workers inherit the parent's
+# entries, which are kept so that they aren't cleaned up from the worker.
+_scratch = {}
+
+def _scratch_dir():
+  """Returns a directory for assembled test programs private to this process,
+  so concurrent test runs and -j workers don't overwrite each other's
+  programs."""
+  pid = os.getpid()
+  if pid not in _scratch:
+    _scratch[pid] = tempfile.TemporaryDirectory(prefix='asm_test')
+  return _scratch[pid].name
+
+def assemble(source):
+  """Assembles source for chsim into the scratch directory."""
+  name = os.path.splitext(os.path.basename(source))[0] + '.e'
+  path = os.path.join(_scratch_dir(), name)
+  run(['python', 'chasm/chasm.py', source, path], stdout=PIPE, check=True)
+  if path in _simulators:
+    _simulators.pop(path).close()
+
+def tearDownModule():
+  for simulator in _simulators.values():
+    simulator.close()
+  _simulators.clear()
+
+
 class SimTestCase(unittest.TestCase):
   def setUp(self):
     self.memory = [0] * 75
+    # simulated cycles used by this test
+    self.cycles = 0
 
   def simulate(self, program, deck, max_cycles=500000):
-    with open('/tmp/test.deck', 'w') as f:
-      f.write(deck)
-    result = run(f'./chsim/chsim -t {max_cycles} -f /tmp/test.deck {program}', shell=True, stdin=PIPE, stdout=PIPE)
-    self.assertEqual(result.returncode, 0)
-    return result.stdout.decode('utf-8').strip().split()
+    path = os.path.join(_scratch_dir(), program)
+    if path not in _simulators:
+      _simulators[path] = BatchSimulator(path)
+    status, output, cycles = _simulators[path].run(deck, max_cycles)
+    self.cycles += cycles
+    self.assertEqual(status, 'halt')
+    return output
 
   def initBoard(self, position):
     piece_code = '??PNBQpnbq'
@@ -96,7 +168,7 @@ class SimTestCase(unittest.TestCase):
 
 class TestMoveGen(SimTestCase):
   def setUpClass():
-    run('python chasm/chasm.py asm/movegen_test.asm movegen_test.e', shell=True, check=True)
+    assemble('asm/movegen_test.asm')
     run('make -C chsim chsim', shell=True, check=True)
 
   def computeMoves(self, fen):
@@ -377,7 +449,7 @@ class TestMoveGen(SimTestCase):
 
 class TestMove(SimTestCase):
   def setUpClass():
-    run('python chasm/chasm.py asm/move_test.asm move_test.e', shell=True, check=True)
+    assemble('asm/move_test.asm')
     run('make -C chsim chsim', shell=True, check=True)
 
   def makeMove(self, fen, move):
@@ -515,7 +587,7 @@ class TestMove(SimTestCase):
 
 class TestUndoMove(SimTestCase):
   def setUpClass():
-    run('python chasm/chasm.py asm/undo_move_test.asm undo_move_test.e', shell=True, check=True)
+    assemble('asm/undo_move_test.asm')
     run('make -C chsim chsim', shell=True, check=True)
 
   def undoMove(self, from_fen, to_fen, move):
@@ -698,7 +770,7 @@ class TestUndoMove(SimTestCase):
 
 class TestChess(SimTestCase):
   def setUpClass():
-    run('python chasm/chasm.py asm/chess_test.asm chess_test.e', shell=True, check=True)
+    assemble('asm/chess_test.asm')
     run('make -C chsim chsim', shell=True, check=True)
 
   def findBestMove(self, fen):
@@ -765,5 +837,107 @@ class TestChess(SimTestCase):
     self.assertEqual(best, '7282')
 
 
+class _TimingResult(unittest.TestResult):
+  """Records (test id, outcome, seconds, cycles, details) for each test."""
+  def __init__(self):
+    super().__init__()
+    self.outcomes = []
+    self._start = None
+
+  def startTest(self, test):
+    super().startTest(test)
+    self._start = time.perf_counter()
+
+  def _record(self, test, outcome, details=''):
+    seconds = time.perf_counter() - self._start if self._start else 0
+    test_id = test.id().replace(f'{__name__}.', '')
+    self.outcomes.append((test_id, outcome, seconds, getattr(test, 'cycles', 0), details))
+    self._start = None
+
+  def addSuccess(self, test):
+    super().addSuccess(test)
+    self._record(test, 'ok')
+
+  def addFailure(self, test, err):
+    super().addFailure(test, err)
+    self._record(test, 'FAIL', self.failures[-1][1])
+
+  def addError(self, test, err):
+    super().addError(test, err)
+    self._record(test, 'ERROR', self.errors[-1][1])
+
+  def addSkip(self, test, reason):
+    super().addSkip(test, reason)
+    self._record(test, 'skip', reason)
+
+
+def _run_shard(test_ids):
+  """Runs tests by id, returning their outcomes.  Runs in a worker."""
+  module = sys.modules[__name__]
+  suite = unittest.defaultTestLoader.loadTestsFromNames(test_ids, module)
+  result = _TimingResult()
+  suite.run(result)
+  return result.outcomes
+
+
+def _shards(test_ids, count):
+  """Splits test_ids into up to count shards per test class.
+
+  Tests of a class are dealt round robin, so the slow TestChess searches are
+  spread across workers.  Each shard assembles its class's program once.
+  """
+  classes = {}
+  for test_id in test_ids:
+    class_name, _ = test_id.rsplit('.', 1)
+    classes.setdefault(class_name, []).append(test_id)
+  shards = []
+  for ids in classes.values():
+    shards.extend(ids[i::count] for i in range(min(count, len(ids))))
+  # Start the longest shards first.
+  shards.sort(key=lambda ids: 'TestChess' not in ids[0])
+  return shards
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Tests chess assembly in the simulator.')
+  parser.add_argument('tests', nargs='*', help='tests to run, e.g. TestChess.testPuzzle')
+  parser.add_argument('--jobs', '-j', type=int, default=1, help='worker processes')
+  args = parser.parse_args()
+
+  # Build chsim once up front instead of racing to build it in every worker.
+  run('make -C chsim chsim', shell=True, check=True)
+  module = sys.modules[__name__]
+  loader = unittest.defaultTestLoader
+  suite = (loader.loadTestsFromNames(args.tests, module) if args.tests
+           else loader.loadTestsFromModule(module))
+  test_ids = [test.id().split('.', 1)[1] for test in _flatten(suite)]
+
+  start = time.perf_counter()
+  if args.jobs > 1:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+      outcomes = [outcome for shard in executor.map(_run_shard, _shards(test_ids, args.jobs))
+                  for outcome in shard]
+  else:
+    outcomes = _run_shard(test_ids)
+  wall = time.perf_counter() - start
+
+  failed = [outcome for outcome in outcomes if outcome[1] in ('FAIL', 'ERROR')]
+  for test_id, outcome, seconds, cycles, _ in sorted(outcomes):
+    print(f'{seconds:8.3f}s {cycles:>12} cycles  {outcome:5}  {test_id}')
+  for test_id, outcome, _, _, details in failed:
+    print(f'\n{outcome}: {test_id}\n{details}')
+  print(f'{len(outcomes)} tests, {len(failed)} failed, '
+        f'{sum(outcome[3] for outcome in outcomes)} cycles in {wall:.2f}s wall')
+  return 1 if failed else 0
+
+
+def _flatten(suite):
+  for test in suite:
+    if isinstance(test, unittest.TestSuite):
+      yield from _flatten(test)
+    else:
+      yield test
+
+
 if __name__ == "__main__":
-  unittest.main()
+  sys.exit(main())
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Runs a chess engine over EPD test suites and scores its moves.
+
+Positions are searched on a process pool and scored by their ops: STS-style
+c0 "move=points" lists, else 1 point for playing a bm move (and avoiding
+every am move).  Results are cached by engine build and EPD line, so a rerun
+only searches positions whose engine or input changed.  For example,
+
+  python bench.py --engine test --depth 3 STS1 STS2
+  python bench.py --engine test --option ordering STS1
+  python bench.py --option deepening --option pvs --option aspiration STS1 STS2
+  python bench.py --engine eniac --jobs 4 --output eniac.jsonl bk wacnew
+  python bench.py --shard 0/4 Midgames1000
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+from subprocess import run
+from typing import Optional
+
+import vm
+from epd import EpdIndex, suite_path
+from game import Move, Position
+import testengine
+from uciengine import SearchLimits
+
+engines = ["test", "eniac", "chsim"]
+
+# Files whose contents decide what each engine plays.
+_engine_sources = {
+  "test": ["testengine.py", "game.py", "uciengine.py"],
+  "eniac": ["libclient.so"],
+  "chsim": ["chsim/chsim", "chess.e"],
+}
+
+def _move_ordering(engine):
+  engine.move_ordering = testengine.MoveOrdering()
+
+def _pvs(engine):
+  engine.pvs = True
+
+def _deepening(engine):
+  engine.faithful = False
+
+def _aspiration(engine):
+  engine.faithful = False
+  engine.aspiration_window = 3
+
+# TestEngine variations to choose from with --option.
+test_options = {
+  "ordering": _move_ordering,
+  "pvs": _pvs,
+  "deepening": _deepening,
+  "aspiration": _aspiration,
+}
+
+
+@dataclass
+class BenchResult:
+  suite: str
+  line: int
+  epd: str
+  id: Optional[str]
+  move: Optional[str]  # long algebraic, None if the engine resigned
+  points: int
+  max_points: int
+  seconds: float
+  nodes: Optional[int] = None   # leaves searched, for TestEngine
+  cycles: Optional[int] = None  # VM cycles, for ENIAC
+  cached: bool = False
+
+  @property
+  def solved(self):
+    return self.points == self.max_points
+
+
+def build_hash(engine, depth=4, options=()):
+  """Returns a hash of everything that decides engine's moves."""
+  h = hashlib.sha256(f"{engine} depth {depth} {' '.join(sorted(options))}\n".encode())
+  for path in _engine_sources[engine]:
+    with open(path, "rb") as f:
+      h.update(f.read())
+  return h.hexdigest()[:16]
+
+
+def _parse_points(c0):
+  """Returns {san: points} for an STS c0 op like "f5=10, Be5+=2"."""
+  points = {}
+  for item in c0.split(","):
+    san, _, value = item.strip().rpartition("=")
+    if san and value.isdigit():
+      points[san] = int(value)
+  return points
+
+
+def _parse_moves(sans, position):
+  """Returns [(move, san)] for the SAN moves in sans that parse in position.
+
+  A few suites have ops that run together or comments in c0, which are
+  skipped.
+  """
+  moves = []
+  for san in sans:
+    try:
+      moves.append((Move.san(san, position), san))
+    except (AssertionError, ValueError):
+      pass
+  return moves
+
+
+def score(position, move):
+  """Returns (points, max_points) for playing move in an EPD position.
+
+  Positions with none of the c0, bm and am ops score (0, 0).
+  """
+  ops = position.ops
+  points = _parse_points(ops.get("c0", ""))
+  moves = _parse_moves(points, position)
+  if moves:
+    return (next((points[san] for m, san in moves if move and m == move), 0),
+            max(points[san] for _, san in moves))
+  best = _parse_moves(ops.get("bm", "").split(), position)
+  avoid = _parse_moves(ops.get("am", "").split(), position)
+  if not best and not avoid:
+    return 0, 0
+  ok = (move is not None and (not best or any(m == move for m, _ in best)) and
+        not any(m == move for m, _ in avoid))
+  return int(ok), 1
+
+
+class ResultCache(object):
+  """Search results on disk, keyed by engine build hash and EPD line.
+
+  The file holds one JSON object per line, and new results are appended as
+  they're put so an interrupted run keeps what it finished.
+  """
+  def __init__(self, path):
+    self.path = path
+    self.entries = {}
+    if path and os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          entry = json.loads(line)
+          self.entries[entry.pop("key")] = entry
+
+  @staticmethod
+  def key(build, epd):
+    return hashlib.sha256(f"{build}\n{epd}".encode()).hexdigest()
+
+  def get(self, build, epd):
+    return self.entries.get(ResultCache.key(build, epd))
+
+  def put(self, build, epd, entry):
+    key = ResultCache.key(build, epd)
+    self.entries[key] = entry
+    if self.path:
+      with open(self.path, "a") as f:
+        print(json.dumps(dict(key=key, **entry)), file=f)
+
+
+_worker_engine = None
+
+def _search_task(engine, epd, depth, max_cycles, options=()):
+  """Searches epd with engine, returning a cache entry.  Runs in a worker.
+
+  Each worker keeps one engine for all of its tasks with the same options.
+  """
+  global _worker_engine
+  position = Position.epd(epd)
+  start = time.perf_counter()
+  entry = {}
+  if engine == "test":
+    if _worker_engine is None or _worker_engine[0] != options:
+      test_engine = testengine.TestEngine()
+      for option in options:
+        test_options[option](test_engine)
+      _worker_engine = (options, test_engine)
+    test_engine = _worker_engine[1]
+    move = test_engine.evaluate(position, SearchLimits(depth=depth))
+    entry["nodes"] = test_engine.node_count
+  elif engine == "eniac":
+    from eniacengine import ClientSearch, load_client
+    if _worker_engine is None:
+      _worker_engine = (options, load_client("./libclient.so"))
+    search = ClientSearch(_worker_engine[1], str(position))
+    # Search on this thread; the pool already runs searches in parallel.
+    search.run()
+    move = Move.lan(search.move) if search.move else None
+    entry["cycles"] = search.cycles
+  else:
+    cards = "".join(f"{f:02}{g:02}{h}\n" for f, g, h in vm.position_deck(position))
+    result = run(["chsim/chsim", "-b", "chess.e"], input=f"{cards}run {max_cycles}\n",
+                 capture_output=True, text=True, check=True)
+    *output, done = result.stdout.split("\n")[:-1]
+    move = vm.output_move(position, output)
+    entry["cycles"] = int(done.split()[2])
+  entry["move"] = str(move) if move else None
+  entry["seconds"] = time.perf_counter() - start
+  return entry
+
+
+def run_suite(suite, lines, engine, executor, build, cache, depth=4, max_cycles=10**10,
+              options=()):
+  """Searches and scores (line number, epd) pairs from suite, yielding BenchResults.
+
+  options are names of test_options to apply to TestEngine.
+
+  Lines with an entry for build in cache are scored without searching, and
+  the rest are submitted to executor up front and cached as they finish.
+  """
+  jobs = []
+  for i, epd in lines:
+    entry = cache.get(build, epd)
+    future = None
+    if entry is None:
+      future = executor.submit(_search_task, engine, epd, depth, max_cycles, tuple(options))
+    jobs.append((i, epd, entry, future))
+  for i, epd, entry, future in jobs:
+    cached = entry is not None
+    if not cached:
+      entry = future.result()
+      cache.put(build, epd, entry)
+    position = Position.epd(epd)
+    move = Move.lan(entry["move"]) if entry["move"] else None
+    points, max_points = score(position, move)
+    yield BenchResult(suite=suite, line=i, epd=epd, id=position.ops.get("id"),
+                      move=entry["move"], points=points, max_points=max_points,
+                      seconds=entry["seconds"], nodes=entry.get("nodes"),
+                      cycles=entry.get("cycles"), cached=cached)
+
+
+def _shard(arg):
+  k, n = (int(x) for x in arg.split("/"))
+  if not 0 <= k < n:
+    raise argparse.ArgumentTypeError(f"shard {arg} is not k/n with 0 <= k < n")
+  return k, n
+
+
+def _format(result):
+  work = (f"{result.nodes:>9} nodes" if result.nodes is not None else
+          f"{result.cycles:>12} cycles" if result.cycles is not None else "")
+  return (f"{result.line:4} {result.move or 'none':6} {result.points:>2}/{result.max_points:<2} "
+          f"{result.seconds:8.2f}s{' (cached)' if result.cached else '         '} {work}  "
+          f"{result.id or ' '.join(result.epd.split()[:2])}")
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("suites", nargs="+",
+                      help="EPD files, or names of suites in benchmarks/ like STS1")
+  parser.add_argument("--engine", "-e", choices=engines, default="test")
+  parser.add_argument("--depth", "-d", type=int, default=4, help="TestEngine search depth")
+  parser.add_argument("--option", action="append", default=[], choices=sorted(test_options),
+                      help="search with a TestEngine variation")
+  parser.add_argument("--max-cycles", type=int, default=10**10,
+                      help="give up on a chsim search after this many cycles")
+  parser.add_argument("--line", "-l", type=int, action="append",
+                      help="only run the given (1-based) line of each suite")
+  parser.add_argument("--limit", "-n", type=int, help="only run the first n positions of each suite")
+  parser.add_argument("--id", action="append", help="only run the position with this id op")
+  parser.add_argument("--shard", type=_shard,
+                      help="only run the k'th of n equal parts of each suite, given as k/n")
+  parser.add_argument("--jobs", "-j", type=int, help="worker processes (default: all cores)")
+  parser.add_argument("--cache", default="/tmp/bench_cache.jsonl",
+                      help="file of cached results, or '' to not cache")
+  parser.add_argument("--output", "-o", help="write a JSON line for every result to this file")
+  args = parser.parse_args()
+
+  if args.engine == "eniac":
+    run("make libclient.so", shell=True, check=True)
+  elif args.engine == "chsim":
+    run("make -C chsim chsim && python chasm/chasm.py asm/chess.asm chess.e", shell=True,
+        check=True)
+  build = build_hash(args.engine, args.depth, args.option)
+  cache = ResultCache(args.cache)
+  output = open(args.output, "w") if args.output else None
+
+  unit = "nodes" if args.engine == "test" else "cycles"
+  start = time.perf_counter()
+  totals = [0, 0, 0]
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+    for suite in args.suites:
+      index = EpdIndex(suite_path(suite))
+      if args.id:
+        numbers = [index.find(id) for id in args.id]
+        lines = [next(index.lines(n, n + 1)) for n in sorted(set(numbers) - {None})]
+      else:
+        lines = list(index.lines(*index.shard(*args.shard) if args.shard else ()))
+      if args.line:
+        lines = [(i, line) for i, line in lines if i in args.line]
+      lines = lines[:args.limit]
+      name = os.path.splitext(os.path.basename(suite))[0]
+      print(name, flush=True)
+      points = max_points = solved = work = 0
+      seconds = 0.0
+      for result in run_suite(name, lines, args.engine, executor, build, cache,
+                              depth=args.depth, max_cycles=args.max_cycles,
+                              options=args.option):
+        print(_format(result), flush=True)
+        if output:
+          print(json.dumps(dict(asdict(result), build=build)), file=output, flush=True)
+        points += result.points
+        max_points += result.max_points
+        solved += result.solved and result.max_points > 0
+        seconds += result.seconds
+        work += result.nodes or result.cycles or 0
+      print(f"{name}: {points}/{max_points} points, {solved}/{len(lines)} solved, "
+            f"{seconds:.2f}s searching, {work} {unit}\n", flush=True)
+      totals[0] += points
+      totals[1] += max_points
+      totals[2] += work
+  if output:
+    output.close()
+  print(f"build {build}: {totals[0]}/{totals[1]} points, {totals[2]} {unit} in "
+        f"{time.perf_counter() - start:.2f}s wall")
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import concurrent.futures
+import os
+import tempfile
+import unittest
+from bench import *
+
+
+class TestScore(unittest.TestCase):
+  def testPoints(self):
+    p = Position.epd('1kr5/3n4/q3p2p/p2n2p1/PppB1P2/5BP1/1P2Q2P/3R2K1 w - - bm f5; '
+                     'id "Undermine.001"; c0 "f5=10, Be5+=2, Bf2=3, Bg4=2";')
+    self.assertEqual(score(p, Move.lan('f4f5')), (10, 10))
+    self.assertEqual(score(p, Move.lan('d4e5')), (2, 10))
+    self.assertEqual(score(p, Move.lan('d1d2')), (0, 10))
+    self.assertEqual(score(p, None), (0, 10))
+
+  def testBestAndAvoidMoves(self):
+    p = Position.epd('r1bqk2r/ppp2ppp/2n5/4P3/2Bp2n1/5N1P/PP1N1PP1/R2Q1RK1 b kq - '
+                     'id "CCR03"; bm Nh6; am Ne5;')
+    self.assertEqual(score(p, Move.lan('g4h6')), (1, 1))
+    self.assertEqual(score(p, Move.lan('g4e5')), (0, 1))
+    p = Position.epd('8/8/8/8/8/4k3/8/R3K3 w - - am Ra3; c0 "no points here";')
+    self.assertEqual(score(p, Move.lan('a1a2')), (1, 1))
+    self.assertEqual(score(p, Move.lan('a1a3')), (0, 1))
+
+  def testUnscored(self):
+    p = Position.epd('8/8/8/8/8/4k3/8/R3K3 w - - id "none";')
+    self.assertEqual(score(p, Move.lan('a1a2')), (0, 0))
+
+
+class TestRunSuite(unittest.TestCase):
+  lines = [(1, '4k3/4P3/3PK3/8/8/8/8/8 w - - bm d7#; id "mate";'),
+           (3, '4k3/8/4K3/8/8/8/8/7R w - - bm Rh8#; id "mate2";')]
+
+  def setUp(self):
+    self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+    self.scratch = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.executor.shutdown()
+    self.scratch.cleanup()
+
+  def testCachesResults(self):
+    path = os.path.join(self.scratch.name, 'cache.jsonl')
+    results = list(run_suite('mates', self.lines, 'test', self.executor, 'build1',
+                             ResultCache(path), depth=2))
+    self.assertEqual([(r.line, r.move, r.points, r.cached) for r in results],
+                     [(1, 'd6d7', 1, False), (3, 'h1h8', 1, False)])
+    self.assertTrue(all(r.nodes is not None for r in results))
+    results = list(run_suite('mates', self.lines, 'test', self.executor, 'build1',
+                             ResultCache(path), depth=2))
+    self.assertEqual([(r.move, r.cached) for r in results], [('d6d7', True), ('h1h8', True)])
+    # Another build searches again.
+    results = list(run_suite('mates', self.lines[:1], 'test', self.executor, 'build2',
+                             ResultCache(path), depth=2))
+    self.assertFalse(results[0].cached)
+
+  def testBuildHash(self):
+    self.assertEqual(build_hash('test', 4), build_hash('test', 4))
+    self.assertNotEqual(build_hash('test', 4), build_hash('test', 3))
+    self.assertNotEqual(build_hash('test', 4), build_hash('test', 4, ['ordering']))
+
+
+if __name__ == '__main__':
+  unittest.main()
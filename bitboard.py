@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""A fast bitboard move generator which can stand in for ReferenceMoveGen."""
+
+from game import (Square, Move, make_move, empty, white_pieces, black_pieces,
+                  rook, knight, bishop, queen, king, pawn,
+                  queen_deltas, king_deltas, knight_deltas)
+
+# Squares are numbered 0 (a1) to 63 (h8), so bit i of a bitboard is the square
+# at x = i % 8 + 1, y = i // 8 + 1.
+_squares = [Square(x=i % 8 + 1, y=i // 8 + 1) for i in range(64)]
+
+def _index(x, y):
+  return 8 * (y - 1) + (x - 1)
+
+def _targets(i, deltas):
+  x, y = i % 8 + 1, i // 8 + 1
+  return tuple(_index(x + dx, y + dy) for dx, dy in deltas
+               if 1 <= x + dx <= 8 and 1 <= y + dy <= 8)
+
+def _mask(indices):
+  bits = 0
+  for i in indices:
+    bits |= 1 << i
+  return bits
+
+# Knight and king targets are listed in ReferenceMoveGen's delta order so that
+# moves are generated in the same order.
+_knight_targets = [_targets(i, knight_deltas) for i in range(64)]
+_king_targets = [_targets(i, king_deltas) for i in range(64)]
+_knight_attacks = [_mask(t) for t in _knight_targets]
+_king_attacks = [_mask(t) for t in _king_targets]
+# _pawn_attacks[color][i] are the squares a pawn of color on i attacks, which
+# is also where enemy pawns attacking i would be.
+_pawn_attacks = [[_mask(_targets(i, [(-1, 1), (1, 1)])) for i in range(64)],
+                 [_mask(_targets(i, [(-1, -1), (1, -1)])) for i in range(64)]]
+
+# Rays indexed by queen_deltas, so directions 0-3 are rook moves and 4-7 are
+# bishop moves.  _rays[d][i] has all squares from i towards the edge.
+def _ray(i, dx, dy):
+  x, y = i % 8 + 1, i // 8 + 1
+  ray = []
+  while 1 <= x + dx <= 8 and 1 <= y + dy <= 8:
+    x += dx; y += dy
+    ray.append(_index(x, y))
+  return _mask(ray)
+
+_rays = [[_ray(i, dx, dy) for i in range(64)] for dx, dy in queen_deltas]
+# True if squares along direction d have increasing indices.
+_ascending = [8 * dy + dx > 0 for dx, dy in queen_deltas]
+_rook_dirs = (0, 1, 2, 3)
+_bishop_dirs = (4, 5, 6, 7)
+_queen_dirs = _rook_dirs + _bishop_dirs
+_rook_lines = [_rays[0][i] | _rays[1][i] | _rays[2][i] | _rays[3][i] for i in range(64)]
+_bishop_lines = [_rays[4][i] | _rays[5][i] | _rays[6][i] | _rays[7][i] for i in range(64)]
+
+def _ray_attacks(d, i, occupied):
+  """Returns squares attacked from i in direction d, up to the first blocker."""
+  ray = _rays[d][i]
+  blockers = ray & occupied
+  if blockers:
+    if _ascending[d]:
+      first = (blockers & -blockers).bit_length() - 1
+    else:
+      first = blockers.bit_length() - 1
+    ray ^= _rays[d][first]
+  return ray
+
+def _lsb(bits):
+  return (bits & -bits).bit_length() - 1
+
+# Piece letters map to (color, piece type), white is 0 and black is 1.
+_piece_info = {}
+for _color, _pieces in enumerate((white_pieces, black_pieces)):
+  for _type, _piece in enumerate(_pieces):
+    _piece_info[_piece] = (_color, _type)
+
+# Kinds of moves.
+_NORMAL, _EN_PASSANT, _CASTLING = range(3)
+
+# Castling moves as (king from, king to, rook from, rook to, right).
+_castling_moves = [
+  (_index(5, 1), _index(7, 1), _index(8, 1), _index(6, 1), "K"),
+  (_index(5, 1), _index(3, 1), _index(1, 1), _index(4, 1), "Q"),
+  (_index(5, 8), _index(7, 8), _index(8, 8), _index(6, 8), "k"),
+  (_index(5, 8), _index(3, 8), _index(1, 8), _index(4, 8), "q"),
+]
+_castling_rook_moves = {kt: (rf, rt) for kf, kt, rf, rt, right in _castling_moves}
+# Moving from or to these squares loses castling rights, see
+# _update_castling_eligibility in game.py.
+_castling_spoilers = {_index(8, 1): "K", _index(1, 1): "Q",
+                      _index(8, 8): "k", _index(1, 8): "q",
+                      _index(5, 1): "KQ", _index(5, 8): "kq"}
+
+
+class _Bitboards(object):
+  """Board state for BitboardMoveGen.
+
+  pieces[color][piece type] and occupied[color] are bitboards, and mailbox has
+  the piece letter for each square for finding what was captured.
+  """
+  __slots__ = ("pieces", "occupied", "mailbox", "color", "castling", "ep")
+
+  def __init__(self, position):
+    self.pieces = [[0] * 6, [0] * 6]
+    self.occupied = [0, 0]
+    self.mailbox = [empty] * 64
+    for square, piece in position.board:
+      _put(self, _index(square.x, square.y), piece)
+    self.color = 0 if position.to_move == "w" else 1
+    self.castling = position.castling
+    self.ep = (_index(position.ep_target.x, position.ep_target.y)
+               if position.ep_target else -1)
+
+def _put(state, i, piece):
+  color, piece_type = _piece_info[piece]
+  bit = 1 << i
+  state.pieces[color][piece_type] |= bit
+  state.occupied[color] |= bit
+  state.mailbox[i] = piece
+
+def _remove(state, i, piece):
+  color, piece_type = _piece_info[piece]
+  bit = 1 << i
+  state.pieces[color][piece_type] ^= bit
+  state.occupied[color] ^= bit
+  state.mailbox[i] = empty
+
+def _attacked(i, enemy, occupied, exclude, color):
+  """Returns true if the player color's square i is attacked by enemy pieces.
+
+  enemy are the enemy piece bitboards, and exclude masks a captured piece.
+  Like ReferenceMoveGen._threatened, this ignores en passant captures.
+  """
+  keep = ~exclude
+  if _knight_attacks[i] & enemy[knight] & keep:
+    return True
+  if _pawn_attacks[color][i] & enemy[pawn] & keep:
+    return True
+  if _king_attacks[i] & enemy[king]:
+    return True
+  sliders = (enemy[rook] | enemy[queen]) & keep
+  if sliders & _rook_lines[i]:
+    for d in _rook_dirs:
+      if _ray_attacks(d, i, occupied) & sliders:
+        return True
+  sliders = (enemy[bishop] | enemy[queen]) & keep
+  if sliders & _bishop_lines[i]:
+    for d in _bishop_dirs:
+      if _ray_attacks(d, i, occupied) & sliders:
+        return True
+  return False
+
+def _pinned(i, own, enemy, occupied):
+  """Returns a bitboard of own pieces pinned to the king on square i."""
+  pinned = 0
+  for d in _queen_dirs:
+    sliders = enemy[rook] | enemy[queen] if d < 4 else enemy[bishop] | enemy[queen]
+    if not _rays[d][i] & sliders:
+      continue
+    first = _ray_attacks(d, i, occupied) & occupied
+    if first & own:
+      behind = _ray_attacks(d, first.bit_length() - 1, occupied) & occupied
+      if behind & sliders:
+        pinned |= first
+  return pinned
+
+
+class BitboardMoveGen(object):
+  """A bitboard move generator with the same interface as ReferenceMoveGen.
+
+  Moves are generated in the same order as ReferenceMoveGen, so engines using
+  it search the same tree.  perft() counts moves on bitboards directly, which
+  is much faster than building a Position for every node.
+  """
+  def __init__(self,
+               ignore_check=False,
+               allow_castling=True,
+               allow_en_passant_captures=True,
+               allowed_promotions="rnbq"):
+    self.ignore_check = ignore_check
+    self.allow_castling = allow_castling
+    self.allow_en_passant_captures = allow_en_passant_captures
+    self.allowed_promotions = allowed_promotions
+
+  def legal_moves(self, position):
+    """Yields all legal moves and next positions for a given position.
+
+    Like ReferenceMoveGen, if position.board.make_in_place then each next
+    position is position itself with the move made in place.
+    """
+    in_place = position.board.make_in_place
+    for f, t, promo, kind in self._generate(_Bitboards(position)):
+      if kind == _CASTLING:
+        move = _castling_move_for[t]
+      else:
+        move = Move(fro=_squares[f], to=_squares[t], promo=promo)
+      if not in_place:
+        yield (move, make_move(position, move))
+        continue
+      position.make(move)
+      try:
+        yield (move, position)
+      finally:
+        position.unmake()
+
+  def perft(self, position, depth=1):
+    """Counts leaf nodes depth plies from position, like game.perft."""
+    return self._perft(_Bitboards(position), depth)
+
+  def _perft(self, state, depth):
+    if depth == 0:
+      return 1
+    moves = self._generate(state)
+    if depth == 1:
+      return len(moves)
+    count = 0
+    for move in moves:
+      undo = _make(state, move)
+      count += self._perft(state, depth - 1)
+      _unmake(state, move, undo)
+    return count
+
+  def _generate(self, state):
+    """Returns a list of legal moves as (from, to, promo, kind) tuples."""
+    color = state.color
+    own = state.pieces[color]
+    enemy = state.pieces[1 - color]
+    own_occupied = state.occupied[color]
+    enemy_occupied = state.occupied[1 - color]
+    occupied = own_occupied | enemy_occupied
+    mailbox = state.mailbox
+    king_square = _lsb(own[king])
+    check = not self.ignore_check
+    if check:
+      in_check = _attacked(king_square, enemy, occupied, 0, color)
+      pinned = _pinned(king_square, own_occupied, enemy, occupied)
+    moves = []
+    pieces = own_occupied
+    while pieces:
+      bit = pieces & -pieces
+      pieces ^= bit
+      f = bit.bit_length() - 1
+      piece_type = _piece_info[mailbox[f]][1]
+      # Moves by pieces that aren't pinned can't expose the king unless it's
+      # already in check.
+      safe = not check or not (in_check or pinned & bit)
+      if piece_type == pawn:
+        self._pawn_moves(state, moves, f, color, occupied, enemy_occupied,
+                         safe, check, king_square)
+      elif piece_type == knight:
+        for t in _knight_targets[f]:
+          if not (own_occupied >> t) & 1:
+            if safe or self._safe(state, f, t, _NORMAL, king_square):
+              moves.append((f, t, "", _NORMAL))
+      elif piece_type == king:
+        for t in _king_targets[f]:
+          if not (own_occupied >> t) & 1:
+            if not check or self._safe(state, f, t, _NORMAL, t):
+              moves.append((f, t, "", _NORMAL))
+      else:
+        directions = (_rook_dirs if piece_type == rook else
+                      _bishop_dirs if piece_type == bishop else
+                      _queen_dirs)
+        for d in directions:
+          targets = _ray_attacks(d, f, occupied) & ~own_occupied
+          ascending = _ascending[d]
+          while targets:
+            if ascending:
+              t = (targets & -targets).bit_length() - 1
+            else:
+              t = targets.bit_length() - 1
+            targets ^= 1 << t
+            if safe or self._safe(state, f, t, _NORMAL, king_square):
+              moves.append((f, t, "", _NORMAL))
+    if self.allow_castling and state.castling:
+      self._castling_moves(state, moves, color, enemy, occupied)
+    return moves
+
+  def _pawn_moves(self, state, moves, f, color, occupied, enemy_occupied,
+                  safe, check, king_square):
+    forward = 8 if color == 0 else -8
+    rank = f // 8
+    t = f + forward
+    if not (occupied >> t) & 1:
+      if safe or self._safe(state, f, t, _NORMAL, king_square):
+        self._pawn_push(moves, f, t, _NORMAL)
+      t += forward
+      if rank == (1 if color == 0 else 6) and not (occupied >> t) & 1:
+        if safe or self._safe(state, f, t, _NORMAL, king_square):
+          self._pawn_push(moves, f, t, _NORMAL)
+    x = f % 8
+    for dx in (-1, 1):
+      if not 0 <= x + dx <= 7:
+        continue
+      t = f + forward + dx
+      if (enemy_occupied >> t) & 1:
+        if safe or self._safe(state, f, t, _NORMAL, king_square):
+          self._pawn_push(moves, f, t, _NORMAL)
+      if self.allow_en_passant_captures and t == state.ep:
+        passed = state.mailbox[t - forward]
+        if passed in "Pp" and _piece_info[passed][0] != color:
+          if not check or self._safe(state, f, t, _EN_PASSANT, king_square):
+            self._pawn_push(moves, f, t, _EN_PASSANT)
+
+  def _pawn_push(self, moves, f, t, kind):
+    if t < 8 or t >= 56:
+      for promo in self.allowed_promotions:
+        moves.append((f, t, promo, kind))
+    else:
+      moves.append((f, t, "", kind))
+
+  def _castling_moves(self, state, moves, color, enemy, occupied):
+    # Can't castle out of check or through an occupied or attacked square.
+    for kf, kt, rf, rt, right in _castling_moves[2 * color:2 * color + 2]:
+      if right not in state.castling:
+        continue
+      between = _mask(range(min(kf, rf) + 1, max(kf, rf)))
+      if occupied & between:
+        continue
+      step = 1 if kt > kf else -1
+      if any(_attacked(i, enemy, occupied, 0, color) for i in range(kf, kt + step, step)):
+        continue
+      moves.append((kf, kt, "", _CASTLING))
+
+  def _safe(self, state, f, t, kind, king_square):
+    """Returns true if moving from f to t doesn't leave the king attacked."""
+    color = state.color
+    occupied = state.occupied[0] | state.occupied[1]
+    captured = 1 << t
+    occupied = (occupied & ~(1 << f)) | captured
+    if kind == _EN_PASSANT:
+      captured = 1 << (t - 8 if color == 0 else t + 8)
+      occupied &= ~captured
+    return not _attacked(king_square, state.pieces[1 - color], occupied, captured, color)
+
+
+_castling_move_for = {
+  _index(7, 1): Move.white_oo,
+  _index(3, 1): Move.white_ooo,
+  _index(7, 8): Move.black_oo,
+  _index(3, 8): Move.black_ooo,
+}
+
+def _make(state, move):
+  """Makes move on state in place, returning what's needed to undo it."""
+  f, t, promo, kind = move
+  mailbox = state.mailbox
+  piece = mailbox[f]
+  capture_square = t
+  if kind == _EN_PASSANT:
+    capture_square = t - 8 if state.color == 0 else t + 8
+  captured = mailbox[capture_square]
+  undo = (piece, captured, capture_square, state.castling, state.ep)
+  if captured != empty:
+    _remove(state, capture_square, captured)
+  _remove(state, f, piece)
+  if promo:
+    _put(state, t, promo.upper() if state.color == 0 else promo)
+  else:
+    _put(state, t, piece)
+  if kind == _CASTLING:
+    rf, rt = _castling_rook_moves[t]
+    rook_piece = mailbox[rf]
+    _remove(state, rf, rook_piece)
+    _put(state, rt, rook_piece)
+  state.ep = (f + t) // 2 if piece in "Pp" and abs(t - f) == 16 else -1
+  if state.castling:
+    castling = state.castling
+    # Rights are only held while the king and rook are on their home squares,
+    # so any move from or to those squares loses them.
+    for i in (f, t):
+      for right in _castling_spoilers.get(i, ""):
+        castling = castling.replace(right, "")
+    state.castling = castling
+  state.color ^= 1
+  return undo
+
+def _unmake(state, move, undo):
+  """Takes back a move made with _make()."""
+  f, t, promo, kind = move
+  piece, captured, capture_square, state.castling, state.ep = undo
+  state.color ^= 1
+  if kind == _CASTLING:
+    rf, rt = _castling_rook_moves[t]
+    rook_piece = state.mailbox[rt]
+    _remove(state, rt, rook_piece)
+    _put(state, rf, rook_piece)
+  _remove(state, t, state.mailbox[t])
+  _put(state, f, piece)
+  if captured != empty:
+    _put(state, capture_square, captured)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import unittest
+import game_test
+from game import *
+from bitboard import BitboardMoveGen
+
+
+class TestBitboardMoveGen(game_test.TestReferenceMoveGen):
+  move_gen_type = BitboardMoveGen
+
+  def testPerftInitialDepth4(self):
+    p = self.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    self.assertEqual(perft(p, self.move_gen, depth=4), 197281)
+
+  def testPerftSuite(self):
+    # Run every perftsuite position to a depth with a modest node count.
+    with open("benchmarks/perftsuite.epd") as f:
+      for line in f:
+        fen, _, ops = line.partition(" D1")
+        counts = [int(op.split()[-1]) for op in ("D1" + ops).split(";") if op.strip()]
+        p = self.fen(fen + " 0 1")
+        for depth, count in enumerate(counts, 1):
+          if count > 50000:
+            break
+          self.assertEqual(perft(p, self.move_gen, depth=depth), count, fen)
+
+  def testSameMovesAsReference(self):
+    # Engines rely on move order, so check it matches the reference exactly.
+    fens = [
+      "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+      "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0",
+      "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+      "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+      "rnbqkb1r/pp1p1ppp/5n2/2pPp3/8/8/PPP1PPPP/RNBQKBNR w KQkq e6 0 1",
+      "k1q5/1R6/K7/8/8/8/8/8 w - - 0 1",
+    ]
+    for ignore_check in (False, True):
+      reference = ReferenceMoveGen(ignore_check=ignore_check)
+      move_gen = BitboardMoveGen(ignore_check=ignore_check)
+      for fen in fens:
+        expected = [(str(m), str(p2)) for m, p2 in reference.legal_moves(self.fen(fen))]
+        actual = [(str(m), str(p2)) for m, p2 in move_gen.legal_moves(self.fen(fen))]
+        self.assertEqual(actual, expected, fen)
+
+
+class TestBitboardMoveGenMailbox(game_test.TestReferenceMoveGenMailbox):
+  move_gen_type = BitboardMoveGen
+
+
+if __name__ == "__main__":
+  unittest.main()
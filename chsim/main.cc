@@ -5,6 +5,7 @@
 #include <signal.h>
 #include <stdlib.h>
 #include <string.h>
+#include <string>
 
 #include "vm.cc"
 
@@ -14,9 +15,11 @@ static FILE* deck_file = nullptr;
 const char* program_filename = nullptr;
 static bool interrupted = false;
 static int test_cycles = 0;
+static bool batch_mode = false;
+const char* profile_filename = nullptr;
 
 static void usage() {
-  fprintf(stderr, "Usage: chsim [-f data.deck] [-t cycles] program.e\n");
+  fprintf(stderr, "Usage: chsim [-f data.deck] [-t cycles] [-b] [-p profile.txt] program.e\n");
   exit(1);
 }
 
@@ -248,7 +251,9 @@ static void step_and_handle_status(VM* vm) {
   if (vm->status & IO_PRINT) {
     printf("%02d%02d\n", drop_sign(vm->a), vm->b);
     fflush(stdout);
-    fprintf(output_file, "%02d%02d\n", drop_sign(vm->a), vm->b);
+    if (output_file) {
+      fprintf(output_file, "%02d%02d\n", drop_sign(vm->a), vm->b);
+    }
     vm->status &= ~IO_PRINT;
   }
 }
@@ -262,6 +267,11 @@ static void parse_command_line(int argc, char **argv) {
     } else if (strcmp(argv[i], "-t") == 0) {
       if (i == argc-1) usage();
       test_cycles = atoi(argv[++i]);
+    } else if (strcmp(argv[i], "-b") == 0) {
+      batch_mode = true;
+    } else if (strcmp(argv[i], "-p") == 0) {
+      if (i == argc-1) usage();
+      profile_filename = argv[++i];
     } else if (i == argc-1) {
       program_filename = argv[i];
     }
@@ -269,6 +279,60 @@ static void parse_command_line(int argc, char **argv) {
   if (program_filename == nullptr) usage();
 }
 
+// batch mode for unit tests
+// Reads decks from stdin, each followed by a line "run <cycles>", and runs
+// each deck from reset for at most that many cycles or until halt/brk.  The
+// program is loaded only once.  After anything the program prints, writes
+// "done <status> <cycles> <instructions>" where status is halt, break, error
+// or timeout.
+// With -p, also writes the profile counts of all decks to profile_filename
+// as lines "<pc> <ir_index> <count>", with pc and ir_index as sampled before
+// each step, i.e. not adjusted as in dump_profile.
+static void run_batch(const VM& loaded) {
+  static unsigned long long totals[400][7];
+  std::string deck;
+  char* line = nullptr;
+  size_t cap = 0;
+  while (getline(&line, &cap, stdin) > 0) {
+    unsigned long long max_cycles;
+    if (sscanf(line, "run %llu", &max_cycles) != 1) {
+      deck += line;
+      continue;
+    }
+    // fmemopen() doesn't accept empty buffers.
+    deck += "\n";
+    deck_file = fmemopen((void*)deck.data(), deck.size(), "r");
+    VM* vm = new VM(loaded);
+    while (vm->cycles < max_cycles && !vm->error && !(vm->status & (BREAK|HALT))) {
+      step_and_handle_status(vm);
+    }
+    const char* status = vm->error ? "error" :
+                         (vm->status & HALT) ? "halt" :
+                         (vm->status & BREAK) ? "break" : "timeout";
+    printf("done %s %llu %llu\n", status, vm->cycles, vm->instructions);
+    fflush(stdout);
+    for (int pc = 0; pc < 400; pc++)
+      for (int i = 0; i < 7; i++)
+        totals[pc][i] += vm->profile[pc][i];
+    delete vm;
+    fclose(deck_file);
+    deck.clear();
+  }
+  free(line);
+  if (profile_filename) {
+    FILE* fp = fopen(profile_filename, "w");
+    if (!fp) {
+      fprintf(stderr, "could not open %s\n", profile_filename);
+      exit(1);
+    }
+    for (int pc = 0; pc < 400; pc++)
+      for (int i = 0; i < 7; i++)
+        if (totals[pc][i] > 0)
+          fprintf(fp, "%d %d %llu\n", pc, i, totals[pc][i]);
+    fclose(fp);
+  }
+}
+
 int main(int argc, char *argv[]) {
   parse_command_line(argc, argv);
 
@@ -278,6 +342,11 @@ int main(int argc, char *argv[]) {
     exit(1);
   }
 
+  if (batch_mode) {
+    run_batch(vm);
+    return 0;
+  }
+
   // open deck file if specified, otherwise read from stdin
   if (deck_filename != nullptr) {
     deck_file = fopen(deck_filename, "r");
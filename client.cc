@@ -14,6 +14,18 @@
 // there is an error or ENIAC resigns, return the empty string.
 std::string eniac_chess_move(const std::string& fen);
 
+// C entry point for loading the client as a shared library (see Makefile).
+// Like eniac_chess_move(), but writes the move to move (a buffer of size
+// move_size) and the VM cycles and instructions used to cycles_used and
+// instructions_used. The search stops early if *cancel becomes nonzero, in
+// which case move is the best move found so far (or empty) and 0 is
+// returned. Returns 1 if the search ran to completion. Safe to call from
+// several threads at once.
+extern "C" int eniac_chess_search(const char* fen, char* move, int move_size,
+                                  const volatile int* cancel,
+                                  unsigned long long* cycles_used,
+                                  unsigned long long* instructions_used);
+
 namespace {
 // Generated by chasm.py, see Makefile.
 #include "chess_data.cc"
@@ -46,14 +58,13 @@ struct VM {
   int function_table[400][6];
 };
 
+// Counted per thread so library searches can run concurrently.
+thread_local unsigned long long cycles;
+thread_local unsigned long long instructions;
+#define ADD_CYCLES(c) cycles += (c)
 #ifdef MAIN
-unsigned long long cycles;
-unsigned long long instructions;
 unsigned long long profile[400][7];
 unsigned long long turns;
-#define ADD_CYCLES(c) cycles += (c)
-#else
-#define ADD_CYCLES(c) (void)(c)
 #endif
 
 enum {
@@ -262,9 +273,7 @@ void step_one_instruction(VM* vm) {
   if (opcode == 99) {
     fetch_cost = 0;
   } else {
-    #ifdef MAIN
     instructions++;
-    #endif
   }
   ADD_CYCLES(fetch_cost);
   switch (opcode) {
@@ -747,7 +756,9 @@ std::string convert_move_to_lan(const Position& position, int from, int to) {
   int from_x = from % 10;
   int to_y = to / 10;
   int to_x = to % 10;
-  if (from_y >= 1 && from_y <= 8 && to_y >= 1 && to_y <= 8) {
+  // 0000 means ENIAC resigned (or, mid-search, hasn't chosen a move yet).
+  if (from_y >= 1 && from_y <= 8 && from_x >= 1 && from_x <= 8 &&
+      to_y >= 1 && to_y <= 8 && to_x >= 1 && to_x <= 8) {
     const char* files = "?abcdefgh";
     const char* ranks = "?12345678";
     char move[5] = {files[from_x], ranks[from_y], files[to_x], ranks[to_y], 0};
@@ -765,7 +776,13 @@ std::string convert_move_to_lan(const Position& position, int from, int to) {
 }
 }
 
-std::string eniac_chess_move(const std::string& fen) {
+namespace {
+// Addresses of ENIAC's best move at the top level of search, from
+// memory_layout.asm.
+const int bestfrom = 73;
+const int bestto = 74;
+
+std::string search(const std::string& fen, const volatile int* cancel, bool* cancelled) {
   Position position;
   if (!parse_fen(fen, position)) {
     return "";
@@ -776,6 +793,12 @@ std::string eniac_chess_move(const std::string& fen) {
   VM vm;
   init(&vm);
   while (!(vm.status & IO_PRINT)) {
+    if (cancel && *cancel) {
+      *cancelled = true;
+      return convert_move_to_lan(position,
+                                 drop_sign(vm.mem[bestfrom / 5][bestfrom % 5]),
+                                 drop_sign(vm.mem[bestto / 5][bestto % 5]));
+    }
     step_one_instruction(&vm);
     if (vm.error != 0) {
       return "";
@@ -798,6 +821,26 @@ std::string eniac_chess_move(const std::string& fen) {
 
   return convert_move_to_lan(position, drop_sign(vm.a), vm.b);
 }
+}
+
+std::string eniac_chess_move(const std::string& fen) {
+  bool cancelled = false;
+  return search(fen, nullptr, &cancelled);
+}
+
+extern "C" int eniac_chess_search(const char* fen, char* move, int move_size,
+                                  const volatile int* cancel,
+                                  unsigned long long* cycles_used,
+                                  unsigned long long* instructions_used) {
+  unsigned long long start_cycles = cycles;
+  unsigned long long start_instructions = instructions;
+  bool cancelled = false;
+  std::string result = search(fen, cancel, &cancelled);
+  snprintf(move, move_size, "%s", result.c_str());
+  *cycles_used = cycles - start_cycles;
+  *instructions_used = instructions - start_instructions;
+  return cancelled ? 0 : 1;
+}
 
 #ifdef MAIN
 int main() {
@@ -812,8 +855,12 @@ int main() {
   size_t cap = 0;
   while (getline(&line, &cap, stdin) > 0) {
     std::string fen = std::string(line);
+    unsigned long long start_cycles = cycles;
+    unsigned long long start_instructions = instructions;
     std::string move = eniac_chess_move(fen);
-    printf("%s\n", move.c_str());
+    // Report the move followed by VM cycles and instructions used to find it.
+    printf("%s %llu %llu\n", move.c_str(), cycles - start_cycles,
+           instructions - start_instructions);
     fflush(stdout);
   }
   free(line);
@@ -37,7 +37,7 @@ with open('/tmp/debug', 'r') as f:
   alpha, beta = '', ''
   for num, line in enumerate(f.readlines()):
     line = line.strip()
-    if line[:2] == '99':
+    if part == 0 and line[:2] == '99':
       pop = True
       part = 0
     elif part == 0:
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Checks TestEngine's search against ENIAC's, move by move.
+
+Runs asm/chess.asm on the Python VM in lock step with a faithful TestEngine
+search of the same position, and stops at the first move where the two
+disagree on the move tried, its ply, or alpha and beta, e.g.
+
+  python diff_search.py --max-moves 20000 benchmarks/bk.epd
+"""
+import argparse
+import sys
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import vm
+from chasm.chasm import Assembler
+from epd import read_lines
+from game import MailboxBoard, Move, Position, Square, legal_move_list
+from testengine import TestEngine
+
+
+@dataclass
+class SearchMove:
+  """A move tried by a search, with alpha and beta when it was tried."""
+  ply: int
+  move: str  # FFTT, as printed by ENIAC
+  alpha: int
+  beta: int
+  legal: bool = True
+
+  def __str__(self):
+    return (f"{self.move}{'' if self.legal else ' (illegal)'} at ply {self.ply} "
+            f"alpha {self.alpha} beta {self.beta}")
+
+
+@dataclass
+class Divergence:
+  """Where two searches of fen first disagree, after matched moves.
+
+  line is the moves leading to the ply where they disagree, and engine or vm
+  is None if that search had stopped.  If both searches tried the same moves
+  but chose different ones, engine and vm are the chosen moves at ply 1.
+  """
+  fen: str
+  matched: int
+  engine: Optional[SearchMove]
+  vm: Optional[SearchMove]
+  line: List[str] = field(default_factory=list)
+
+  def __str__(self):
+    return (f"{self.fen}: after {self.matched} moves, line {' '.join(self.line) or '-'}\n"
+            f"  TestEngine tried {self.engine or 'nothing'}\n"
+            f"  ENIAC tried      {self.vm or 'nothing'}")
+
+
+def _numeric(move):
+  return f"{move.fro.y}{move.fro.x}{move.to.y}{move.to.x}"
+
+
+def assemble(source="asm/chess.asm"):
+  """Returns the vm.Program and labels of an assembled chess program."""
+  out = Assembler(print_errors=False).assemble(source)
+  if out.errors:
+    raise ValueError("\n".join(out.errors))
+  return vm.Program(vm.output_program(out)), out.context.labels
+
+
+class VMSearch(object):
+  """Runs the ENIAC search of position and yields each move it tries.
+
+  A move is reported when the VM reaches output_move with it, which is where
+  TestEngine logs moves.  ENIAC generates pseudo-legal moves and only learns
+  a move before the last ply was illegal by finding a king capture in reply,
+  so those moves and the replies searched under them are skipped to match
+  TestEngine's legal move generation.  Illegal moves at the last ply are
+  really searched, so they are reported with legal set to False.  move_gen
+  decides what is legal.
+  """
+  # Search stack depth, as MAXD in memory_layout.asm
+  max_depth = 4
+
+  def __init__(self, program, labels, position, move_gen):
+    self.machine = vm.VM(program, vm.position_deck(position))
+    self.output_move = labels["output_move"]
+    self.position = position.with_board_type(MailboxBoard)
+    self.move_gen = move_gen
+    # Moves made on self.position to reach the ply being searched
+    self.line = []
+    # Legal moves at each ply of line, computed when first needed
+    self._legal = [None]
+
+  def _word(self, address):
+    return vm._drop_sign(self.machine.mem[address // 5][address % 5])
+
+  def __iter__(self):
+    machine = self.machine
+    skip_below = None
+    while not machine.status & (vm.HALT | vm.BREAK | vm.IO_PRINT):
+      if machine.pc != self.output_move or machine.ir_index != 6:
+        machine.step()
+        continue
+      machine.step()
+      ply = self._word(38)
+      if skip_below is not None:
+        if ply > skip_below:
+          continue
+        skip_below = None
+      while len(self.line) >= ply:
+        self.position.unmake()
+        self.line.pop()
+        self._legal.pop()
+      fro, to = self._word(47), self._word(48)
+      move = self._move(fro, to)
+      legal = move in self._legal_moves()
+      if ply < self.max_depth and not legal:
+        skip_below = ply
+        continue
+      yield SearchMove(ply, f"{fro:02}{to:02}", self._word(64 + ply), self._word(68 + ply), legal)
+      if ply < self.max_depth:
+        self.position.make(move)
+        self.line.append(str(move))
+        self._legal.append(None)
+
+  def _legal_moves(self):
+    if self._legal[-1] is None:
+      self._legal[-1] = legal_move_list(self.position, self.move_gen)
+    return self._legal[-1]
+
+  def _move(self, fro, to):
+    fro = Square(y=fro // 10, x=fro % 10)
+    to = Square(y=to // 10, x=to % 10)
+    piece = self.position.board[fro]
+    promo = "q" if piece in "pP" and to.y in (1, 8) else ""
+    return Move(fro, to, promo)
+
+  @property
+  def best_move(self):
+    """The move ENIAC printed, or None."""
+    output = self.machine.output
+    return output[-1] if output else None
+
+
+class _Stop(Exception):
+  pass
+
+
+def check(position, program=None, labels=None, max_moves=None, bounds=True, engine=None):
+  """Searches position with TestEngine and ENIAC in lock step.
+
+  Returns (matched, divergence), where matched counts the moves both tried
+  and divergence is a Divergence, or None if the searches agreed.  With
+  max_moves, stops after that many moves.  Unless bounds is set, only moves
+  and plies are compared, not alpha and beta.  engine can be a TestEngine
+  configured for the check; it searches faithfully and serially, and its
+  settings are restored afterwards.
+  """
+  if program is None:
+    program, labels = assemble()
+  engine = engine or TestEngine()
+  search = VMSearch(program, labels, position, engine.move_gen)
+  moves = iter(search)
+  matched = 0
+  divergence = None
+
+  def trace(depth, move, alpha, beta):
+    nonlocal matched, divergence
+    if max_moves is not None and matched >= max_moves:
+      raise _Stop()
+    ply = VMSearch.max_depth - depth + 1
+    engine_move = SearchMove(ply, _numeric(move), alpha, beta)
+    vm_move = next(moves, None)
+    if (engine_move != vm_move if bounds else
+        not vm_move or (engine_move.ply, engine_move.move) != (vm_move.ply, vm_move.move)):
+      divergence = Divergence(str(position), matched, engine_move, vm_move, list(search.line))
+      raise _Stop()
+    matched += 1
+
+  saved = engine.faithful, engine.executor, engine.trace
+  engine.faithful, engine.executor, engine.trace = True, None, trace
+  try:
+    best_move = engine.evaluate(position, depth=VMSearch.max_depth)
+  except _Stop:
+    return matched, divergence
+  finally:
+    engine.faithful, engine.executor, engine.trace = saved
+  vm_move = next(moves, None)
+  if vm_move:
+    return matched, Divergence(str(position), matched, None, vm_move, list(search.line))
+  engine_best = _numeric(best_move) if best_move else "0000"
+  if search.best_move != engine_best:
+    divergence = Divergence(str(position), matched, SearchMove(1, engine_best, 0, 99),
+                            SearchMove(1, search.best_move, 0, 99))
+  return matched, divergence
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("epd", help="EPD file of positions to check")
+  parser.add_argument("--max-moves", type=int,
+                      help="stop checking a position after this many moves")
+  parser.add_argument("--line", "-l", type=int, action="append",
+                      help="only check the given (1-based) line of the EPD file")
+  parser.add_argument("--moves-only", action="store_true",
+                      help="only compare the moves tried, not alpha and beta")
+  args = parser.parse_args()
+
+  program, labels = assemble()
+  failures = 0
+  for i, line in read_lines(args.epd):
+    if args.line and i not in args.line:
+      continue
+    position = Position.epd(line)
+    matched, divergence = check(position, program, labels, args.max_moves,
+                                bounds=not args.moves_only)
+    if divergence:
+      failures += 1
+      print(f"{i:4} diverged {divergence}", flush=True)
+    else:
+      print(f"{i:4} ok {matched} moves  {' '.join(str(position).split()[:2])}", flush=True)
+  return 1 if failures else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import unittest
+
+import diff_search
+from game import Position, ReferenceMoveGen
+import testengine
+
+
+class TestDiffSearch(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.program, cls.labels = diff_search.assemble()
+
+  def check(self, fen, **kwargs):
+    return diff_search.check(Position.fen(fen), self.program, self.labels, **kwargs)
+
+  def testSameSearch(self):
+    matched, divergence = self.check('4k3/4P3/3PK3/8/8/8/8/8 w - - 0 1')
+    self.assertIsNone(divergence)
+    self.assertEqual(matched, 2)
+
+  def testMaxMoves(self):
+    matched, divergence = self.check('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                                     max_moves=50)
+    self.assertIsNone(divergence)
+    self.assertEqual(matched, 50)
+
+  def testScoresMatchAwayFromStart(self):
+    # Scores are relative to the root, so material and center occupancy
+    # already on the board don't count.
+    matched, divergence = self.check(
+      'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4', max_moves=150)
+    self.assertIsNone(divergence)
+    self.assertEqual(matched, 150)
+
+  def testReportsFirstDivergence(self):
+    # Without alpha/beta updates at the leaves, TestEngine's beta at the last
+    # ply stays at its initial value.
+    engine = testengine.TestEngine()
+    engine.update_ab_at_depth_1 = False
+    matched, divergence = self.check('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                                     engine=engine)
+    self.assertEqual(matched, 4)
+    self.assertEqual(divergence.line, ['b1a3', 'a7a6', 'a1b1'])
+    self.assertEqual(divergence.engine, diff_search.SearchMove(4, '7262', 0, 99))
+    self.assertEqual(divergence.vm, diff_search.SearchMove(4, '7262', 0, 50))
+    self.assertEqual(self.check('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                                engine=engine, bounds=False, max_moves=20), (20, None))
+
+  def testRestoresEngine(self):
+    engine = testengine.TestEngine()
+    engine.faithful = False
+    self.assertEqual(self.check('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                                engine=engine, max_moves=20), (20, None))
+    self.assertFalse(engine.faithful)
+    self.assertIsNone(engine.trace)
+    engine.evaluate(Position.fen('4k3/4P3/3PK3/8/8/8/8/8 w - - 0 1'), depth=2)
+
+  def testSkipsIllegalMoves(self):
+    # The knight is pinned, so ENIAC's knight moves at ply 1 are illegal.
+    position = Position.fen('4r1k1/8/8/8/8/8/4N3/4K3 w - - 0 1')
+    move_gen = ReferenceMoveGen(allow_castling=False, allow_en_passant_captures=False,
+                                allowed_promotions='q')
+    search = diff_search.VMSearch(self.program, self.labels, position, move_gen)
+    root_moves = [move.move for move in search if move.ply == 1]
+    self.assertEqual(sorted(root_moves), ['1514', '1516', '1524', '1526'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,37 +1,99 @@
+import ctypes
 import math
+import threading
 
 from uciengine import UCIEngine
-from game import Move
-from subprocess import run, PIPE, Popen
+from game import Move, legal_move_list
+from subprocess import run
 
 class EniacEngine(UCIEngine):
-  """Wraps eniac chess client for uci tournament play."""
+  """Wraps eniac chess client for uci tournament play.
+
+  The client is built as a shared library and searches on a worker thread,
+  so a search can be cancelled as soon as self.stop is set.
+  """
+  # ENIAC's cycling unit runs at 5kHz.
+  cycles_per_second = 5000
 
   def __init__(self):
     super().__init__(name="ENIAC Chess 1.0", author="Jonathan Stray and Jered Wierzbicki")
     self.client = None
 
   def start(self):
-    run('make client', shell=True, check=True)
-    self.client = Popen('./client', shell=True, stdin=PIPE, stdout=PIPE)
+    run('make libclient.so', shell=True, check=True)
+    self.client = load_client('./libclient.so')
     super().start()
 
-  def join(self):
-    self.client.kill()
-    super().join()
+  def evaluate(self, position, limits=None):
+    """Write position as cards and return response from eniac
 
-  def evaluate(self, position):
-    """Write position as cards and return response from eniac"""
-    self.client.stdin.write(f'{position}\n'.encode())
-    self.client.stdin.flush()
+    ENIAC always searches to the same depth, so only time limits apply.  If
+    self.stop is set before ENIAC answers, the search is cancelled and
+    ENIAC's best move so far is played, or else the first legal move.
+    """
     self.log.debug(f'eniac evaluating {position}')
-    move = self.client.stdout.readline().decode().strip()
-    self.log.debug(f'foo')
-    if move == '':
+    search = ClientSearch(self.client, str(position))
+    search.start()
+    while search.is_alive():
+      if self.stop.wait(0.01):
+        search.cancel()
+        search.join()
+    eniac_hours = search.cycles / self.cycles_per_second / 3600
+    self.info(force=True, string=f'{search.cycles} cycles {search.instructions} instructions '
+                                 f'{eniac_hours:.1f} ENIAC hours')
+    if not search.completed:
+      self.log.debug(f'eniac stopped early with {search.move or "no move"}')
+      if not search.move:
+        return next(iter(legal_move_list(position)), None)
+    if search.move == '':
       # UCI doesn't seem to have an actual way to resign, so return None
       # This will make the move the literal string "None", which a board
       # program ought to adjudicate as resignation by invalid move.
       self.log.debug(f'eniac resigns')
       return
-    self.log.debug(f'eniac plays {move}')
-    return Move.lan(move)
+    self.log.debug(f'eniac plays {search.move}')
+    return Move.lan(search.move)
+
+
+def load_client(path):
+  """Loads the client shared library built by make libclient.so."""
+  client = ctypes.CDLL(path)
+  client.eniac_chess_search.argtypes = [
+    ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+    ctypes.POINTER(ctypes.c_ulonglong), ctypes.POINTER(ctypes.c_ulonglong)]
+  client.eniac_chess_search.restype = ctypes.c_int
+  return client
+
+
+class ClientSearch(threading.Thread):
+  """Runs one ENIAC search in the client library on its own thread.
+
+  After the thread finishes, move is ENIAC's move (empty if it resigns or
+  was cancelled before finding one), completed says if the search ran to
+  the end, and cycles and instructions count the VM work done.
+  """
+  def __init__(self, client, fen):
+    super().__init__()
+    self.client = client
+    self.fen = fen
+    self.move = ''
+    self.completed = False
+    self.cycles = 0
+    self.instructions = 0
+    self._cancel = ctypes.c_int(0)
+
+  def cancel(self):
+    self._cancel.value = 1
+
+  def run(self):
+    move = ctypes.create_string_buffer(8)
+    cycles = ctypes.c_ulonglong(0)
+    instructions = ctypes.c_ulonglong(0)
+    # ctypes releases the GIL for the duration of the call.
+    completed = self.client.eniac_chess_search(
+      self.fen.encode(), move, len(move), ctypes.byref(self._cancel),
+      ctypes.byref(cycles), ctypes.byref(instructions))
+    self.move = move.value.decode()
+    self.completed = bool(completed)
+    self.cycles = cycles.value
+    self.instructions = instructions.value
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Reads EPD files lazily, optionally through an on-disk index.
+
+read_lines() and read_positions() stream a file instead of loading it all,
+and EpdIndex records the byte offset and parsed ops of every position so
+positions can be looked up by id or taken by range without reparsing the
+file.  Run as a script to measure parsing throughput, e.g.
+
+  python epd.py benchmarks/Midgames1000.epd benchmarks/Openings1000.epd
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+from game import Move, Position, _parse_epd_ops
+
+
+def suite_path(suite):
+  """Returns the path of suite, a file or the name of a suite in benchmarks/
+  like "STS1"."""
+  if os.path.exists(suite):
+    return suite
+  return os.path.join("benchmarks", suite if suite.endswith(".epd") else f"{suite}.epd")
+
+
+def read_lines(path):
+  """Yields (line number, EPD text) for the non-blank lines of path."""
+  with open(path) as f:
+    for i, line in enumerate(f, 1):
+      line = line.strip()
+      if line:
+        yield i, line
+
+
+def read_positions(path, board_type=None):
+  """Yields a Position for every non-blank line of path."""
+  for _, line in read_lines(path):
+    yield Position.epd(line, board_type=board_type)
+
+
+@dataclass
+class IndexEntry:
+  line: int
+  offset: int  # byte offset of the line in the file
+  length: int  # bytes, not counting the newline
+  ops: Dict[str, str]
+
+  @property
+  def id(self):
+    return self.ops.get("id")
+
+
+class EpdIndex(object):
+  """The positions of an EPD file, indexed by number and id.
+
+  The index is saved next to the file as path + ".idx" and rebuilt when the
+  file's size or modification time changes, so opening it again is just a
+  JSON load.  Lines are only read from the file when a position is asked for.
+  """
+  def __init__(self, path, save=True):
+    self.path = path
+    self.index_path = path + ".idx"
+    stat = os.stat(path)
+    self._stamp = [stat.st_size, stat.st_mtime_ns]
+    self.entries = self._load() if save else None
+    if self.entries is None:
+      self.entries = self._build()
+      if save:
+        self._save()
+    self._by_id = {entry.id: i for i, entry in enumerate(self.entries) if entry.id}
+
+  def _load(self):
+    try:
+      with open(self.index_path) as f:
+        index = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if index.get("stamp") != self._stamp:
+      return None
+    return [IndexEntry(*entry) for entry in index["entries"]]
+
+  def _save(self):
+    with open(self.index_path, "w") as f:
+      json.dump({"stamp": self._stamp,
+                 "entries": [[e.line, e.offset, e.length, e.ops] for e in self.entries]}, f)
+
+  def _build(self):
+    entries = []
+    offset = 0
+    with open(self.path, "rb") as f:
+      for i, raw in enumerate(f, 1):
+        text = raw.decode().strip()
+        if text:
+          start = offset + raw.index(text[0].encode())
+          ops = _parse_epd_ops((text + " ").split(" ", 4)[4])
+          entries.append(IndexEntry(i, start, len(text.encode()), ops))
+        offset += len(raw)
+    return entries
+
+  def __len__(self):
+    return len(self.entries)
+
+  def find(self, id):
+    """Returns the number of the position with the given id op, or None."""
+    return self._by_id.get(id)
+
+  def lines(self, start=0, stop=None):
+    """Yields (line number, EPD text) for positions start..stop."""
+    with open(self.path, "rb") as f:
+      for entry in self.entries[start:stop]:
+        f.seek(entry.offset)
+        yield entry.line, f.read(entry.length).decode()
+
+  def positions(self, start=0, stop=None, board_type=None):
+    """Yields Positions start..stop, using the index's parsed ops."""
+    for entry, (_, text) in zip(self.entries[start:stop], self.lines(start, stop)):
+      yield Position.epd(text, board_type=board_type, ops=entry.ops)
+
+  def shard(self, k, n):
+    """Returns the (start, stop) range of the k'th of n equal shards."""
+    return k * len(self) // n, (k + 1) * len(self) // n
+
+  def position(self, i, board_type=None):
+    """Returns the i'th Position, reading just its line."""
+    return next(self.positions(i, i + 1, board_type=board_type))
+
+
+def _resolve_san(position):
+  """Parses the bm and am moves of position, returning how many parsed."""
+  count = 0
+  for op in ("bm", "am"):
+    for san in position.ops.get(op, "").split():
+      try:
+        Move.san(san, position)
+        count += 1
+      except AssertionError:
+        pass
+  return count
+
+
+def _rate(count, seconds):
+  return f"{count / seconds:9.0f}/s" if seconds else "        -"
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Measures EPD and SAN parsing throughput.")
+  parser.add_argument("epd", nargs="+", help="EPD files to parse")
+  args = parser.parse_args()
+
+  print(f"{'positions':>9} {'parse':>11} {'index':>11} {'indexed':>11} {'bm/am san':>11}  file")
+  for path in args.epd:
+    start = time.perf_counter()
+    count = sum(1 for _ in read_positions(path))
+    parse = time.perf_counter() - start
+    start = time.perf_counter()
+    index = EpdIndex(path, save=False)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    positions = list(index.positions())
+    indexed = time.perf_counter() - start
+    start = time.perf_counter()
+    moves = sum(_resolve_san(position) for position in positions)
+    san = time.perf_counter() - start
+    print(f"{count:9} {_rate(count, parse)} {_rate(count, build)} {_rate(count, indexed)} "
+          f"{_rate(moves, san)}  {path}")
+
+
+if __name__ == "__main__":
+  sys.exit(main())
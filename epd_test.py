@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from epd import *
+from game import MailboxBoard
+
+
+class TestEpd(unittest.TestCase):
+  lines = ['4k3/8/8/8/8/8/8/4K2R w K - bm O-O; id "castle";',
+           '',
+           '  rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - id "start"; c0 "é";',
+           '8/8/8/8/8/4k3/8/R3K3 w Q - D1 16;']
+
+  def setUp(self):
+    self.scratch = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.scratch.name, 'test.epd')
+    with open(self.path, 'w') as f:
+      f.write('\n'.join(self.lines) + '\n')
+
+  def tearDown(self):
+    self.scratch.cleanup()
+
+  def testReadLines(self):
+    self.assertEqual(list(read_lines(self.path)),
+                     [(1, self.lines[0]), (3, self.lines[2].strip()), (4, self.lines[3])])
+    positions = list(read_positions(self.path, board_type=MailboxBoard))
+    self.assertEqual([p.ops.get('id') for p in positions], ['castle', 'start', None])
+    self.assertIsInstance(positions[0].board, MailboxBoard)
+
+  def testSuitePath(self):
+    self.assertEqual(suite_path(self.path), self.path)
+    self.assertEqual(suite_path('STS1'), os.path.join('benchmarks', 'STS1.epd'))
+    self.assertEqual(suite_path('STS1.epd'), os.path.join('benchmarks', 'STS1.epd'))
+
+  def testIndex(self):
+    index = EpdIndex(self.path)
+    self.assertTrue(os.path.exists(self.path + '.idx'))
+    self.assertEqual(len(index), 3)
+    self.assertEqual(index.find('start'), 1)
+    self.assertIsNone(index.find('missing'))
+    self.assertEqual(list(index.lines(1)), [(3, self.lines[2].strip()), (4, self.lines[3])])
+    for p, (_, line) in zip(index.positions(), read_lines(self.path)):
+      expected = Position.epd(line)
+      self.assertEqual((str(p), p.ops, p.key), (str(expected), expected.ops, expected.key))
+    self.assertEqual(index.position(2).ops, {'D1': '16'})
+
+  def testIndexIsReused(self):
+    EpdIndex(self.path)
+    with open(self.path + '.idx') as f:
+      saved = f.read()
+    with open(self.path + '.idx', 'w') as f:
+      f.write(saved.replace('castle', 'cached'))
+    self.assertEqual(EpdIndex(self.path).find('cached'), 0)
+    # Changing the file rebuilds the index.
+    with open(self.path, 'a') as f:
+      f.write('8/8/8/8/8/4k3/8/R3K3 b Q - id "new";\n')
+    index = EpdIndex(self.path)
+    self.assertEqual((index.find('castle'), index.find('new')), (0, 3))
+
+  def testShard(self):
+    index = EpdIndex(self.path, save=False)
+    self.assertFalse(os.path.exists(self.path + '.idx'))
+    self.assertEqual([index.shard(k, 2) for k in range(2)], [(0, 1), (1, 3)])
+
+
+if __name__ == '__main__':
+  unittest.main()
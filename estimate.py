@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Projects ENIAC's time per move for TestEngine search variations.
+
+ENIAC's search time goes to a few operations: calling movegen, trying the
+moves it returns, making and unmaking them, scoring leaves, and starting
+search frames, which includes movegen's scan of the board for pieces to
+move.  Calibration runs asm/chess.asm on chsim with a profile and divides
+the cycles spent in each part of the program by the number of times its
+operation ran.  TestEngine counts the same operations as it searches, so any
+bench.py --option variation can be costed in ENIAC hours, e.g.
+
+  python estimate.py STS1 --limit 20
+  python estimate.py STS1 --limit 20 --option ordering --option pvs
+
+The calibration positions are also searched faithfully to show how far
+predictions are off.  ENIAC searches under illegal moves until it finds the
+king capture refuting them, which TestEngine doesn't, so positions with
+checks and pins come out low.  Only operations ENIAC already does are
+costed, so projections for variations that would need new ENIAC code (like
+sorting moves or probing a table) are lower bounds.
+"""
+import argparse
+import bisect
+import os
+import statistics
+import sys
+import tempfile
+from collections import Counter
+from dataclasses import dataclass
+from subprocess import run
+from typing import Dict
+
+import vm
+from bench import test_options
+from chasm.chasm import Assembler, print_easm
+from eniacengine import EniacEngine
+from epd import read_lines, suite_path
+from game import Position
+import testengine
+from uciengine import SearchLimits
+
+operations = ["movegen", "move", "make", "leaf", "frame"]
+
+# Where each part of asm/chess.asm starts, in address order, with the
+# operation its cycles are charged to.  None is setup and output, which
+# happen once per search.
+_regions = [
+  ("next_move", "movegen"),
+  ("init_move", "frame"),    # scanning the board for pieces to move
+  ("next_pawn_move", "movegen"),
+  ("get_square", "get_square"),
+  ("move", "make"),          # and undo_move
+  ("game", None),
+  ("search", "movegen"),     # a far jump to next_move
+  ("output_move", "move"),   # pruning and king capture checks
+  ("move_ret", "make"),
+  ("push_ret", "frame"),
+  ("leaf", "leaf"),
+  ("no_more_moves", "frame"),
+  ("search_done", None),
+]
+
+# The label jumped to once per operation.  The root frame isn't pushed.
+_counted_at = {"movegen": "search", "move": "output_move", "make": "move", "leaf": "leaf",
+               "frame": "push"}
+
+
+def assemble(path, source="asm/chess.asm"):
+  """Assembles source to path for chsim, returning its vm.Program and labels."""
+  out = Assembler(print_errors=False).assemble(source)
+  if out.errors:
+    raise ValueError("\n".join(out.errors))
+  with open(path, "w") as f:
+    print_easm(out, f)
+  return vm.Program(vm.output_program(out)), out.context.labels
+
+
+def read_profile(path):
+  """Returns a chsim -p profile as {(pc, ir_index): count}."""
+  profile = {}
+  with open(path) as f:
+    for line in f:
+      pc, ir_index, count = map(int, line.split())
+      profile[pc, ir_index] = count
+  return profile
+
+
+def profile_search(program_path, position, max_cycles=10**10):
+  """Searches position on chsim, returning (cycles, profile)."""
+  cards = "".join(f"{f:02}{g:02}{h}\n" for f, g, h in vm.position_deck(position))
+  with tempfile.TemporaryDirectory() as scratch:
+    path = os.path.join(scratch, "chsim.prof")
+    result = run(["chsim/chsim", "-b", "-p", path, program_path],
+                 input=f"{cards}run {max_cycles}\n", capture_output=True, text=True, check=True)
+    profile = read_profile(path)
+  done = result.stdout.split("\n")[-2].split()
+  if done[1] != "halt":
+    raise RuntimeError(f"chsim search of {position} ended with {done[1]}")
+  return int(done[2]), profile
+
+
+def _row_cycles(program, profile):
+  """Yields (row, cycles) for the instructions counted in profile.
+
+  chsim samples pc and ir_index before each step, so as in vm.VM.step, an
+  ir_index of 6 means the first instruction of row pc and anything else the
+  instruction at ir_index on the row before.
+  """
+  for (pc, ir_index), count in profile.items():
+    if ir_index == 6:
+      row, index = pc, 1 if pc >= 300 else 0
+    else:
+      row, index = pc - 1, ir_index
+    yield row, program.decoded[row][index][3] * count
+
+
+def region_cycles(program, labels, profile):
+  """Returns the cycles in profile charged to each operation, and to None."""
+  starts = sorted((labels[label], operation) for label, operation in _regions)
+  rows = [row for row, _ in starts]
+  cycles = dict.fromkeys(operations + [None, "get_square"], 0)
+  for row, row_cycles in _row_cycles(program, profile):
+    i = bisect.bisect_right(rows, row) - 1
+    cycles[starts[i][1] if i >= 0 else None] += row_cycles
+  # get_square is called once per square scanned, and the rest of its calls
+  # look at target squares.
+  shared = cycles.pop("get_square")
+  calls = profile.get((labels["get_square"], 6), 0)
+  scanned = shared * profile.get((labels["try_square"], 6), 0) // max(calls, 1)
+  cycles["frame"] += scanned
+  cycles["movegen"] += shared - scanned
+  return cycles
+
+
+def vm_counts(labels, profile):
+  """Returns how many times each operation ran in profile."""
+  counts = {operation: profile.get((labels[label], 6), 0)
+            for operation, label in _counted_at.items()}
+  counts["frame"] += profile.get((labels["game"], 6), 0)
+  return counts
+
+
+def engine_counts(engine):
+  """Returns the operations ENIAC would run for TestEngine's last search.
+
+  movegen is called for each move tried, and once more to find a frame has
+  no moves left unless it was pruned.  Non-captures at the last ply are
+  scored without being made.
+  """
+  return {
+    "movegen": engine.moves_tried + engine.expanded - engine.pruned,
+    "move": engine.moves_tried,
+    "make": engine.moves_tried - engine.pruned - engine.leaf_non_captures,
+    "leaf": engine.node_count + engine.leaf_non_captures,
+    "frame": engine.expanded,
+  }
+
+
+@dataclass
+class Calibration:
+  """ENIAC cycles per operation, and per search for setup and output."""
+  cycles: Dict[str, float]
+  setup: float
+
+  def predict(self, counts):
+    """Returns the cycles to search with counts of each operation."""
+    return self.setup + sum(self.cycles[operation] * counts[operation]
+                            for operation in operations)
+
+
+def calibrate(program, labels, profiles):
+  """Returns the Calibration for chsim profiles of whole searches."""
+  cycles = Counter()
+  counts = Counter()
+  for profile in profiles:
+    cycles.update(region_cycles(program, labels, profile))
+    counts.update(vm_counts(labels, profile))
+  return Calibration({operation: cycles[operation] / max(counts[operation], 1)
+                      for operation in operations},
+                     cycles[None] / max(len(profiles), 1))
+
+
+def hours(cycles):
+  return cycles / EniacEngine.cycles_per_second / 3600
+
+
+def distribution(values):
+  """Returns the min, median, mean, 90th percentile and max of values."""
+  values = sorted(values)
+  p90 = values[min(len(values) - 1, int(0.9 * len(values)))]
+  return {"min": values[0], "median": statistics.median(values),
+          "mean": statistics.mean(values), "p90": p90, "max": values[-1]}
+
+
+def search_counts(engine, position, depth=4):
+  """Searches position with engine, returning engine_counts()."""
+  engine.evaluate(position, SearchLimits(depth=depth))
+  return engine_counts(engine)
+
+
+def _format_distribution(values):
+  return "  ".join(f"{name} {value:.2f}h" for name, value in distribution(values).items())
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("suite", help="EPD file, or name of a suite in benchmarks/ like STS1")
+  parser.add_argument("--option", action="append", default=[], choices=sorted(test_options),
+                      help="project a TestEngine variation")
+  parser.add_argument("--calibrate", "-c", type=int, default=3,
+                      help="profile ENIAC's search of the first n positions")
+  parser.add_argument("--limit", "-n", type=int, help="only project the first n positions")
+  args = parser.parse_args()
+
+  run("make -C chsim chsim", shell=True, check=True)
+  epds = [epd for _, epd in read_lines(suite_path(args.suite))]
+  with tempfile.TemporaryDirectory() as scratch:
+    program_path = os.path.join(scratch, "chess.e")
+    program, labels = assemble(program_path)
+    searches = [profile_search(program_path, Position.epd(epd))
+                for epd in epds[:args.calibrate]]
+  calibration = calibrate(program, labels, [profile for _, profile in searches])
+
+  print("operation       count  cycles/op  share")
+  totals = Counter()
+  for _, profile in searches:
+    totals.update(vm_counts(labels, profile))
+  all_cycles = sum(cycles for cycles, _ in searches)
+  for operation in operations:
+    cycles = calibration.cycles[operation]
+    print(f"{operation:8} {totals[operation]:12} {cycles:10.1f}  "
+          f"{100 * cycles * totals[operation] / all_cycles:4.1f}%")
+  print(f"setup    {len(searches):12} {calibration.setup:10.1f}")
+  faithful = testengine.TestEngine()
+  for epd, (cycles, _) in zip(epds, searches):
+    position = Position.epd(epd)
+    predicted = calibration.predict(search_counts(faithful, position))
+    print(f"{position.ops.get('id', epd[:40])}: ENIAC {hours(cycles):.2f}h, "
+          f"predicted {hours(predicted):.2f}h ({100 * (predicted / cycles - 1):+.1f}%)")
+  print()
+
+  engine = testengine.TestEngine()
+  for option in args.option:
+    test_options[option](engine)
+  projected = []
+  baseline = []
+  for epd in epds[:args.limit]:
+    position = Position.epd(epd)
+    projected.append(hours(calibration.predict(search_counts(engine, position))))
+    line = f"{position.ops.get('id', epd[:40])}: {projected[-1]:.2f}h"
+    if args.option:
+      baseline.append(hours(calibration.predict(search_counts(faithful, position))))
+      line += f" vs {baseline[-1]:.2f}h faithful ({baseline[-1] / projected[-1]:.2f}x)"
+    print(line, flush=True)
+  print(f"\n{' '.join(args.option) or 'faithful'}: {_format_distribution(projected)}")
+  if baseline:
+    print(f"faithful: {_format_distribution(baseline)}")
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from subprocess import run
+
+import estimate
+from game import Position
+import testengine
+
+
+class TestEstimate(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    run('make -C chsim chsim', shell=True, check=True)
+    cls.scratch = tempfile.TemporaryDirectory()
+    cls.path = os.path.join(cls.scratch.name, 'chess.e')
+    cls.program, cls.labels = estimate.assemble(cls.path)
+    cls.position = Position.fen('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+    cls.cycles, cls.profile = estimate.profile_search(cls.path, cls.position)
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.scratch.cleanup()
+
+  def testChargesEveryCycle(self):
+    cycles = estimate.region_cycles(self.program, self.labels, self.profile)
+    self.assertEqual(sum(cycles.values()), self.cycles)
+    self.assertEqual(set(cycles), set(estimate.operations) | {None})
+
+  def testCalibration(self):
+    calibration = estimate.calibrate(self.program, self.labels, [self.profile])
+    counts = estimate.vm_counts(self.labels, self.profile)
+    self.assertAlmostEqual(calibration.predict(counts), self.cycles, delta=1)
+    # Away from checks, TestEngine does about what ENIAC does.
+    engine_counts = estimate.search_counts(testengine.TestEngine(), self.position)
+    for operation in estimate.operations:
+      self.assertAlmostEqual(engine_counts[operation] / counts[operation], 1, delta=0.1,
+                             msg=operation)
+    self.assertAlmostEqual(calibration.predict(engine_counts) / self.cycles, 1, delta=0.05)
+
+  def testVariationsCostLess(self):
+    calibration = estimate.calibrate(self.program, self.labels, [self.profile])
+    engine = testengine.TestEngine()
+    faithful = calibration.predict(estimate.search_counts(engine, self.position))
+    engine.move_ordering = testengine.MoveOrdering()
+    engine.pvs = True
+    self.assertLess(calibration.predict(estimate.search_counts(engine, self.position)), faithful)
+
+  def testDistribution(self):
+    self.assertEqual(estimate.distribution([4, 1, 3, 2]),
+                     {'min': 1, 'median': 2.5, 'mean': 2.5, 'p90': 4, 'max': 4})
+
+
+if __name__ == '__main__':
+  unittest.main()
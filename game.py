@@ -4,6 +4,9 @@
 
 import re
 import copy
+import random
+import threading
+from collections import OrderedDict
 
 white_pieces = "RNBQKP"
 black_pieces = "rnbqkp"
@@ -30,16 +33,44 @@ class Square(object):
 
   x is the file and runs from 1 to 8 corresponding to A-H.
   y is the rank and runs from 1 to 8 with white pieces starting on ranks 1 and 2.
+
+  Squares are interned and immutable: Square(x, y) always returns the same
+  object for a given on-board square, and Square.offboard for any square off
+  the board.  On-board squares carry precomputed neighbour tables for move
+  generation: rook_rays, bishop_rays and queen_rays hold a tuple of squares for
+  each direction in rook_deltas, bishop_deltas and queen_deltas, and
+  knight_targets and king_targets hold the on-board squares a knight or king
+  step away in knight_deltas and king_deltas order.
   """
-  def __init__(self, x=0, y=0):
-    self.x = x
-    self.y = y
-    self.in_bounds = 1 <= self.x <= 8 and 1 <= self.y <= 8
+  __slots__ = ("x", "y", "in_bounds",
+               "rook_rays", "bishop_rays", "queen_rays",
+               "knight_targets", "king_targets")
+
+  def __new__(cls, x=0, y=0):
+    return _squares.get((x, y), Square.offboard)
+
+  @staticmethod
+  def _intern(x, y):
+    square = object.__new__(Square)
+    square._init(x=x, y=y, in_bounds=1 <= x <= 8 and 1 <= y <= 8)
+    return square
+
+  def _init(self, **attrs):
+    for name, value in attrs.items():
+      object.__setattr__(self, name, value)
+
+  def __setattr__(self, name, value):
+    raise AttributeError("Square is immutable")
+
+  def __reduce__(self):
+    return (Square, (self.x, self.y))
 
   def __str__(self):
     return file_names[self.x] + rank_names[self.y]
 
   def __repr__(self):
+    if not self.in_bounds:
+      return 'Square.offboard'
     return 'Square.{}'.format(self)
 
   @staticmethod
@@ -47,19 +78,73 @@ class Square(object):
     assert len(name) == 2
     return Square(x=file_names.index(name[0]), y=rank_names.index(name[1]))
 
-  def __eq__(self, other):
-    return self.x == other.x and self.y == other.y
-
   def __add__(self, deltas):
     dx, dy = deltas
-    return Square(x=self.x + dx, y=self.y + dy)
-
-# Populate attributes on the Square class Square.a1 .. Square.h8.
-# This makes it convenient to refer to squares by name.
-for rn in rank_names:
-  for fn in file_names:
-    name = fn + rn
-    setattr(Square, name, Square.named(name))
+    return _squares.get((self.x + dx, self.y + dy), Square.offboard)
+
+_squares = {(x, y): Square._intern(x, y) for y in range(1, 9) for x in range(1, 9)}
+Square.offboard = Square._intern(0, 0)
+
+def _ray(square, dx, dy):
+  ray = []
+  to = square + (dx, dy)
+  while to.in_bounds:
+    ray.append(to)
+    to = to + (dx, dy)
+  return tuple(ray)
+
+def _targets(square, deltas):
+  return tuple(to for to in (square + d for d in deltas) if to.in_bounds)
+
+def _init_squares():
+  for square in list(_squares.values()) + [Square.offboard]:
+    rook_rays = tuple(_ray(square, dx, dy) for dx, dy in rook_deltas)
+    bishop_rays = tuple(_ray(square, dx, dy) for dx, dy in bishop_deltas)
+    square._init(rook_rays=rook_rays,
+                 bishop_rays=bishop_rays,
+                 queen_rays=rook_rays + bishop_rays,
+                 knight_targets=_targets(square, knight_deltas),
+                 king_targets=_targets(square, king_deltas))
+    # Populate attributes on the Square class Square.a1 .. Square.h8.
+    # This makes it convenient to refer to squares by name.
+    if square.in_bounds:
+      setattr(Square, str(square), square)
+
+_init_squares()
+
+
+# Zobrist keys for hashing positions.  A fixed seed keeps keys stable from run
+# to run so they can be saved alongside results.
+_zobrist_random = random.Random(0xe41ac)
+_zobrist_pieces = {piece: {square: _zobrist_random.getrandbits(64) for square in _squares.values()}
+                   for piece in white_pieces + black_pieces}
+_zobrist_black = _zobrist_random.getrandbits(64)
+_zobrist_castling = {ch: _zobrist_random.getrandbits(64) for ch in "KQkq"}
+_zobrist_ep_file = [_zobrist_random.getrandbits(64) for x in range(9)]
+
+def _castling_key(castling):
+  key = 0
+  for ch in castling:
+    key ^= _zobrist_castling[ch]
+  return key
+
+def zobrist_key(position):
+  """Computes the Zobrist hash key of position from scratch."""
+  key = _zobrist_black if position.to_move == "b" else 0
+  key ^= _castling_key(position.castling)
+  if position.ep_target:
+    key ^= _zobrist_ep_file[position.ep_target.x]
+  for square, piece in position.board:
+    if piece != empty:
+      key ^= _zobrist_pieces[piece][square]
+  return key
+
+
+def _pack_ranks(ranks):
+  fen = "/".join("".join(rank) for rank in ranks)
+  for num_dots in range(8, 0, -1):
+    fen = fen.replace(empty * num_dots, str(num_dots))
+  return fen
 
 
 class Board(object):
@@ -72,16 +157,21 @@ class Board(object):
   white_king_square and black_king_square cache where kings are, which is
   needed when testing for check; they are calculated if left unspecified.
   """
+  # Move generators copy this board for every move (see make_move).
+  make_in_place = False
+
   def __init__(self, ranks=None, white_king_square=None, black_king_square=None):
     self.ranks = ranks
     self.white_king_square = white_king_square or self.find("K")
     self.black_king_square = black_king_square or self.find("k")
 
   def __str__(self):
-    fen = "/".join("".join(rank) for rank in self.ranks)
-    for num_dots in range(8, 0, -1):
-      fen = fen.replace(empty * num_dots, str(num_dots))
-    return fen
+    return _pack_ranks(self.ranks)
+
+  def copy(self):
+    return Board(ranks=[[p for p in rank] for rank in self.ranks],
+                 white_king_square=self.white_king_square,
+                 black_king_square=self.black_king_square)
 
   @staticmethod
   def unpack(fen):
@@ -129,9 +219,113 @@ class Board(object):
         return sq
 
 
+# Off board squares in a MailboxBoard.
+offboard = "#"
+
+def _mailbox_index(x, y):
+  return 10 * (y + 1) + x
+
+# Mailbox indices and squares, in the same order Board iterates over squares.
+_mailbox_squares = [(_mailbox_index(x, y), Square(x=x, y=y))
+                    for y in range(1, 9) for x in range(1, 9)]
+
+
+class MailboxBoard(object):
+  """A chess board stored as a flat 10x12 "mailbox" array.
+
+  squares holds Square(x, y) at index 10 * (y + 1) + x, and the 8x8 board is
+  surrounded by offboard sentinels two deep above and below and one deep on
+  either side so that knight jumps and slides can run off the edge without
+  bounds checks.
+
+  This supports the same operations as Board, but move generators make and
+  unmake moves on it in place instead of copying it for every move.
+  """
+  make_in_place = True
+
+  def __init__(self, ranks=None, white_king_square=None, black_king_square=None):
+    self.squares = [offboard] * 120
+    for y, rank in enumerate(reversed(ranks)):
+      for x, piece in enumerate(rank):
+        self.squares[_mailbox_index(x + 1, y + 1)] = piece
+    self.white_king_square = white_king_square or self.find("K")
+    self.black_king_square = black_king_square or self.find("k")
+
+  @property
+  def ranks(self):
+    return [[self.squares[_mailbox_index(x, y)] for x in range(1, 9)]
+            for y in range(8, 0, -1)]
+
+  def __str__(self):
+    return _pack_ranks(self.ranks)
+
+  @staticmethod
+  def unpack(fen):
+    return MailboxBoard(ranks=Board.unpack(fen).ranks)
+
+  def copy(self):
+    board = MailboxBoard.__new__(MailboxBoard)
+    board.squares = self.squares[:]
+    board.white_king_square = self.white_king_square
+    board.black_king_square = self.black_king_square
+    return board
+
+  def pretty_print(self):
+    for rank in self.ranks:
+      print("".join(rank))
+
+  def __iter__(self):
+    squares = self.squares
+    for i, square in _mailbox_squares:
+      piece = squares[i]
+      if piece != empty:
+        yield (square, piece)
+
+  def __getitem__(self, pos):
+    assert pos.in_bounds
+    return self.squares[10 * pos.y + pos.x + 10]
+
+  def __setitem__(self, pos, piece):
+    assert pos.in_bounds
+    if piece == "K":
+      self.white_king_square = pos
+    elif piece == "k":
+      self.black_king_square = pos
+    self.squares[10 * pos.y + pos.x + 10] = piece
+
+  def __eq__(self, other):
+    if isinstance(other, MailboxBoard):
+      return self.squares == other.squares
+    mine, theirs = list(self), list(other)
+    return len(mine) == len(theirs) and all(a == b for a, b in zip(mine, theirs))
+
+  def find(self, piece):
+    for sq, there in self:
+      if there == piece:
+        return sq
+
+
 class Position(object):
-  """A chess position description modeled after the EPD format."""
-  def __init__(self, board=None, to_move=None, castling=None, ep_target=None, ops=None):
+  """A chess position description modeled after the EPD format.
+
+  Positions can also be updated in place with make() and unmake(), which keep
+  an undo_stack of moves made so far.  captured is the piece captured by the
+  last move, or empty.
+
+  key is a Zobrist hash of the board, side to move, castling and ep_target.
+  It is computed when the position is created and updated incrementally by
+  make_move(), make() and unmake(); code which changes a position's fields
+  directly must recompute it with zobrist_key().
+
+  mscore is ENIAC's evaluation, kept the same way as mscore in asm/move.asm:
+  it starts at 50 and each move adds (for white) or subtracts (for black) the
+  value of the piece it captures, the promotion bonus, and +1 for moving into
+  or -1 for moving out of the center, all mod 100.  So it is relative to
+  where it was last reset, and a piece captured in the center keeps its
+  center point, as on ENIAC.
+  """
+  def __init__(self, board=None, to_move=None, castling=None, ep_target=None, ops=None,
+               captured=empty, key=None, mscore=50):
     self.board = board
     self.to_move = to_move
     # Just the move history part of eligibility for castling.
@@ -142,12 +336,16 @@ class Position(object):
     # http://www.talkchess.com/forum3/viewtopic.php?t=37879
     self.ep_target = ep_target
     self.ops = ops
+    self.captured = captured
+    self.undo_stack = []
+    if key is None and board is not None:
+      key = zobrist_key(self)
+    self.key = key
+    self.mscore = mscore
 
   def __deepcopy__(self, memodict={}):
     # Speeds up perft because copy.deepcopy() is slow.
-    board = Board(ranks=[[p for p in rank] for rank in self.board.ranks],
-                  white_king_square=self.board.white_king_square,
-                  black_king_square=self.board.black_king_square)
+    board = self.board.copy()
     # These are treated as immutable.
     to_move = self.to_move
     ep_target = self.ep_target
@@ -157,20 +355,42 @@ class Position(object):
                     to_move=to_move,
                     castling=castling,
                     ep_target=ep_target,
-                    ops=ops)
+                    ops=ops,
+                    captured=self.captured,
+                    key=self.key,
+                    mscore=self.mscore)
+
+  def with_board_type(self, board_type):
+    """Returns a copy of this position using board_type for its board."""
+    p2 = copy.deepcopy(self)
+    p2.board = board_type.unpack(str(self.board))
+    return p2
+
+  def make(self, move):
+    """Applies move to this position in place.
+
+    This is much cheaper than make_move() because nothing is copied, but the
+    move must be taken back with unmake() to get the old position back.
+    """
+    self.undo_stack.append(_apply_move(self, move))
+
+  def unmake(self):
+    """Takes back the last move applied with make()."""
+    _unapply_move(self, self.undo_stack.pop())
 
   @staticmethod
-  def initial():
-    return Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+  def initial(board_type=None):
+    return Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                        board_type=board_type)
 
   @staticmethod
-  def fen(fen):
+  def fen(fen, board_type=None):
     # rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1
     (packed_board, to_move, castling, ep_target, halfmove_clock, fullmove) = fen.split()
     assert to_move in ("w", "b")
     assert castling == "-" or all(ch in "KQkq" for ch in castling)
     assert ep_target == "-" or ep_target[1] in ("3", "6")
-    return Position(board=Board.unpack(packed_board),
+    return Position(board=(board_type or Board).unpack(packed_board),
                     to_move=to_move,
                     castling=(castling if castling != "-" else ""),
                     ep_target=(Square.named(ep_target) if ep_target != "-" else None),
@@ -182,58 +402,40 @@ class Position(object):
     fen.append(self.to_move)
     fen.append("".join(sorted(self.castling)) if self.castling else "-")
     fen.append(str(self.ep_target) if self.ep_target else "-")
-    fen.append(self.ops["hmvc"])
-    fen.append(self.ops["fmvn"])
+    # EPD positions often have no move counters.
+    fen.append(str(self.ops.get("hmvc", 0)))
+    fen.append(str(self.ops.get("fmvn", 1)))
     return " ".join(fen)
 
   @staticmethod
-  def epd(epd):
+  def epd(epd, board_type=None, ops=None):
+    """Parses an EPD line.  ops can be its already parsed ops, e.g. from an index."""
     # 1kr5/3n4/q3p2p/p2n2p1/PppB1P2/5BP1/1P2Q2P/3R2K1 w - - bm f5; id "Undermine.001"; c0 "f5=10, Be5+=2, Bf2=3, Bg4=2";
-    (packed_board, to_move, castling, ep_target, ops) = (epd + " ").split(" ", 4)
+    (packed_board, to_move, castling, ep_target, ops_text) = (epd + " ").split(" ", 4)
     assert to_move in ("w", "b")
     assert castling == "-" or all(ch in "KQkq" for ch in castling)
     assert ep_target == "-" or ep_target[1] in ("3", "6")
-    return Position(board=Board.unpack(packed_board),
+    return Position(board=(board_type or Board).unpack(packed_board),
                     to_move=to_move,
                     castling=(castling if castling != "-" else ""),
                     ep_target=(Square.named(ep_target) if ep_target != "-" else None),
-                    ops=_parse_epd_ops(ops))
+                    ops=_parse_epd_ops(ops_text) if ops is None else ops)
 
 
+# One op of the ops part of an EPD line: an opcode, then a quoted or bare
+# argument, then a semicolon, e.g. bm f5; or id "Undermine.001";
+_epd_op = re.compile(r'[ \t]*([^ \t;]+)[ \t]*(?:"([^"]*)"|([^;]*));')
+
 def _parse_epd_ops(s):
-  # This parses the ops part of EPD strings.  These are not regular and a small
-  # parser is simpler than hacking together res.
   # bm f5; id "Undermine.001"; c0 "f5=10, Be5+=2, Bf2=3, Bg4=2";
   ops = {}
-  i = 0; n = len(s)
-  def skip_of(chars):
-    nonlocal i
-    while i < n and s[i] in chars:
-      i += 1
-  def take_not_of(chars):
-    nonlocal i
-    start = i
-    while i < n and s[i] not in chars:
-      i += 1
-    return s[start:i]
-  def expect(ch):
-    nonlocal i
-    assert i < n and s[i] == ch
-    i += 1
+  i = 0; n = len(s.rstrip())
   while i < n:
-    skip_of(" \t")
-    if i >= n: break
-    op = take_not_of(" \t")
-    skip_of(" \t")
-    arg = ""
-    if s[i] == ";":
-      pass
-    elif s[i] == '"':
-      i += 1; arg = take_not_of('"'); i += 1
-    else:
-      arg = take_not_of(";")
-    expect(";")
-    ops[op] = arg
+    m = _epd_op.match(s, i)
+    assert m, f"bad EPD ops {s[i:]!r}"
+    op, quoted, arg = m.groups()
+    ops[op] = arg if quoted is None else quoted
+    i = m.end()
   return ops
 
 
@@ -284,22 +486,22 @@ class Move(object):
       return Move.black_oo if position.to_move == "b" else Move.white_oo
     if s == "O-O-O" or s == "0-0-0":
       return Move.black_ooo if position.to_move == "b" else Move.white_ooo
-    m = re.match(r"^([RNBQK])([a-h]|[1-8]|[a-h][1-8])x?([a-h][1-8])$", s)
+    m = _san_piece_from.match(s)
     if m:
       piece, from_desc, to_desc = m.groups()
       piece = _piece_for_color(piece, position.to_move)
       return _disambiguate_san(position, piece, from_desc, to_desc)
-    m = re.match(r"^([RNBQK])x?([a-h][1-8])$", s)
+    m = _san_piece.match(s)
     if m:
       piece, to_desc = m.groups()
       piece = _piece_for_color(piece, position.to_move)
       return _disambiguate_san(position, piece, "", to_desc)
-    m = re.match(r"^([a-h]|[a-h][1-8])x?([a-h][1-8])=?([RNBQ]?)$", s)
+    m = _san_pawn_from.match(s)
     if m:
       from_desc, to_desc, promo = m.groups()
       piece = _piece_for_color("p", position.to_move)
       return _disambiguate_san(position, piece, from_desc, to_desc, promo.lower())
-    m = re.match(r"^([a-h][1-8])=?([RNBQ]?)$", s)
+    m = _san_pawn.match(s)
     assert m
     to_desc, promo = m.groups()
     piece = _piece_for_color("p", position.to_move)
@@ -333,6 +535,33 @@ def _is_castling_move(position, move):
       return True
   return False
 
+_san_piece_from = re.compile(r"^([RNBQK])([a-h]|[1-8]|[a-h][1-8])x?([a-h][1-8])$")
+_san_piece = re.compile(r"^([RNBQK])x?([a-h][1-8])$")
+_san_pawn_from = re.compile(r"^([a-h]|[a-h][1-8])x?([a-h][1-8])=?([RNBQ]?)$")
+_san_pawn = re.compile(r"^([a-h][1-8])=?([RNBQ]?)$")
+
+def _san_index(position):
+  """Returns {(piece, to): pseudo-legal moves} for position, cached on position.
+
+  The cache is dropped when position's key changes, e.g. after make().
+  Castling moves are left out since SAN spells them differently.
+  """
+  cached = getattr(position, "_san_moves", None)
+  if cached and cached[0] == position.key:
+    return cached[1]
+  index = {}
+  for move in _san_move_gen._pseudo_legal_moves(position):
+    index.setdefault((position.board[move.fro], move.to), []).append(move)
+  position._san_moves = (position.key, index)
+  return index
+
+def _is_legal_san_move(position, move):
+  p2 = make_move(position, move)
+  king_square = (p2.board.white_king_square if position.to_move == "w" else
+                 p2.board.black_king_square)
+  assert king_square
+  return not _san_move_gen._threatened(p2, position.to_move, king_square)
+
 def _disambiguate_san(position, piece, from_desc, to_desc, promo=""):
   to = Square.named(to_desc)
   result = None
@@ -340,10 +569,10 @@ def _disambiguate_san(position, piece, from_desc, to_desc, promo=""):
     from_desc = from_desc or "-"
     from_rank = rank_names.find(from_desc)
     from_file = file_names.find(from_desc)
-    for move, _ in ReferenceMoveGen().legal_moves(position):
+    for move in _san_index(position).get((piece, to), ()):
       if ((from_rank == -1 or move.fro.y == from_rank) and
           (from_file == -1 or move.fro.x == from_file) and
-          (move.to == to and position.board[move.fro] == piece and move.promo == promo)):
+          move.promo == promo and _is_legal_san_move(position, move)):
         assert not result
         result = move
     assert result
@@ -351,32 +580,89 @@ def _disambiguate_san(position, piece, from_desc, to_desc, promo=""):
     result = Move(fro=Square.named(from_desc), to=to)
   return result
 
+# ENIAC's piece values for mscore, as pval in asm/memory_layout.asm.  A
+# promotion scores the difference between the new piece and a pawn, which for
+# a queen is PBONUS.
+mscore_piece_value = {
+  "p": 3, "n": 9, "b": 9, "r": 15, "q": 27, "k": 25,
+  "P": 3, "N": 9, "B": 9, "R": 15, "Q": 27, "K": 25,
+}
+
+def _is_center(square):
+  return 3 <= square.x <= 6 and 3 <= square.y <= 6
+
+# _center_delta[fro][to] is the mscore change for moving from fro to to.
+_center_delta = {fro: {to: _is_center(to) - _is_center(fro) for to in _squares.values()}
+                 for fro in _squares.values()}
+
 def make_move(position, move):
   """Returns the new position after applying move to position."""
-  piece = position.board[move.fro]
   p2 = copy.deepcopy(position)
-  p2.to_move = "w" if position.to_move == "b" else "b"
-  p2.ep_target = None
-  if piece.lower() == "p":
+  _apply_move(p2, move)
+  return p2
+
+def _apply_move(position, move):
+  """Applies move to position in place and returns what's needed to undo it."""
+  board = position.board
+  piece = board[move.fro]
+  player = position.to_move
+  castling = _is_castling_move(position, move)
+  undo = (move, piece, castling, player, position.castling,
+          position.ep_target, position.captured, position.key, position.mscore)
+  key = position.key ^ _zobrist_black
+  if position.ep_target:
+    key ^= _zobrist_ep_file[position.ep_target.x]
+  capture_square = move.to
+  position.to_move = "w" if player == "b" else "b"
+  position.ep_target = None
+  if piece == "P" or piece == "p":
     dx = move.to.x - move.fro.x
     dy = move.to.y - move.fro.y
     if abs(dy) == 2:
-      p2.ep_target = move.fro + (0, dy//2)
-    if dx != 0 and p2.board[move.to] == empty:
-      ep_capture_square = Square(x=move.to.x, y=move.fro.y)
-      ep_capture_piece = p2.board[ep_capture_square]
+      position.ep_target = move.fro + (0, dy//2)
+      key ^= _zobrist_ep_file[position.ep_target.x]
+    if dx != 0 and board[move.to] == empty:
+      capture_square = Square(x=move.to.x, y=move.fro.y)
+      ep_capture_piece = board[capture_square]
       assert ep_capture_piece.lower() == "p" and ep_capture_piece != piece
-      p2.board[ep_capture_square] = empty
-  _update_castling_eligibility(p2, move, piece)
-  if _is_castling_move(position, move):
-    _do_castling(p2, move)
+  position.captured = board[capture_square]
+  score = _center_delta[move.fro][move.to]
+  if position.captured != empty:
+    key ^= _zobrist_pieces[position.captured][capture_square]
+    score += mscore_piece_value[position.captured]
+  old_castling = position.castling
+  _update_castling_eligibility(position, move, piece)
+  if position.castling != old_castling:
+    key ^= _castling_key(old_castling) ^ _castling_key(position.castling)
+  if castling:
+    _do_castling(position, move)
+    key ^= _castling_move_key(move)
   else:
-    p2.board[move.fro] = empty
+    board[capture_square] = empty
+    board[move.fro] = empty
     if not move.promo:
-      p2.board[move.to] = piece
+      board[move.to] = piece
     else:
-      p2.board[move.to] = _piece_for_color(move.promo, position.to_move)
-  return p2
+      board[move.to] = _piece_for_color(move.promo, player)
+      score += mscore_piece_value[move.promo] - mscore_piece_value["p"]
+    key ^= _zobrist_pieces[piece][move.fro] ^ _zobrist_pieces[board[move.to]][move.to]
+  position.key = key
+  position.mscore = (position.mscore + score if player == "w" else
+                     position.mscore - score) % 100
+  return undo + (capture_square,)
+
+def _unapply_move(position, undo):
+  """Takes back a move applied by _apply_move()."""
+  (move, piece, castling, position.to_move, position.castling,
+   position.ep_target, old_captured, position.key, position.mscore, capture_square) = undo
+  board = position.board
+  if castling:
+    _undo_castling(position, move)
+  else:
+    board[move.to] = empty
+    board[capture_square] = position.captured
+    board[move.fro] = piece
+  position.captured = old_captured
 
 def _update_castling_eligibility(position, move, piece):
   # Use a string instead of sets because sets slow down perft.
@@ -419,6 +705,86 @@ def _do_castling(position, move):
     position.board[Square.d8] = "r"
     position.board[Square.e8] = empty
 
+def _castling_move_key(move):
+  """Returns the change in Zobrist key from moving the king and rook to castle."""
+  for castling_move, king, rook, rook_from, rook_to in _castling_pieces:
+    if move == castling_move:
+      return (_zobrist_pieces[king][move.fro] ^ _zobrist_pieces[king][move.to] ^
+              _zobrist_pieces[rook][rook_from] ^ _zobrist_pieces[rook][rook_to])
+
+_castling_pieces = [(Move.white_oo, "K", "R", Square.h1, Square.f1),
+                    (Move.white_ooo, "K", "R", Square.a1, Square.d1),
+                    (Move.black_oo, "k", "r", Square.h8, Square.f8),
+                    (Move.black_ooo, "k", "r", Square.a8, Square.d8)]
+
+def _undo_castling(position, move):
+  if move == Move.white_oo:
+    position.board[Square.e1] = "K"
+    position.board[Square.f1] = empty
+    position.board[Square.g1] = empty
+    position.board[Square.h1] = "R"
+  elif move == Move.white_ooo:
+    position.board[Square.a1] = "R"
+    position.board[Square.c1] = empty
+    position.board[Square.d1] = empty
+    position.board[Square.e1] = "K"
+  elif move == Move.black_oo:
+    position.board[Square.e8] = "k"
+    position.board[Square.f8] = empty
+    position.board[Square.g8] = empty
+    position.board[Square.h8] = "r"
+  elif move == Move.black_ooo:
+    position.board[Square.a8] = "r"
+    position.board[Square.c8] = empty
+    position.board[Square.d8] = empty
+    position.board[Square.e8] = "k"
+
+
+class _LazyPosition(object):
+  """Stands in for make_move(position, move), which is only called when an
+  attribute of the next position is first used."""
+  __slots__ = ("_position", "_move", "_key", "_mscore", "_made")
+
+  def __init__(self, position, move):
+    self._position = position
+    self._move = move
+    self._key = position.key
+    self._mscore = position.mscore
+    self._made = None
+
+  def made(self):
+    """Returns the next position, making it if needed."""
+    if self._made is None:
+      assert (self._position.key, self._position.mscore) == (self._key, self._mscore), \
+        "position changed before next position was made"
+      self._made = make_move(self._position, self._move)
+      self._position = None
+    return self._made
+
+  def __getattr__(self, name):
+    return getattr(self.made(), name)
+
+  def __setattr__(self, name, value):
+    if name in _LazyPosition.__slots__:
+      object.__setattr__(self, name, value)
+    else:
+      setattr(self.made(), name, value)
+
+  def __str__(self):
+    return str(self.made())
+
+  def __repr__(self):
+    return repr(self.made())
+
+  def __eq__(self, other):
+    return self.made() == (other.made() if type(other) is _LazyPosition else other)
+
+  def __hash__(self):
+    return hash(self.made())
+
+  def __deepcopy__(self, memo):
+    return copy.deepcopy(self.made(), memo)
+
 
 class ReferenceMoveGen(object):
   """A slow (perft ~18knodes/sec) but correct move generator.
@@ -427,30 +793,113 @@ class ReferenceMoveGen(object):
   Options allow for turning off more complex chess rules.  ignore_check returns
   pseudo-legal moves that leave the player in check (but does not affect
   castling rules.)
+
+  By default every pseudo-legal move is made and tested for check.  With
+  check_pins, checkers and pinned pieces are found once per position, and
+  only king moves, en passant captures and moves of pinned pieces are tested
+  unless the king is already in check.  The moves are the same either way.
   """
   def __init__(self,
                ignore_check=False,
                allow_castling=True,
                allow_en_passant_captures=True,
-               allowed_promotions="rnbq"):
+               allowed_promotions="rnbq",
+               check_pins=False):
     self.ignore_check = ignore_check
     self.allow_castling = allow_castling
     self.allow_en_passant_captures = allow_en_passant_captures
     self.allowed_promotions = allowed_promotions
+    self.check_pins = check_pins
 
   def legal_moves(self, position):
-    """Yields all legal moves and next positions for a given position."""
+    """Yields all legal moves and next positions for a given position.
+
+    If position.board.make_in_place, each next position is position itself
+    with the move made in place, which is only valid until the generator is
+    resumed.  Otherwise next positions that don't have to be made to test for
+    check are only made when first used, so position mustn't be changed until
+    then.
+    """
+    if type(position) is _LazyPosition:
+      position = position.made()
+    if position.board.make_in_place:
+      yield from self._legal_moves_in_place(position)
+      return
+    unsafe = self._unsafe_squares(position)
     for move in self._pseudo_legal_moves(position):
-      p2 = make_move(position, move)
-      if _is_castling_move(position, move):
-        yield (move, p2)
+      if _is_castling_move(position, move) or (unsafe is not None and move.fro not in unsafe):
+        yield (move, _LazyPosition(position, move))
         continue
+      p2 = make_move(position, move)
       king_square = (p2.board.white_king_square if position.to_move == "w" else
                      p2.board.black_king_square)
       assert king_square
-      if self.ignore_check or not self._threatened(p2, position.to_move, king_square):
+      if not self._threatened(p2, position.to_move, king_square):
         yield (move, p2)
 
+  def _legal_moves_in_place(self, position):
+    player = position.to_move
+    unsafe = self._unsafe_squares(position)
+    for move in self._pseudo_legal_moves(position):
+      test = unsafe is None or move.fro in unsafe
+      position.make(move)
+      try:
+        castling = position.undo_stack[-1][2]
+        king_square = (position.board.white_king_square if player == "w" else
+                       position.board.black_king_square)
+        assert king_square
+        if castling or not test or not self._threatened(position, player, king_square):
+          yield (move, position)
+      finally:
+        position.unmake()
+
+  def _unsafe_squares(self, position):
+    """Returns the squares whose pseudo-legal moves must be tested for check.
+
+    None means every square.  With check_pins and the king not in check,
+    these are the king's square, the squares of pinned pieces and of pawns
+    which could capture en passant.
+    """
+    if self.ignore_check:
+      return ()
+    if not self.check_pins:
+      return None
+    player = position.to_move
+    king_square = (position.board.white_king_square if player == "w" else
+                   position.board.black_king_square)
+    assert king_square
+    if self._threatened(position, player, king_square):
+      return None
+    unsafe = self._pinned(position, player, king_square)
+    unsafe.add(king_square)
+    if position.ep_target:
+      dy = 1 if player == "w" else -1
+      unsafe.update(position.ep_target + (dx, -dy) for dx in (-1, 1))
+    return unsafe
+
+  def _pinned(self, position, player, king_square):
+    """Returns the set of squares of player's pieces pinned to king_square."""
+    own_pieces = white_pieces if player == "w" else black_pieces
+    if isinstance(position.board, MailboxBoard):
+      return _mailbox_pinned(position.board.squares, own_pieces, king_square)
+    board = position.board
+    pinned = set()
+    for ray, (dx, dy) in zip(king_square.queen_rays, queen_deltas):
+      shield = None
+      for to in ray:
+        there = board[to]
+        if there == empty:
+          continue
+        if there in own_pieces:
+          if shield:
+            break
+          shield = to
+          continue
+        if shield and there.lower() in ("q", "r" if dx == 0 or dy == 0 else "b"):
+          pinned.add(shield)
+        break
+    return pinned
+
   def _pseudo_legal_moves(self, position):
     """Yields pseudo-legal moves possible from position.
 
@@ -462,24 +911,21 @@ class ReferenceMoveGen(object):
       if piece == own_pieces[pawn]:
         yield from self._pawn_moves(position, fro, own_pieces, pawn_delta)
       elif piece == own_pieces[rook]:
-        yield from self._slide_moves(position, fro, own_pieces, rook_deltas)
+        yield from self._slide_moves(position, fro, own_pieces, fro.rook_rays)
       elif piece == own_pieces[knight]:
-        yield from self._step_moves(position, fro, own_pieces, knight_deltas)
+        yield from self._step_moves(position, fro, own_pieces, fro.knight_targets)
       elif piece == own_pieces[bishop]:
-        yield from self._slide_moves(position, fro, own_pieces, bishop_deltas)
+        yield from self._slide_moves(position, fro, own_pieces, fro.bishop_rays)
       elif piece == own_pieces[queen]:
-        yield from self._slide_moves(position, fro, own_pieces, queen_deltas)
+        yield from self._slide_moves(position, fro, own_pieces, fro.queen_rays)
       elif piece == own_pieces[king]:
-        yield from self._step_moves(position, fro, own_pieces, king_deltas)
+        yield from self._step_moves(position, fro, own_pieces, fro.king_targets)
     if self.allow_castling:
       yield from self._castling_moves(position)
 
-  def _slide_moves(self, position, fro, own_pieces, deltas):
-    for dx, dy in deltas:
-      for n in range(1, 8):
-        to = fro + (dx * n, dy * n)
-        if not to.in_bounds:
-          break
+  def _slide_moves(self, position, fro, own_pieces, rays):
+    for ray in rays:
+      for to in ray:
         there = position.board[to]
         if there == empty:
           yield Move(fro=fro, to=to)
@@ -488,13 +934,11 @@ class ReferenceMoveGen(object):
             yield Move(fro=fro, to=to)
           break
 
-  def _step_moves(self, position, fro, own_pieces, deltas):
-    for dx, dy in deltas:
-      to = fro + (dx, dy)
-      if to.in_bounds:
-        there = position.board[to]
-        if there == empty or there not in own_pieces:
-          yield Move(fro=fro, to=to)
+  def _step_moves(self, position, fro, own_pieces, targets):
+    for to in targets:
+      there = position.board[to]
+      if there == empty or there not in own_pieces:
+        yield Move(fro=fro, to=to)
 
   def _pawn_moves(self, position, fro, own_pieces, dy):
     from_start_rank = (fro.y == 2 and dy == 1) or (fro.y == 7 and dy == -1)
@@ -578,22 +1022,17 @@ class ReferenceMoveGen(object):
     does not subject attacker moves to pins or check restrictions.
     """
     enemy_pieces = black_pieces if player == "w" else white_pieces
+    if isinstance(position.board, MailboxBoard):
+      return _mailbox_threatened(position.board.squares, enemy_pieces, square)
     # It's much faster for perft to access the board array directly here, rather
     # than using __getitem__, and is about as clear.
-    x, y = square.x, square.y
-    for dx, dy in knight_deltas:
-      xp, yp = x + dx, y + dy
-      if 1 <= xp <= 8 and 1 <= yp <= 8:
-        there = position.board.ranks[8 - yp][xp - 1]
-        if there == enemy_pieces[knight]:
-          return True
-    for dx, dy in queen_deltas:
-      xp, yp = x, y
-      for n in range(1, 8):
-        xp += dx; yp += dy
-        if not (1 <= xp <= 8 and 1 <= yp <= 8):
-          break
-        there = position.board.ranks[8 - yp][xp - 1]
+    ranks = position.board.ranks
+    for to in square.knight_targets:
+      if ranks[8 - to.y][to.x - 1] == enemy_pieces[knight]:
+        return True
+    for ray, (dx, dy) in zip(square.queen_rays, queen_deltas):
+      for n, to in enumerate(ray, 1):
+        there = ranks[8 - to.y][to.x - 1]
         if there == empty:
           continue
         if there not in enemy_pieces:
@@ -615,14 +1054,211 @@ class ReferenceMoveGen(object):
     return False
 
 
-def perft(position, move_gen, depth=1):
+_san_move_gen = ReferenceMoveGen(allow_castling=False)
+
+_mailbox_knight_offsets = [10 * dy + dx for dx, dy in knight_deltas]
+_mailbox_queen_offsets = [(10 * dy + dx, dx, dy) for dx, dy in queen_deltas]
+
+def _mailbox_threatened(squares, enemy_pieces, square):
+  """ReferenceMoveGen._threatened for MailboxBoards."""
+  s = _mailbox_index(square.x, square.y)
+  enemy_knight = enemy_pieces[knight]
+  for d in _mailbox_knight_offsets:
+    if squares[s + d] == enemy_knight:
+      return True
+  for d, dx, dy in _mailbox_queen_offsets:
+    t = s + d
+    there = squares[t]
+    n = 1
+    while there == empty:
+      t += d
+      there = squares[t]
+      n += 1
+    if there not in enemy_pieces:
+      continue
+    # NB: Ignore en passant pawn captures.
+    if (n == 1 and
+        ((there == "p" and dy == +1) or (there == "P" and dy == -1)) and
+        dx != 0):
+      return True
+    there = there.lower()
+    if there == "r" and (dx == 0 or dy == 0):
+      return True
+    if there == "b" and not (dx == 0 or dy == 0):
+      return True
+    if there == "q":
+      return True
+    if there == "k" and n == 1:
+      return True
+  return False
+
+def _mailbox_pinned(squares, own_pieces, square):
+  """ReferenceMoveGen._pinned for MailboxBoards."""
+  s = _mailbox_index(square.x, square.y)
+  pinned = set()
+  for d, dx, dy in _mailbox_queen_offsets:
+    t = s + d
+    while squares[t] == empty:
+      t += d
+    if squares[t] not in own_pieces:
+      continue
+    shield = t
+    t += d
+    while squares[t] == empty:
+      t += d
+    there = squares[t]
+    if there != offboard and there not in own_pieces and there.lower() in (
+        "q", "r" if dx == 0 or dy == 0 else "b"):
+      pinned.add(Square(x=shield % 10, y=shield // 10 - 1))
+  return pinned
+
+
+def perft(position, move_gen, depth=1, cache=None):
   """Sums numbers of moves possible at each depth starting from position.
 
-  These counts are useful to validate move generation.
+  These counts are useful to validate move generation.  Move generators which
+  can count moves themselves without building positions (like BitboardMoveGen)
+  do so.
+
+  If cache is a PerftCache, counts for transposed subtrees are looked up by
+  position key instead of being counted again.  This always uses
+  move_gen.legal_moves(), so leave cache unset to check a generator's own
+  perft() or to get counts that don't depend on Zobrist keys.
   """
+  if cache is not None:
+    return _cached_perft(position, move_gen, depth, cache)
+  if hasattr(move_gen, "perft"):
+    return move_gen.perft(position, depth=depth)
   if depth == 0: return 1
-  moves = list(move_gen.legal_moves(position))
   count = 0
-  for move, p2 in moves:
+  for move, p2 in move_gen.legal_moves(position):
     count += perft(p2, move_gen, depth=depth-1)
   return count
+
+def _cached_perft(position, move_gen, depth, cache):
+  if depth == 0: return 1
+  key = position.key
+  count = cache.get(key, depth)
+  if count is not None:
+    return count
+  count = 0
+  for move, p2 in move_gen.legal_moves(position):
+    count += _cached_perft(p2, move_gen, depth - 1, cache)
+  cache.put(key, depth, count)
+  return count
+
+
+class PerftCache(object):
+  """A fixed-size transposition table of perft counts.
+
+  Counts are keyed by position key and remaining depth.  Each key and depth
+  hashes to a single slot, and a new count only replaces the one there if it
+  is for at least as deep a subtree, since deeper counts save more work.
+
+  The table holds about megabytes of counts.  A cache must only be shared by
+  perft runs using the same move generator options.  hits, misses and
+  evictions count lookups found, lookups not found and stores which replaced
+  a different entry.
+  """
+  # Rough size of a slot: three list entries plus int objects for key and count.
+  entry_bytes = 100
+
+  def __init__(self, megabytes=16):
+    self.size = max(1, megabytes * 2**20 // PerftCache.entry_bytes)
+    self.keys = [None] * self.size
+    self.depths = [0] * self.size
+    self.counts = [0] * self.size
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def _slot(self, key, depth):
+    return (key ^ _zobrist_depth[depth & 63]) % self.size
+
+  def get(self, key, depth):
+    """Returns the count stored for key and depth, or None."""
+    i = self._slot(key, depth)
+    if self.keys[i] == key and self.depths[i] == depth:
+      self.hits += 1
+      return self.counts[i]
+    self.misses += 1
+    return None
+
+  def put(self, key, depth, count):
+    """Stores count for key and depth unless a deeper count is in its slot."""
+    i = self._slot(key, depth)
+    if self.keys[i] is not None:
+      if self.depths[i] > depth:
+        return
+      if self.keys[i] != key or self.depths[i] != depth:
+        self.evictions += 1
+    self.keys[i] = key
+    self.depths[i] = depth
+    self.counts[i] = count
+
+  def __str__(self):
+    lookups = self.hits + self.misses
+    rate = 100 * self.hits / lookups if lookups else 0
+    return (f"{self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), "
+            f"{self.evictions} evictions, {self.size} entries")
+
+_zobrist_depth = [_zobrist_random.getrandbits(64) for depth in range(64)]
+
+
+class LegalMoveCache(object):
+  """A bounded LRU cache of the legal moves of positions.
+
+  Move lists are keyed by position key and the move generator's options, so
+  positions reached in different ways share an entry.  Once entries lists
+  are cached, each new one evicts the least recently used.  hits, misses and
+  evictions count lookups found, lookups not found and lists dropped.  Safe
+  to use from several threads.
+  """
+  def __init__(self, entries=4096):
+    self.size = entries
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._lock = threading.Lock()
+
+  def legal_moves(self, position, move_gen):
+    """Returns a list of the legal moves of position from move_gen."""
+    key = (position.key, type(move_gen), move_gen.ignore_check, move_gen.allow_castling,
+           move_gen.allow_en_passant_captures, move_gen.allowed_promotions)
+    with self._lock:
+      moves = self.entries.get(key)
+      if moves is not None:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return moves
+      self.misses += 1
+    moves = [move for move, _ in move_gen.legal_moves(position)]
+    with self._lock:
+      self.entries[key] = moves
+      if len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+    return moves
+
+  def clear(self):
+    with self._lock:
+      self.entries.clear()
+
+  def __str__(self):
+    lookups = self.hits + self.misses
+    rate = 100 * self.hits / lookups if lookups else 0
+    return (f"{self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), "
+            f"{self.evictions} evictions, {len(self.entries)}/{self.size} entries")
+
+legal_move_cache = LegalMoveCache()
+
+def legal_move_list(position, move_gen=None):
+  """Returns a list of position's legal moves, cached in legal_move_cache.
+
+  move_gen defaults to a ReferenceMoveGen with all rules.  Callers must not
+  modify the list.
+  """
+  return legal_move_cache.legal_moves(position, move_gen or _default_move_gen)
+
+_default_move_gen = ReferenceMoveGen()
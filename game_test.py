@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import copy
+import functools
 import unittest
 from game import *
 
@@ -40,6 +42,33 @@ class TestSquare(unittest.TestCase):
     self.assertEqual(Square(x=4, y=4) + (0, -1), Square(x=4, y=3))
     self.assertEqual(Square(x=4, y=4) + (-1, 0), Square(x=3, y=4))
     self.assertEqual(Square(x=4, y=4) + (3, 0), Square(x=7, y=4))
+    self.assertIs(Square(x=8, y=4) + (1, 0), Square.offboard)
+
+  def testInterned(self):
+    self.assertIs(Square(x=5, y=4), Square.e4)
+    self.assertIs(Square.named("e4"), Square.e4)
+    self.assertIs(Square.e3 + (0, 1), Square.e4)
+    self.assertIs(Square(x=0, y=4), Square.offboard)
+    self.assertIs(copy.deepcopy(Square.e4), Square.e4)
+    with self.assertRaises(AttributeError):
+      Square.e4.x = 1
+
+  def testRays(self):
+    self.assertEqual(Square.a1.rook_rays,
+                     ((Square.b1, Square.c1, Square.d1, Square.e1, Square.f1, Square.g1, Square.h1),
+                      (),
+                      (Square.a2, Square.a3, Square.a4, Square.a5, Square.a6, Square.a7, Square.a8),
+                      ()))
+    self.assertEqual(Square.c2.bishop_rays,
+                     ((Square.b3, Square.a4),
+                      (Square.d3, Square.e4, Square.f5, Square.g6, Square.h7),
+                      (Square.b1,),
+                      (Square.d1,)))
+    self.assertEqual(Square.c2.queen_rays, Square.c2.rook_rays + Square.c2.bishop_rays)
+
+  def testTargets(self):
+    self.assertEqual(Square.b1.knight_targets, (Square.d2, Square.a3, Square.c3))
+    self.assertEqual(Square.h8.king_targets, (Square.g8, Square.h7, Square.g7))
 
 
 class TestBoard(unittest.TestCase):
@@ -84,6 +113,47 @@ class TestBoard(unittest.TestCase):
     self.assertEqual(self.initial.find("k"), Square.e8)
 
 
+class TestMailboxBoard(unittest.TestCase):
+  def setUp(self):
+    self.initial = MailboxBoard.unpack("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR")
+
+  def testStr(self):
+    self.assertEqual(str(self.initial), "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR")
+
+  def testEqualsBoard(self):
+    self.assertEqual(self.initial, Board.unpack("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"))
+    self.assertEqual(list(self.initial), list(Board.unpack("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR")))
+
+  def testNotEqualsWithExtraPieces(self):
+    kings = MailboxBoard.unpack("4k3/8/8/8/8/8/8/4K3")
+    for extra in (MailboxBoard.unpack("4k2r/8/8/8/8/8/8/4K3"), Board.unpack("4k2r/8/8/8/8/8/8/4K3")):
+      self.assertNotEqual(kings, extra)
+
+  def testGetSet(self):
+    self.assertEqual(self.initial[Square.a8], "r")
+    self.assertEqual(self.initial[Square.g2], "P")
+    self.initial[Square.e2], self.initial[Square.e4] = empty, "P"
+    self.assertEqual(self.initial[Square.e2], empty)
+    self.assertEqual(self.initial[Square.e4], "P")
+    self.assertEqual(str(self.initial), "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR")
+
+  def testSentinels(self):
+    self.assertEqual(self.initial.squares.count(offboard), 120 - 64)
+    self.assertEqual(self.initial.squares[21], "R")
+    self.assertEqual(self.initial.squares[98], "r")
+
+  def testFind(self):
+    self.assertEqual(self.initial.find("K"), Square.e1)
+    self.assertEqual(self.initial.find("k"), Square.e8)
+    self.assertEqual(self.initial.white_king_square, Square.e1)
+    self.assertEqual(self.initial.black_king_square, Square.e8)
+
+  def testCopy(self):
+    board = self.initial.copy()
+    board[Square.e2] = empty
+    self.assertEqual(self.initial[Square.e2], "P")
+
+
 class TestPosition(unittest.TestCase):
   def testFromFen1(self):
     p = Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
@@ -277,6 +347,117 @@ class TestPosition(unittest.TestCase):
 
   def testEpdSometimesUsesTabs(self):
     p = Position.epd('4rrk1/1bp2ppp/p1q2b1B/1pn2B2/4N1Q1/2P4P/PP3PP1/3RR1K1 w - - bm Nxc5; id	"ECM.1016";')
+    self.assertEqual(p.ops, {"bm": "Nxc5", "id": "ECM.1016"})
+
+  def testEpdOps(self):
+    p = Position.epd('8/8/8/8/8/4k3/8/R3K3 w Q - id "a; b";bm Ra3 Ra2; noop; D1 16 ;')
+    self.assertEqual(p.ops, {"id": "a; b", "bm": "Ra3 Ra2", "noop": "", "D1": "16 "})
+    with self.assertRaises(AssertionError):
+      Position.epd('8/8/8/8/8/4k3/8/R3K3 w Q - bm Ra3')
+
+
+class TestMakeUnmake(unittest.TestCase):
+  def checkMakeUnmake(self, fen, lan, expected_fen):
+    for board_type in (Board, MailboxBoard):
+      p = Position.fen(fen, board_type=board_type)
+      key = p.key
+      expected_key = Position.fen(expected_fen).key
+      p2 = make_move(p, Move.lan(lan))
+      self.assertEqual(str(p2), expected_fen)
+      self.assertEqual(p2.key, expected_key)
+      p.make(Move.lan(lan))
+      self.assertEqual(str(p), expected_fen)
+      self.assertEqual(p.key, expected_key)
+      p.unmake()
+      self.assertEqual(str(p), fen)
+      self.assertEqual(p.key, key)
+      self.assertEqual(p.undo_stack, [])
+
+  def testQuiet(self):
+    self.checkMakeUnmake("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", "g1f3",
+                         "rnbqkbnr/pppppppp/8/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq - 0 1")
+
+  def testDoublePush(self):
+    self.checkMakeUnmake("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", "e2e4",
+                         "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1")
+
+  def testCapture(self):
+    self.checkMakeUnmake("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0", "e2a6",
+                         "r3k2r/p1ppqpb1/Bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPB1PPP/R3K2R b KQkq - 0 0")
+
+  def testEnPassant(self):
+    self.checkMakeUnmake("8/8/8/2k5/2pP4/8/B7/4K3 b - d3 5 3", "c4d3",
+                         "8/8/8/2k5/8/3p4/B7/4K3 w - - 5 3")
+
+  def testPromotion(self):
+    self.checkMakeUnmake("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 b kq - 0 1", "b2a1n",
+                         "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/P2P2PP/n2Q1RK1 w kq - 0 1")
+
+  def testCastling(self):
+    self.checkMakeUnmake("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0", "e1c1",
+                         "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/2KR3R b kq - 0 0")
+    self.checkMakeUnmake("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R b KQkq - 0 0", "e8g8",
+                         "r4rk1/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQ - 0 0")
+
+  def testCaptured(self):
+    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0",
+                     board_type=MailboxBoard)
+    p.make(Move.lan("e2a6"))
+    self.assertEqual(p.captured, "b")
+    p.make(Move.lan("b6c4"))
+    self.assertEqual(p.captured, empty)
+    p.unmake()
+    self.assertEqual(p.captured, "b")
+    p.unmake()
+    self.assertEqual(p.captured, empty)
+
+  def testMscore(self):
+    p = Position.initial(board_type=MailboxBoard)
+    scores = []
+    for lan in ("e2e4", "d7d5", "e4d5", "d8d5", "b1c3", "d5a2"):
+      p.make(Move.lan(lan))
+      scores.append(p.mscore)
+    # Captures count the moving piece's center bonus, but not the captured one's.
+    self.assertEqual(scores, [51, 50, 53, 49, 50, 48])
+    self.assertEqual(make_move(make_move(Position.initial(), Move.lan("e2e4")),
+                               Move.lan("d7d5")).mscore, 50)
+    for _ in scores:
+      p.unmake()
+    self.assertEqual(p.mscore, 50)
+
+  def testMscorePromotion(self):
+    p = Position.fen("8/P7/8/8/8/8/8/k6K w - - 0 1")
+    self.assertEqual(make_move(p, Move.lan("a7a8q")).mscore, 50 + 24)
+    p = Position.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 b kq - 0 1")
+    self.assertEqual(make_move(p, Move.lan("b2a1n")).mscore, 50 - 15 - 6)
+
+  def testMscoreWraps(self):
+    p = Position.fen("3q4/8/8/8/8/8/8/k2R3K w - - 0 1")
+    p.mscore = 90
+    p.make(Move.lan("d1d8"))
+    self.assertEqual(p.mscore, 17)
+    p.unmake()
+    self.assertEqual(p.mscore, 90)
+
+  def testKeyTransposition(self):
+    p = Position.initial()
+    for lan in ("g1f3", "g8f6", "b1c3"):
+      p = make_move(p, Move.lan(lan))
+    q = Position.initial()
+    for lan in ("b1c3", "g8f6", "g1f3"):
+      q = make_move(q, Move.lan(lan))
+    self.assertEqual(p.key, q.key)
+    self.assertEqual(p.key, zobrist_key(p))
+
+  def testKeyDistinguishesState(self):
+    keys = set(Position.fen(fen).key for fen in [
+      "r3k2r/8/8/8/4P3/8/8/R3K2R b KQkq - 0 1",
+      "r3k2r/8/8/8/4P3/8/8/R3K2R w KQkq - 0 1",
+      "r3k2r/8/8/8/4P3/8/8/R3K2R b Kkq - 0 1",
+      "r3k2r/8/8/8/4P3/8/8/R3K2R b KQkq e3 0 1",
+      "r3k2r/8/8/8/8/4P3/8/R3K2R b KQkq - 0 1",
+    ])
+    self.assertEqual(len(keys), 5)
 
 
 class TestMove(unittest.TestCase):
@@ -330,6 +511,13 @@ class TestMove(unittest.TestCase):
     p = Position.epd("3r3r/p4pk1/5Rp1/3q4/1p1P2RQ/5N2/P1P4P/2b4K w - -")
     self.assertEqual(Move.san("Rfxg6+", p), Move(fro=Square.f6, to=Square.g6))
 
+  def testSanMailbox(self):
+    p = Position.epd("5r1k/2p3q1/1p1npr2/pPn1N1pp/P1PN4/R4PPP/4Q1K1/3R4 w - -", board_type=MailboxBoard)
+    self.assertEqual(Move.san("Ndc6", p), Move(fro=Square.d4, to=Square.c6))
+    p = Position.epd("qk4q1/5P2/8/1K6/8/8/8/8 w - -", board_type=MailboxBoard)
+    self.assertEqual(Move.san("fxg8=Q+", p), Move(fro=Square.f7, to=Square.g8, promo="q"))
+    self.assertEqual(str(p.board), "qk4q1/5P2/8/1K6/8/8/8/8")
+
   def testSanCastling(self):
     p = Position.epd("r2q1rk1/pp1bppbp/2np1np1/8/2BNP3/2N1BP2/PPPQ2PP/R3K2R w KQ -")
     self.assertEqual(Move.san("O-O-O", p), Move(fro=Square.e1, to=Square.c1))
@@ -338,6 +526,21 @@ class TestMove(unittest.TestCase):
     p = Position.epd("4r2k/3qbp2/p3bp1p/8/8/P1RQ4/1PP2PPP/2K1R3 b - -")
     self.assertEqual(Move.san("Qa4", p), Move(fro=Square.d7, to=Square.a4))
 
+  def testSanPinnedPiece(self):
+    # Nd4 would be ambiguous, but the knight on e2 is pinned.
+    p = Position.epd("4r1k1/8/8/8/8/1N6/4N3/4K3 w - -")
+    self.assertEqual(Move.san("Nd4", p), Move(fro=Square.b3, to=Square.d4))
+    with self.assertRaises(AssertionError):
+      Move.san("Ng3", p)
+
+  def testSanCacheFollowsMoves(self):
+    p = Position.epd("4k3/8/8/8/8/8/4P3/4K3 w - -", board_type=MailboxBoard)
+    self.assertEqual(Move.san("e4", p), Move.lan("e2e4"))
+    p.make(Move.lan("e2e4"))
+    self.assertEqual(Move.san("Kd7", p), Move.lan("e8d7"))
+    p.unmake()
+    self.assertEqual(Move.san("Kd2", p), Move.lan("e1d2"))
+
   @unittest.skip("useful for debugging but goofy as a test")
   def testAllSanExamples(self):
     import glob
@@ -354,166 +557,172 @@ class TestMove(unittest.TestCase):
 
 
 class TestReferenceMoveGen(unittest.TestCase):
+  board_type = Board
+  move_gen_type = ReferenceMoveGen
+
   def setUp(self):
-    self.move_gen = ReferenceMoveGen()
+    self.move_gen = self.move_gen_type()
+
+  def fen(self, fen):
+    return Position.fen(fen, board_type=self.board_type)
 
   def testPerftInitial(self):
-    p = Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    p = self.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=1), 20)
 
   def testPerftInitialDepth2(self):
-    p = Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    p = self.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=2), 400)
 
   def testPerftInitialDepth3(self):
-    p = Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    p = self.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=3), 8902)
 
   @unittest.skip("slow")
   def testPerftInitialDepth4(self):
-    p = Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    p = self.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=4), 197281)
 
   @unittest.skip("really slow")
   def testPerftInitialDepth5(self):
-    p = Position.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    p = self.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=5), 4865609)
 
   def testPerftJones1(self):
-    p = Position.fen("r6r/1b2k1bq/8/8/7B/8/8/R3K2R b QK - 3 2")
+    p = self.fen("r6r/1b2k1bq/8/8/7B/8/8/R3K2R b QK - 3 2")
     self.assertEqual(perft(p, self.move_gen, depth=1), 8)
 
   def testPerftJones2(self):
-    p = Position.fen("8/8/8/2k5/2pP4/8/B7/4K3 b - d3 5 3")
+    p = self.fen("8/8/8/2k5/2pP4/8/B7/4K3 b - d3 5 3")
     self.assertEqual(perft(p, self.move_gen, depth=1), 8)
 
   def testPerftJones3(self):
-    p = Position.fen("r1bqkbnr/pppppppp/n7/8/8/P7/1PPPPPPP/RNBQKBNR w QqKk - 2 2")
+    p = self.fen("r1bqkbnr/pppppppp/n7/8/8/P7/1PPPPPPP/RNBQKBNR w QqKk - 2 2")
     self.assertEqual(perft(p, self.move_gen, depth=1), 19)
 
   def testPerftJones4(self):
-    p = Position.fen("r3k2r/p1pp1pb1/bn2Qnp1/2qPN3/1p2P3/2N5/PPPBBPPP/R3K2R b QqKk - 3 2")
+    p = self.fen("r3k2r/p1pp1pb1/bn2Qnp1/2qPN3/1p2P3/2N5/PPPBBPPP/R3K2R b QqKk - 3 2")
     self.assertEqual(perft(p, self.move_gen, depth=1), 5)
 
   def testPerftJones5(self):
-    p = Position.fen("2kr3r/p1ppqpb1/bn2Qnp1/3PN3/1p2P3/2N5/PPPBBPPP/R3K2R b QK - 3 2")
+    p = self.fen("2kr3r/p1ppqpb1/bn2Qnp1/3PN3/1p2P3/2N5/PPPBBPPP/R3K2R b QK - 3 2")
     self.assertEqual(perft(p, self.move_gen, depth=1), 44)
 
   def testPerftJones6(self):
-    p = Position.fen("rnb2k1r/pp1Pbppp/2p5/q7/2B5/8/PPPQNnPP/RNB1K2R w QK - 3 9")
+    p = self.fen("rnb2k1r/pp1Pbppp/2p5/q7/2B5/8/PPPQNnPP/RNB1K2R w QK - 3 9")
     self.assertEqual(perft(p, self.move_gen, depth=1), 39)
 
   def testPerftJones7(self):
-    p = Position.fen("2r5/3pk3/8/2P5/8/2K5/8/8 w - - 5 4")
+    p = self.fen("2r5/3pk3/8/2P5/8/2K5/8/8 w - - 5 4")
     self.assertEqual(perft(p, self.move_gen, depth=1), 9)
 
   def testPerftJones8(self):
-    p = Position.fen("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8")
+    p = self.fen("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8")
     self.assertEqual(perft(p, self.move_gen, depth=3), 62379)
 
   def testPerftJones9(self):
-    p = Position.fen("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
+    p = self.fen("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
     self.assertEqual(perft(p, self.move_gen, depth=3), 89890)
 
   @unittest.skip("slow")
   def testPerftJones10(self):
-    p = Position.fen("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1")
+    p = self.fen("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 1134888)
 
   @unittest.skip("slow")
   def testPerftJones11(self):
-    p = Position.fen("8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1")
+    p = self.fen("8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 1015133)
 
   @unittest.skip("slow")
   def testPerftJones12(self):
-    p = Position.fen("8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1")
+    p = self.fen("8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 1440467)
 
   @unittest.skip("slow")
   def testPerftJones13(self):
-    p = Position.fen("5k2/8/8/8/8/8/8/4K2R w K - 0 1")
+    p = self.fen("5k2/8/8/8/8/8/8/4K2R w K - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 661072)
 
   @unittest.skip("slow")
   def testPerftJones14(self):
-    p = Position.fen("3k4/8/8/8/8/8/8/R3K3 w Q - 0 1")
+    p = self.fen("3k4/8/8/8/8/8/8/R3K3 w Q - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 803711)
 
   @unittest.skip("slow")
   def testPerftJones15(self):
-    p = Position.fen("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1")
+    p = self.fen("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=2), 1141)
     self.assertEqual(perft(p, self.move_gen, depth=4), 1274206)
 
   @unittest.skip("slow")
   def testPerftJones16(self):
-    p = Position.fen("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1")
+    p = self.fen("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=4), 1720476)
 
   @unittest.skip("slow")
   def testPerftJones17(self):
-    p = Position.fen("2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1")
+    p = self.fen("2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 3821001)
 
   @unittest.skip("slow")
   def testPerftJones18(self):
-    p = Position.fen("8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1")
+    p = self.fen("8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=5), 1004658)
 
   def testPerftJones19(self):
-    p = Position.fen("4k3/1P6/8/8/8/8/K7/8 w - - 0 1")
+    p = self.fen("4k3/1P6/8/8/8/8/K7/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 217342)
 
   def testPerftJones20(self):
-    p = Position.fen("8/P1k5/K7/8/8/8/8/8 w - - 0 1")
+    p = self.fen("8/P1k5/K7/8/8/8/8/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 92683)
 
   def testPerftJones21(self):
-    p = Position.fen("K1k5/8/P7/8/8/8/8/8 w - - 0 1")
+    p = self.fen("K1k5/8/P7/8/8/8/8/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=6), 2217)
 
   def testPerftJones22(self):
-    p = Position.fen("8/k1P5/8/1K6/8/8/8/8 w - - 0 1")
+    p = self.fen("8/k1P5/8/1K6/8/8/8/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=7), 567584)
 
   def testPerftJones23(self):
-    p = Position.fen("8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1")
+    p = self.fen("8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=4), 23527)
 
   def testPerftKiwipeteDepth3(self):
-    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    p = self.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
     self.assertEqual(perft(p, self.move_gen, depth=3), 97862)
 
   @unittest.skip("slow")
   def testPerftKiwipeteDepth4(self):
-    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    p = self.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
     self.assertEqual(perft(p, self.move_gen, depth=4), 4085603)
 
   def testPerftCporgPosition3Depth4(self):
-    p = Position.fen("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 0")
+    p = self.fen("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 0")
     self.assertEqual(perft(p, self.move_gen, depth=4), 43238)
 
   @unittest.skip("slow")
   def testPerftCporgPosition3Depth5(self):
-    p = Position.fen("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 0")
+    p = self.fen("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 0")
     self.assertEqual(perft(p, self.move_gen, depth=5), 674624)
 
   def testPerftCporgPosition4Depth3(self):
-    p = Position.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
+    p = self.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=3), 9467)
 
   @unittest.skip("slow")
   def testPerftCporgPosition4Depth4(self):
-    p = Position.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
+    p = self.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=4), 422333)
 
   def testPerftTalkchess(self):
-    p = Position.fen("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8")
+    p = self.fen("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8")
     self.assertEqual(perft(p, self.move_gen, depth=3), 62379)
 
   def testPerftEdwardsDepth3(self):
-    p = Position.fen("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
+    p = self.fen("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
     self.assertEqual(perft(p, self.move_gen, depth=3), 89890)
 
   @unittest.skip("slow and sorta redundant")
@@ -522,7 +731,7 @@ class TestReferenceMoveGen(unittest.TestCase):
       for line in f:
         line = line.strip()
         print(line)
-        p = Position.epd(line)
+        p = Position.epd(line, board_type=self.board_type)
         for depth in range(1, 7):
           depth_key = "D" + str(depth)
           if not depth_key in p.ops: break
@@ -533,45 +742,183 @@ class TestReferenceMoveGen(unittest.TestCase):
             break
 
   def testNoEnPassant(self):
-    self.move_gen = ReferenceMoveGen(allow_en_passant_captures=False)
-    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    self.move_gen = self.move_gen_type(allow_en_passant_captures=False)
+    p = self.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
     self.assertEqual(perft(p, self.move_gen, depth=2), 2039 - 1)
 
   def testNoCastling(self):
-    self.move_gen = ReferenceMoveGen(allow_castling=False)
-    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    self.move_gen = self.move_gen_type(allow_castling=False)
+    p = self.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
     self.assertEqual(perft(p, self.move_gen, depth=1), 48 - 2)
 
   def testNoPromotion(self):
-    self.move_gen = ReferenceMoveGen(allowed_promotions="")
-    p = Position.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
+    self.move_gen = self.move_gen_type(allowed_promotions="")
+    p = self.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=2), 264 - 48)
 
   def testOnlyQueenPromotion(self):
-    self.move_gen = ReferenceMoveGen(allowed_promotions="q")
-    p = Position.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
+    self.move_gen = self.move_gen_type(allowed_promotions="q")
+    p = self.fen("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=2), 264 - 36)
 
   def testIgnoreCheckFalse(self):
-    self.move_gen = ReferenceMoveGen(ignore_check=False)
-    p = Position.fen("k7/8/K7/8/8/8/8/8 w - - 0 1")
+    self.move_gen = self.move_gen_type(ignore_check=False)
+    p = self.fen("k7/8/K7/8/8/8/8/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=1), 3)
 
   def testIgnoreCheckFalse_Pin(self):
-    self.move_gen = ReferenceMoveGen(ignore_check=False)
-    p = Position.fen("k1q5/1R6/K7/8/8/8/8/8 w - - 0 1")
+    self.move_gen = self.move_gen_type(ignore_check=False)
+    p = self.fen("k1q5/1R6/K7/8/8/8/8/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=1), 3)
 
   def testIgnoreCheckTrue(self):
-    self.move_gen = ReferenceMoveGen(ignore_check=True)
-    p = Position.fen("k7/8/K7/8/8/8/8/8 w - - 0 1")
+    self.move_gen = self.move_gen_type(ignore_check=True)
+    p = self.fen("k7/8/K7/8/8/8/8/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=1), 5)
 
   def testIgnoreCheckTrue_Pin(self):
-    self.move_gen = ReferenceMoveGen(ignore_check=True)
-    p = Position.fen("k1q5/1R6/K7/8/8/8/8/8 w - - 0 1")
+    self.move_gen = self.move_gen_type(ignore_check=True)
+    p = self.fen("k1q5/1R6/K7/8/8/8/8/8 w - - 0 1")
     self.assertEqual(perft(p, self.move_gen, depth=1), 14 + 4)
 
 
+class TestPerftCache(unittest.TestCase):
+  def testCachedPerft(self):
+    p = Position.initial(board_type=MailboxBoard)
+    cache = PerftCache(megabytes=1)
+    self.assertEqual(perft(p, ReferenceMoveGen(), depth=4, cache=cache), 197281)
+    self.assertGreater(cache.hits, 0)
+    # Counts found in the cache are the same second time around.
+    self.assertEqual(perft(p, ReferenceMoveGen(), depth=4, cache=cache), 197281)
+
+  def testCachedPerftTinyCache(self):
+    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    cache = PerftCache(megabytes=0)
+    self.assertEqual(cache.size, 1)
+    self.assertEqual(perft(p, ReferenceMoveGen(), depth=2, cache=cache), 2039)
+    self.assertGreater(cache.evictions, 0)
+
+  def testReplaceByDepth(self):
+    cache = PerftCache(megabytes=0)
+    cache.put(1, 3, 100)
+    cache.put(2, 2, 50)
+    self.assertEqual(cache.get(1, 3), 100)
+    self.assertIsNone(cache.get(2, 2))
+    cache.put(2, 4, 500)
+    self.assertEqual(cache.get(2, 4), 500)
+    self.assertIsNone(cache.get(1, 3))
+    self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 2, 1))
+
+
+class TestLegalMoveCache(unittest.TestCase):
+  def testHits(self):
+    cache = LegalMoveCache(entries=2)
+    p = Position.initial(board_type=MailboxBoard)
+    moves = cache.legal_moves(p, ReferenceMoveGen())
+    self.assertEqual(len(moves), 20)
+    self.assertIs(cache.legal_moves(Position.initial(), ReferenceMoveGen()), moves)
+    p.make(Move.lan("e2e4"))
+    self.assertEqual(len(cache.legal_moves(p, ReferenceMoveGen())), 20)
+    p.unmake()
+    self.assertIs(cache.legal_moves(p, ReferenceMoveGen()), moves)
+    self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 2, 0))
+
+  def testMoveGenOptions(self):
+    cache = LegalMoveCache()
+    p = Position.fen("4k3/8/8/8/8/8/8/4K2R w K - 0 1")
+    self.assertEqual(len(cache.legal_moves(p, ReferenceMoveGen())), 15)
+    self.assertEqual(len(cache.legal_moves(p, ReferenceMoveGen(allow_castling=False))), 14)
+
+  def testLeastRecentlyUsedIsEvicted(self):
+    cache = LegalMoveCache(entries=2)
+    gen = ReferenceMoveGen()
+    a, b, c = (Position.fen(fen) for fen in ("4k3/8/8/8/8/8/8/4K3 w - - 0 1",
+                                             "4k3/8/8/8/8/8/8/4K3 b - - 0 1",
+                                             "4k3/8/8/8/8/8/8/3K4 w - - 0 1"))
+    cache.legal_moves(a, gen)
+    cache.legal_moves(b, gen)
+    cache.legal_moves(a, gen)
+    cache.legal_moves(c, gen)
+    self.assertEqual(cache.evictions, 1)
+    cache.legal_moves(a, gen)
+    self.assertEqual((cache.hits, cache.misses), (2, 3))
+    cache.legal_moves(b, gen)
+    self.assertEqual((cache.hits, cache.misses), (2, 4))
+    self.assertEqual(str(cache), "2 hits, 4 misses (33.3% hit rate), 2 evictions, 2/2 entries")
+
+  def testLegalMoveList(self):
+    p = Position.fen("4k3/8/8/8/8/8/8/4K2R w K - 0 1")
+    self.assertIn(Move.white_oo, legal_move_list(p))
+    self.assertNotIn(Move.white_oo, legal_move_list(p, ReferenceMoveGen(allow_castling=False)))
+
+
+class TestReferenceMoveGenMailbox(TestReferenceMoveGen):
+  board_type = MailboxBoard
+
+  def testMovesAreUnmade(self):
+    p = self.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    self.assertEqual(perft(p, self.move_gen, depth=2), 2039)
+    self.assertEqual(str(p), "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    self.assertEqual(p.board.white_king_square, Square.e1)
+    self.assertEqual(p.board.black_king_square, Square.e8)
+    self.assertEqual(p.undo_stack, [])
+
+  def testStopEarly(self):
+    p = self.fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    for move, p2 in self.move_gen.legal_moves(p):
+      self.assertIs(p2, p)
+      self.assertEqual(p2.to_move, "b")
+      break
+    self.assertEqual(str(p), "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+
+
+class TestReferenceMoveGenPins(TestReferenceMoveGen):
+  move_gen_type = functools.partial(ReferenceMoveGen, check_pins=True)
+
+  def testPinned(self):
+    p = self.fen("4r1k1/8/8/b7/8/2P5/4N3/r1R1K3 w - - 0 1")
+    self.assertEqual(self.move_gen._pinned(p, "w", Square.e1), {Square.e2, Square.c3, Square.c1})
+    # Pinned pieces can still move along the pin.
+    p = self.fen("4r1k1/8/8/8/8/8/4N3/rR2K3 w - - 0 1")
+    self.assertEqual(self.move_gen._pinned(p, "w", Square.e1), {Square.e2, Square.b1})
+    self.assertEqual(self.move_gen._unsafe_squares(p), {Square.e2, Square.b1, Square.e1})
+    self.assertEqual(sorted(str(m) for m, _ in self.move_gen.legal_moves(p) if m.fro == Square.b1),
+                     ["b1a1", "b1c1", "b1d1"])
+
+  def testNextPositionsMadeWhenUsed(self):
+    if self.board_type.make_in_place:
+      self.skipTest("next positions are made in place")
+    p = self.fen("4r1k1/8/8/8/8/8/4N3/rR2K3 w - - 0 1")
+    for move, p2 in self.move_gen.legal_moves(p):
+      # Only moves that could expose the king are made to test them.
+      self.assertEqual(isinstance(p2, Position), move.fro in (Square.e1, Square.e2, Square.b1))
+      expected = make_move(p, move)
+      self.assertEqual(str(p2), str(expected))
+      self.assertEqual(p2.key, expected.key)
+
+  def testNextPositionsCheckParentUnchanged(self):
+    if self.board_type.make_in_place:
+      self.skipTest("next positions are made in place")
+    p = self.fen("4r1k1/8/8/8/8/8/4N2P/rR2K3 w - - 0 1")
+    p2 = next(p2 for move, p2 in self.move_gen.legal_moves(p) if move == Move.lan("h2h3"))
+    p.mscore = 60
+    with self.assertRaises(AssertionError):
+      p2.mscore
+
+  def testInCheck(self):
+    p = self.fen("4r1k1/8/8/8/8/8/8/R3K3 w - - 0 1")
+    self.assertIsNone(self.move_gen._unsafe_squares(p))
+
+  def testEnPassantDiscoveredCheck(self):
+    # Taking en passant would expose the king along the rank.
+    p = self.fen("8/8/8/K1pP3r/8/8/8/7k w - c6 0 1")
+    self.assertNotIn(Move.lan("d5c6"), [m for m, _ in self.move_gen.legal_moves(p)])
+    self.assertEqual(self.move_gen._unsafe_squares(p), {Square.a5, Square.b5, Square.d5})
+
+
+class TestReferenceMoveGenPinsMailbox(TestReferenceMoveGenPins):
+  board_type = MailboxBoard
+
+
 if __name__ == "__main__":
   unittest.main()
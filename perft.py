@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Runs perft over an EPD suite on a process pool and checks D1..D6 counts.
+
+Each root move of each position is counted in a separate task, so deep runs
+over the whole suite keep every core busy.  For example,
+
+  python perft.py --depth 5 benchmarks/perftsuite.epd
+  python perft.py --depth 6 --divide --line 1 benchmarks/perftsuite.epd
+"""
+import argparse
+import concurrent.futures
+import functools
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from game import Board, MailboxBoard, PerftCache, Position, ReferenceMoveGen, perft
+from bitboard import BitboardMoveGen
+from epd import read_lines
+
+move_gens = {"reference": ReferenceMoveGen,
+             "pins": functools.partial(ReferenceMoveGen, check_pins=True),
+             "bitboard": BitboardMoveGen}
+board_types = {"board": Board, "mailbox": MailboxBoard}
+
+
+@dataclass
+class PerftResult:
+  epd: str
+  depth: int
+  nodes: int
+  expected: Optional[int]
+  seconds: float
+  divide: List[Tuple[str, int]] = field(default_factory=list)
+
+  @property
+  def ok(self):
+    return self.expected is None or self.nodes == self.expected
+
+
+def _load(epd, board):
+  return Position.epd(epd, board_type=board_types[board])
+
+
+_worker_cache = None
+
+def _divide_task(epd, depth, index, move_gen, board, cache_mb):
+  """Counts leaves under the index'th root move of epd.  Runs in a worker.
+
+  With cache_mb, each worker keeps one PerftCache for all of its tasks.
+  """
+  global _worker_cache
+  start = time.perf_counter()
+  cache = None
+  if cache_mb:
+    if _worker_cache is None or _worker_cache[0] != (move_gen, cache_mb):
+      _worker_cache = ((move_gen, cache_mb), PerftCache(megabytes=cache_mb))
+    cache = _worker_cache[1]
+  gen = move_gens[move_gen]()
+  for i, (move, p2) in enumerate(gen.legal_moves(_load(epd, board))):
+    if i == index:
+      count = perft(p2, gen, depth=depth - 1, cache=cache)
+      return str(move), count, time.perf_counter() - start
+  raise IndexError(f"no root move {index} in {epd}")
+
+
+def expected_counts(position):
+  """Returns {depth: nodes} from the D1..D6 ops of an EPD position."""
+  return {int(op[1:]): int(value) for op, value in position.ops.items()
+          if op[0] == "D" and op[1:].isdigit()}
+
+
+def run(epds, depths, executor, move_gen="reference", board="board", max_nodes=None,
+        cache_mb=None):
+  """Runs perft for every (epd, depth) pair, yielding PerftResults in order.
+
+  Every root move of every job is submitted to executor up front, so results
+  for early lines are reported while later ones are still being counted.
+  Depths whose recorded count exceeds max_nodes are skipped.  With cache_mb,
+  workers count with a PerftCache of that many megabytes.
+  """
+  jobs = []
+  for epd in epds:
+    position = _load(epd, board)
+    expected = expected_counts(position)
+    roots = sum(1 for _ in move_gens[move_gen]().legal_moves(position))
+    for depth in depths:
+      if max_nodes is not None and expected.get(depth, 0) > max_nodes:
+        continue
+      if depth == 0:
+        futures = []
+      else:
+        futures = [executor.submit(_divide_task, epd, depth, i, move_gen, board, cache_mb)
+                   for i in range(roots)]
+      jobs.append((epd, depth, expected.get(depth), futures))
+  for epd, depth, expected, futures in jobs:
+    divide = []
+    seconds = 0
+    for future in futures:
+      move, nodes, elapsed = future.result()
+      divide.append((move, nodes))
+      seconds += elapsed
+    nodes = sum(n for _, n in divide) if depth else 1
+    yield PerftResult(epd=epd, depth=depth, nodes=nodes, expected=expected,
+                      seconds=seconds, divide=divide)
+
+
+def _format(result, index):
+  status = "ok" if result.ok else f"FAIL expected {result.expected}"
+  nps = result.nodes / result.seconds if result.seconds else 0
+  return (f"{index:3} D{result.depth} {result.nodes:>11} {result.seconds:8.2f}s "
+          f"{nps:9.0f} nps  {status}  {' '.join(result.epd.split()[:4])}")
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("epd", nargs="?", default="benchmarks/perftsuite.epd",
+                      help="EPD file with D1..D6 ops")
+  parser.add_argument("--depth", "-d", type=int, default=4, help="deepest depth to run")
+  parser.add_argument("--all-depths", action="store_true",
+                      help="run every depth up to --depth instead of only the deepest")
+  parser.add_argument("--max-nodes", type=int, help="skip depths with more recorded nodes")
+  parser.add_argument("--line", "-l", type=int, action="append",
+                      help="only run the given (1-based) line of the EPD file")
+  parser.add_argument("--jobs", "-j", type=int, help="worker processes (default: all cores)")
+  parser.add_argument("--divide", action="store_true", help="print counts for each root move")
+  parser.add_argument("--move-gen", choices=sorted(move_gens), default="reference")
+  parser.add_argument("--board", choices=sorted(board_types), default="board")
+  parser.add_argument("--cache-mb", type=int,
+                      help="count transpositions once using a cache of this size per worker")
+  args = parser.parse_args()
+
+  lines = list(read_lines(args.epd))
+  if args.line:
+    lines = [(i, line) for i, line in lines if i in args.line]
+  depths = range(1, args.depth + 1) if args.all_depths else [args.depth]
+
+  start = time.perf_counter()
+  total_nodes = 0
+  failures = 0
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+    results = run([line for _, line in lines], depths, executor,
+                  move_gen=args.move_gen, board=args.board, max_nodes=args.max_nodes,
+                  cache_mb=args.cache_mb)
+    indices = {line: i for i, line in lines}
+    for result in results:
+      print(_format(result, indices[result.epd]), flush=True)
+      if args.divide:
+        for move, nodes in sorted(result.divide):
+          print(f"    {move:5} {nodes}")
+      total_nodes += result.nodes
+      failures += not result.ok
+  wall = time.perf_counter() - start
+  print(f"{total_nodes} nodes in {wall:.2f}s wall ({total_nodes / wall:.0f} nps), "
+        f"{failures} failures")
+  return 1 if failures else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import concurrent.futures
+import unittest
+from perft import *
+
+
+class TestPerft(unittest.TestCase):
+  def setUp(self):
+    self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+
+  def tearDown(self):
+    self.executor.shutdown()
+
+  def testDivide(self):
+    epd = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - D1 48; D2 2039;"
+    results = list(run([epd], [1, 2], self.executor))
+    self.assertEqual([r.nodes for r in results], [48, 2039])
+    self.assertTrue(all(r.ok for r in results))
+    divide = dict(results[1].divide)
+    self.assertEqual(len(divide), 48)
+    self.assertEqual(divide["e1g1"], 43)
+    self.assertEqual(divide["a2a4"], 44)
+
+  def testMismatch(self):
+    epd = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - D1 20; D2 401;"
+    result, = run([epd], [2], self.executor)
+    self.assertEqual(result.nodes, 400)
+    self.assertFalse(result.ok)
+
+  def testMaxNodes(self):
+    epds = ["4k3/8/8/8/8/8/8/4K2R w K - D1 15; D2 66; D3 1197;",
+            "4k3/8/8/8/8/8/8/R3K3 w Q - D1 16; D2 71; D3 1287;"]
+    results = list(run(epds, [1, 2, 3], self.executor, move_gen="bitboard",
+                       board="mailbox", max_nodes=1200))
+    self.assertEqual([(r.depth, r.nodes) for r in results],
+                     [(1, 15), (2, 66), (3, 1197), (1, 16), (2, 71)])
+    self.assertTrue(all(r.ok for r in results))
+
+  def testCache(self):
+    epd = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - D1 48; D2 2039; D3 97862;"
+    result, = run([epd], [3], self.executor, board="mailbox", cache_mb=1)
+    self.assertEqual(result.nodes, 97862)
+
+
+if __name__ == "__main__":
+  unittest.main()
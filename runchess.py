@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from game import Board, Position, ReferenceMoveGen, Square, Move, make_move
+from game import Board, Position, Square, Move, legal_move_list, make_move
 from subprocess import run, PIPE, Popen
 import signal
 import time
@@ -59,10 +59,7 @@ def send_position_to_sim(sim, position):
   sim.stdin.flush()
 
 def is_legal(position, move):
-  for legal_move, _ in ReferenceMoveGen().legal_moves(position):
-    if move == legal_move:
-      return True
-  return False
+  return move in legal_move_list(position)
 
 def print_board(position):
   print('  abcdefgh')
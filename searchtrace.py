@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Records TestEngine's search in a compact binary trace.
+
+A SearchTrace keeps fixed size records in an in-memory ring, so tracing a
+long search costs a few bytes per move and keeps only the most recent
+records.  Set level to CUTOFFS to record just the moves that caused a
+cutoff, or FULL to record every move tried, every move returned from and
+every prune.  Saved traces can be rendered as the text debug_moves.py reads,
+
+  python searchtrace.py /tmp/trace.bin > /tmp/debug && python debug_moves.py > tree.html
+"""
+import argparse
+import struct
+import sys
+from dataclasses import dataclass
+
+OFF, CUTOFFS, FULL = range(3)
+
+# Record kinds.  START begins a search, with depth set to the search depth.
+START, TRY, RETURN, PRUNE, CUTOFF = range(5)
+_kind_names = ["start", "try", "return", "prune", "cutoff"]
+
+# kind, depth, from, to, alpha, beta, score, with squares as ENIAC's yx.
+_record = struct.Struct("7B")
+
+
+@dataclass
+class TraceRecord:
+  kind: int
+  depth: int  # remaining depth, as in TestEngine._search
+  fro: int
+  to: int
+  alpha: int
+  beta: int
+  score: int
+
+  @property
+  def move(self):
+    """The move as FFTT, as printed by ENIAC."""
+    return f"{self.fro:02}{self.to:02}"
+
+  def __str__(self):
+    if self.kind == START:
+      return f"start depth {self.depth}"
+    return (f"{_kind_names[self.kind]:6} depth {self.depth} {self.move} "
+            f"alpha {self.alpha} beta {self.beta} score {self.score}")
+
+
+class SearchTrace(object):
+  """A ring of the last capacity trace records.
+
+  TestEngine calls record() for the events level asks for; record() itself
+  doesn't check level.
+  """
+  def __init__(self, level=FULL, capacity=1 << 20):
+    self.level = level
+    self.capacity = capacity
+    self.buffer = bytearray(capacity * _record.size)
+    self.count = 0  # records ever written, including overwritten ones
+
+  def clear(self):
+    self.count = 0
+
+  def start(self, depth):
+    self.record(START, depth, None, 0, 0, 0)
+
+  def record(self, kind, depth, move, alpha, beta, score):
+    fro = move.fro.y * 10 + move.fro.x if move else 0
+    to = move.to.y * 10 + move.to.x if move else 0
+    _record.pack_into(self.buffer, self.count % self.capacity * _record.size,
+                      kind, depth, fro, to, alpha, beta, score)
+    self.count += 1
+
+  def __len__(self):
+    return min(self.count, self.capacity)
+
+  def data(self):
+    """Returns the records in the ring, oldest first, as bytes."""
+    end = self.count % self.capacity * _record.size
+    if self.count <= self.capacity:
+      return bytes(self.buffer[:end])
+    return bytes(self.buffer[end:] + self.buffer[:end])
+
+  def save(self, path):
+    with open(path, "wb") as f:
+      f.write(self.data())
+
+  def __iter__(self):
+    return decode(self.data())
+
+
+def decode(data):
+  """Yields the TraceRecords in data."""
+  for fields in _record.iter_unpack(data):
+    yield TraceRecord(*fields)
+
+
+def load(path):
+  """Returns the TraceRecords saved in path."""
+  with open(path, "rb") as f:
+    return list(decode(f.read()))
+
+
+def render(records, depth=4):
+  """Yields the lines of the text debug_moves.py reads for the last search.
+
+  Each move searched and each move returned from (after a "99" line) is
+  written as three lines: ply and best score so far, FFTT, then alpha and
+  beta.  Moves tried but pruned and cutoffs aren't part of the format and are
+  left out.  depth is the search depth to assume if the START record was
+  overwritten, and debug_moves.py expects 4.
+  """
+  records = list(records)
+  starts = [i for i, record in enumerate(records) if record.kind == START]
+  if starts:
+    depth = records[starts[-1]].depth
+    records = records[starts[-1] + 1:]
+  for record, next_record in zip(records, records[1:] + [None]):
+    if record.kind not in (TRY, RETURN):
+      continue
+    if next_record and next_record.kind == PRUNE:
+      continue
+    if record.kind == RETURN:
+      yield "9900"
+    yield f"{depth - record.depth + 1:02}{record.score:02}"
+    yield record.move
+    yield f"{record.alpha:02}{record.beta:02}"
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Decodes a saved SearchTrace.")
+  parser.add_argument("trace", help="file written by SearchTrace.save()")
+  parser.add_argument("--list", action="store_true",
+                      help="list every record instead of rendering for debug_moves.py")
+  args = parser.parse_args()
+  records = load(args.trace)
+  for line in map(str, records) if args.list else render(records):
+    print(line)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from game import Move, Position
+from searchtrace import *
+import testengine
+
+
+class TestSearchTrace(unittest.TestCase):
+  def search(self, level, fen='4k3/4P3/3PK3/8/8/8/8/8 w - - 0 1', depth=4):
+    engine = testengine.TestEngine()
+    engine.search_trace = SearchTrace(level)
+    engine.evaluate(Position.fen(fen), depth=depth)
+    return engine, list(engine.search_trace)
+
+  def testRecord(self):
+    trace = SearchTrace()
+    trace.record(TRY, 3, Move.lan('b1c3'), 10, 60, 99)
+    self.assertEqual(list(trace), [TraceRecord(TRY, 3, 12, 33, 10, 60, 99)])
+    self.assertEqual(str(list(trace)[0]), 'try    depth 3 1233 alpha 10 beta 60 score 99')
+
+  def testRingKeepsLatest(self):
+    trace = SearchTrace(capacity=3)
+    for score in range(5):
+      trace.record(TRY, 1, Move.lan('a2a3'), 0, 99, score)
+    self.assertEqual(len(trace), 3)
+    self.assertEqual([record.score for record in trace], [2, 3, 4])
+
+  def testLevels(self):
+    engine, records = self.search(OFF)
+    self.assertEqual(records, [TraceRecord(START, 4, 0, 0, 0, 0, 0)])
+    engine, records = self.search(CUTOFFS)
+    self.assertEqual({record.kind for record in records}, {START, CUTOFF})
+    self.assertEqual(len(records) - 1, engine.cutoffs)
+    engine, records = self.search(FULL)
+    kinds = [(record.kind, record.depth) for record in records]
+    self.assertEqual(sum(kind == PRUNE for kind, _ in kinds), engine.pruned)
+    self.assertEqual(kinds.count((TRY, 1)) - kinds.count((PRUNE, 1)),
+                     engine.node_count + engine.leaf_non_captures)
+
+  def testRender(self):
+    # d6d7 mates, so black has no replies and every other move is pruned.
+    _, records = self.search(FULL)
+    self.assertEqual(list(render(records)), ['0100', '6474', '0099',
+                                             '9900', '0199', '6474', '9999'])
+    _, records = self.search(FULL, fen='4k3/8/4K3/8/8/8/8/7R w - - 0 1', depth=2)
+    lines = list(render(records))
+    self.assertEqual(lines.count('9900'), sum(record.kind == RETURN for record in records))
+    self.assertEqual(lines[:6], ['0100', '1817', '0099', '0299', '8586', '0099'])
+
+  def testSaveAndLoad(self):
+    engine, records = self.search(FULL)
+    with tempfile.TemporaryDirectory() as scratch:
+      path = os.path.join(scratch, 'trace.bin')
+      engine.search_trace.save(path)
+      self.assertEqual(load(path), records)
+
+
+if __name__ == '__main__':
+  unittest.main()
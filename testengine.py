@@ -1,88 +1,541 @@
+import argparse
+import concurrent.futures
 import math
+import sys
+import time
 
+import searchtrace
+from epd import read_positions
 from uciengine import UCIEngine
-from game import ReferenceMoveGen, empty, white_pieces, black_pieces, Square
+from game import ReferenceMoveGen, MailboxBoard, legal_move_list, empty
 
 class TestEngine(UCIEngine):
-  """A simple model of the eniac chess algorithm for experimentation."""
+  """A simple model of the eniac chess algorithm for experimentation.
+
+  By default the search is faithful to ENIAC: a single fixed depth search
+  visiting moves in the same order as asm/search.asm, so node counts and the
+  moves recorded in search_trace (a searchtrace.SearchTrace, if not None)
+  can be checked against the VM.  Setting faithful = False
+  searches with iterative deepening, trying the previous iteration's best move
+  first, and uses transposition_table (if not None) to reuse results and order
+  moves.  Either way, move_ordering can be set to a MoveOrdering to sort moves
+  before searching them; None keeps ENIAC's board order.
+
+  If executor is set to a concurrent.futures executor, faithful searches
+  split at the root: the first root move is searched here and the rest on
+  executor, split_width at a time (None for all at once).  The best move and
+  score are the same as searching serially.  Traced searches (with trace or
+  search_trace set) stay serial so every move is traced in ENIAC's order.
+
+  Setting pvs searches every move after the first at a node with a null
+  window first, and aspiration_window (if not None, at least 1) starts each
+  iteration of iterative deepening with a window that far either side of an
+  earlier iteration's score.  Both keep scores in 0..99 like asm/search.asm and
+  find the same best score, though aspiration windows can change which of
+  several equally good moves is chosen.
+
+  Each search counts leaves in node_count, and also the interior nodes whose
+  moves were searched (expanded) and the moves they tried (moves_tried),
+  which estimate.py uses to project ENIAC's search time.
+  """
 
   def __init__(self):
     super().__init__(name="Cheetah", author="et al")
-    self.debug_file = open("/tmp/moves.out", "w")
     self.node_count = 0
     self.pruned = 0
     self.leaf_non_captures = 0
+    self.expanded = 0
+    self.moves_tried = 0
+    self.cutoffs = 0
+    self.first_move_cutoffs = 0
+    self.researches = 0
     self.update_ab_at_depth_1 = True
+    self.faithful = True
+    self.node_limit = None
+    self.trace = None
+    self.search_trace = None
+    self.transposition_table = TranspositionTable()
+    self.move_ordering = None
+    self.executor = None
+    self.split_width = None
+    self.pvs = False
+    self.aspiration_window = None
     self.move_gen = ReferenceMoveGen(allow_castling=False,
                                      allow_en_passant_captures=False,
-                                     allowed_promotions='q')
+                                     allowed_promotions='q',
+                                     check_pins=True)
 
-  def evaluate(self, position, depth=4):
-    """Depth-first minimax search"""
-    self.node_count = 0
-    self.pruned = 0
-    self.leaf_non_captures = 0
-    best_move, best_score = self._search(position, 0, 99, depth)
+  def evaluate(self, position, limits=None, depth=4):
+    """Depth-first minimax search
+
+    limits.depth overrides depth, and the search stops early once
+    limits.nodes leaves have been searched or self.stop is set.  Moves whose
+    search was stopped are ignored, and searches limited by nodes or time
+    deepen iteratively even if faithful, so there is a shallower search to
+    fall back on.
+    """
+    if limits and limits.depth:
+      depth = limits.depth
+    bounded = limits is not None and (limits.nodes is not None or limits.infinite or
+                                      limits.time_budget(position.to_move) is not None)
+    self.node_limit = limits.nodes if limits else None
+    self._reset_counts()
+    if self.move_ordering:
+      self.move_ordering.clear()
+    if self.transposition_table:
+      self.transposition_table.clear()
+    if self.search_trace is not None:
+      self.search_trace.start(depth)
+    # Search on a copy so moves can be made and unmade in place.  Scores are
+    # relative to the root, as on ENIAC.
+    position = position.with_board_type(MailboxBoard)
+    position.mscore = 50
+    if self.faithful and not bounded:
+      tracing = self.trace is not None or self.search_trace is not None
+      if self.executor is not None and depth > 1 and not tracing:
+        best_move, best_score = self._split_search(position, depth)
+      else:
+        best_move, best_score = self._search(position, 0, 99, depth)
+      self.info(force=True, depth=depth, nodes=self.node_count,
+                score=_centipawns(best_score, position.to_move),
+                pv=[best_move] if best_move else None)
+    else:
+      best_move, best_score = self._iterative_deepening(position, depth)
     self.log.debug(f'best move {best_move} score {best_score}')
     self.log.debug(f'{self.node_count} nodes searched, {self.pruned} pruned')
     self.log.debug(f'{self.leaf_non_captures} leaf non capture moves')
+    self.log.debug(f'{self.cutoffs} cutoffs, {self.first_move_cutoffs} on the first move '
+                   f'({100 * self.first_move_cutoff_rate:.1f}%)')
     return best_move
 
-  def _score(self, position):
-    return 50 + _coarse_material(position) + _center_score(position)
+  @property
+  def first_move_cutoff_rate(self):
+    """The fraction of cutoffs in the last search caused by the first move tried."""
+    return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0
 
-  def _search(self, position, alpha, beta, depth):
+  def _iterative_deepening(self, position, depth):
+    """Searches to depth 1, 2, ... depth, seeding each with the last best move."""
+    best_move, best_score = None, None
+    scores = []
+    for iteration_depth in range(1, depth + 1):
+      node_count, pruned = self.node_count, self.pruned
+      table = self.transposition_table
+      hits = table.hits if table else 0
+      move, score = self._aspiration_search(position, iteration_depth, best_move, scores)
+      scores.append(score)
+      if self._should_stop() and best_move:
+        # Keep the last completed iteration's result.
+        break
+      best_move, best_score = move, score
+      self.log.debug(f'depth {iteration_depth}: best move {best_move} score {best_score}, '
+                     f'{self.node_count - node_count} nodes, {self.pruned - pruned} pruned, '
+                     f'{(table.hits if table else 0) - hits} table hits')
+      self.info(force=True, depth=iteration_depth, nodes=self.node_count,
+                score=_centipawns(best_score, position.to_move),
+                pv=self._principal_variation(position, best_move, iteration_depth))
+    return best_move, best_score
+
+  def _aspiration_search(self, position, depth, first_move, scores):
+    """Searches position with a window around scores (from earlier iterations)
+    if aspiration_window is set, widening it when the score falls outside.
+
+    Scores of odd and even depths differ a lot here, so the window is centered
+    on the score from two iterations back when there is one.
+    """
+    if self.aspiration_window is None or not scores:
+      return self._search(position, 0, 99, depth, first_move=first_move)
+    guess = scores[-2] if len(scores) >= 2 else scores[-1]
+    alpha = max(0, guess - self.aspiration_window)
+    beta = min(99, guess + self.aspiration_window)
+    while True:
+      move, score = self._search(position, alpha, beta, depth, first_move=first_move)
+      if self._should_stop() or (alpha < score < beta or
+                                 (score <= alpha and alpha == 0) or
+                                 (score >= beta and beta == 99)):
+        return move, score
+      self.researches += 1
+      if score <= alpha:
+        alpha = 0
+      else:
+        beta = 99
+      first_move = move or first_move
+
+  def _principal_variation(self, position, best_move, depth):
+    """Returns best_move followed by best replies found in the table."""
+    pv = []
+    move = best_move
+    table = self.transposition_table
+    while move and len(pv) < depth:
+      pv.append(move)
+      position.make(move)
+      entry = table.peek(_table_key(position)) if table else None
+      move = entry and entry[4]
+      if move and move not in legal_move_list(position, self.move_gen):
+        move = None
+    for _ in pv:
+      position.unmake()
+    return pv
+
+  def _search(self, position, alpha, beta, depth, first_move=None, ply=0):
     if depth == 0:
       self.node_count += 1
-      return None, self._score(position)
+      if self.node_count & 1023 == 0:
+        self.info(nodes=self.node_count)
+      return None, position.mscore
+
+    table = None if self.faithful else self.transposition_table
+    if table is not None:
+      entry = table.get(_table_key(position))
+      if entry:
+        _, entry_depth, entry_score, bound, entry_move = entry
+        # Only use scores from the same depth so results match the faithful
+        # search; odd and even depth scores aren't comparable here anyway.
+        if entry_depth == depth and (bound == _exact or
+                                     (bound == _lower and entry_score >= beta) or
+                                     (bound == _upper and entry_score <= alpha)):
+          return entry_move, entry_score
+        first_move = first_move or entry_move
+    original_alpha, original_beta = alpha, beta
+    self.expanded += 1
 
     best_move = None
     best_score = 0 if position.to_move == 'w' else 99
-    for move, p2 in self.move_gen.legal_moves(position):
-      print(_numeric(move), file=self.debug_file)
-      if self.stop.is_set():
+    player = position.to_move
+    # Non-captures at depth 1 are scored as the current position, which
+    # legal_moves() changes while each move is made.
+    if depth == 1:
+      position_score = position.mscore
+    search_trace = self.search_trace
+    level = search_trace.level if search_trace is not None else searchtrace.OFF
+    for i, (move, p2) in enumerate(self._legal_moves(position, first_move, ply)):
+      if level == searchtrace.FULL:
+        search_trace.record(searchtrace.TRY, depth, move, alpha, beta, best_score)
+      if self.trace:
+        self.trace(depth, move, alpha, beta)
+      if self._should_stop():
         break
+      self.moves_tried += 1
       if beta <= alpha:
-        print('pruned', file=self.debug_file)
+        if level == searchtrace.FULL:
+          search_trace.record(searchtrace.PRUNE, depth, move, alpha, beta, best_score)
         self.pruned += 1
         break
-      if depth == 1 and position.board[move.to] == empty:
+      if depth == 1 and p2.captured == empty:
         self.leaf_non_captures += 1
-        score = self._score(position)
+        score = position_score
+      elif self.pvs and i > 0 and depth > 1:
+        # Test whether the move can do better than alpha (or beta for black)
+        # with a null window, and only search it fully if it can.
+        null_alpha, null_beta = (alpha, alpha + 1) if player == 'w' else (beta - 1, beta)
+        _, score = self._search(p2, null_alpha, null_beta, depth - 1, ply=ply + 1)
+        if alpha < score < beta:
+          self.researches += 1
+          _, score = self._search(p2, alpha, beta, depth - 1, ply=ply + 1)
       else:
-        _, score = self._search(p2, alpha, beta, depth - 1)
+        _, score = self._search(p2, alpha, beta, depth - 1, ply=ply + 1)
+      if depth > 1 and self._should_stop():
+        # The move's search was cut short, so its score means nothing.
+        break
       if self.update_ab_at_depth_1 or depth != 1:
-        if position.to_move == 'w' and score > alpha:
+        if player == 'w' and score > alpha:
           alpha = score
-        elif position.to_move == 'b' and score < beta:
+        elif player == 'b' and score < beta:
           beta = score
-      if ((position.to_move == 'w' and score > best_score) or
-          (position.to_move == 'b' and score < best_score)):
+      if ((player == 'w' and score > best_score) or
+          (player == 'b' and score < best_score)):
         best_move = move
         best_score = score
+      if level == searchtrace.FULL and depth > 1:
+        search_trace.record(searchtrace.RETURN, depth, move, alpha, beta, best_score)
+      if beta <= alpha:
+        # The next move will be pruned, unless this was the last one.
+        if level != searchtrace.OFF:
+          search_trace.record(searchtrace.CUTOFF, depth, move, alpha, beta, score)
+        self.cutoffs += 1
+        self.first_move_cutoffs += i == 0
+        if self.move_ordering:
+          self.move_ordering.cutoff(move, p2.board[move.to], p2.captured, ply, depth)
+    if table is not None and not self._should_stop():
+      bound = (_upper if best_score <= original_alpha else
+               _lower if best_score >= original_beta else _exact)
+      table.put(_table_key(position), depth, best_score, bound, best_move)
     return best_move, best_score
 
+  def _split_search(self, position, depth):
+    """Searches position like _search(position, 0, 99, depth), with every
+    root move after the first searched on executor.
+
+    split_width root moves are kept queued on executor, each searched with
+    the window left by the moves merged before it was queued.  That window
+    is never narrower than a serial search would use, so moves take more
+    nodes, but any move that would be chosen scores the same.  Results are
+    merged in move order as _search would, which keeps the choice between
+    equal moves the same.  Nothing is traced, and workers don't stop early
+    for node limits.
+    """
+    moves = [move for move, _ in self._legal_moves(position, None, 0)]
+    player = position.to_move
+    alpha, beta = 0, 99
+    best_move = None
+    best_score = 0 if player == 'w' else 99
+    width = self.split_width or len(moves)
+    options = dict(update_ab_at_depth_1=self.update_ab_at_depth_1, pvs=self.pvs,
+                   move_ordering=self.move_ordering, move_gen=self.move_gen)
+    futures = []
+    self.expanded += 1
+    for i, move in enumerate(moves):
+      if self._should_stop():
+        break
+      self.moves_tried += 1
+      if beta <= alpha:
+        self.pruned += 1
+        break
+      if i == 0:
+        position.make(move)
+        _, score = self._search(position, alpha, beta, depth - 1, ply=1)
+        position.unmake()
+        if self._should_stop():
+          break
+      else:
+        score, counts = futures[i - 1].result()
+        self._add_counts(counts)
+      if player == 'w' and score > alpha:
+        alpha = score
+      elif player == 'b' and score < beta:
+        beta = score
+      if ((player == 'w' and score > best_score) or
+          (player == 'b' and score < best_score)):
+        best_move = move
+        best_score = score
+      if beta <= alpha:
+        self.cutoffs += 1
+        self.first_move_cutoffs += i == 0
+      while len(futures) < min(i + width, len(moves) - 1):
+        futures.append(self.executor.submit(_search_root_move, position, moves[len(futures) + 1],
+                                            alpha, beta, depth, options))
+    for future in futures:
+      future.cancel()
+    return best_move, best_score
+
+  def _reset_counts(self):
+    self.node_count = 0
+    self.pruned = 0
+    self.leaf_non_captures = 0
+    self.expanded = 0
+    self.moves_tried = 0
+    self.cutoffs = 0
+    self.first_move_cutoffs = 0
+    self.researches = 0
 
-_coarse_piece_value = {
-  "k": 0, "p": -3, "b": -6, "n": -6, "r": -15, "q": -27,
-  "K": 0, "P": +3, "B": +6, "N": +6, "R": +15, "Q": +27
+  def _counts(self):
+    return (self.node_count, self.pruned, self.leaf_non_captures, self.expanded,
+            self.moves_tried, self.cutoffs, self.first_move_cutoffs, self.researches)
+
+  def _add_counts(self, counts):
+    (self.node_count, self.pruned, self.leaf_non_captures, self.expanded,
+     self.moves_tried, self.cutoffs, self.first_move_cutoffs, self.researches) = (
+       a + b for a, b in zip(self._counts(), counts))
+
+  def _should_stop(self):
+    return self.stop.is_set() or (self.node_limit is not None and
+                                  self.node_count >= self.node_limit)
+
+  def _legal_moves(self, position, first_move, ply):
+    """Yields legal moves like move_gen.legal_moves, but ordered by
+    move_ordering and with first_move first."""
+    if first_move is None and self.move_ordering is None:
+      yield from self.move_gen.legal_moves(position)
+      return
+    moves = [move for move, _ in self.move_gen.legal_moves(position)]
+    if self.move_ordering:
+      moves = self.move_ordering.order(position, moves, ply)
+    if first_move is not None and first_move in moves:
+      moves.remove(first_move)
+      moves.insert(0, first_move)
+    for move in moves:
+      position.make(move)
+      try:
+        yield move, position
+      finally:
+        position.unmake()
+
+
+_worker_engine = None
+
+def _search_root_move(position, move, alpha, beta, depth, options):
+  """Searches root move in position for TestEngine._split_search.  Runs in a
+  worker, returning the move's score and the worker engine's counts."""
+  global _worker_engine
+  if _worker_engine is None:
+    _worker_engine = TestEngine()
+  engine = _worker_engine
+  for name, value in options.items():
+    setattr(engine, name, value)
+  engine._reset_counts()
+  if engine.move_ordering:
+    engine.move_ordering.clear()
+  position.make(move)
+  _, score = engine._search(position, alpha, beta, depth - 1, ply=1)
+  return score, engine._counts()
+
+
+# Piece values for ordering captures; kings attack last.
+_order_value = {
+  "p": 1, "n": 3, "b": 3, "r": 5, "q": 9, "k": 100,
+  "P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 100,
 }
-def _coarse_material(position):
-  """Returns a coarse material evaluation of a position."""
-  score = 0
-  for sq, piece in position.board:
-    score += _coarse_piece_value[piece]
-  return score
-
-def _center_score(position):
-  """Returns center occupancy bonus for position."""
-  score = 0
-  for x in range(3, 6+1):
-    for y in range(3, 6+1):
-      here = position.board[Square(x, y)]
-      score += (1 if here in white_pieces else
-               -1 if here in black_pieces else 0)
-  return score
-
-def _numeric(move):
-  return f"{move.fro.y}{move.fro.x}{move.to.y}{move.to.x}"
+
+class MoveOrdering(object):
+  """Sorts moves so that the ones likely to cause cutoffs are searched first.
+
+  Captures come first, most valuable victim then least valuable attacker
+  first (MVV-LVA).  Then come killer moves, the last quiet moves to cause a
+  cutoff at the same ply (distance from the root), and then other moves by
+  their history score, which adds remaining depth squared for every cutoff a
+  piece moving to a square caused.  Each stage can be turned
+  off, and moves that tie keep board order.
+  """
+  killers_per_ply = 2
+
+  def __init__(self, mvv_lva=True, killers=True, history=True):
+    self.mvv_lva = mvv_lva
+    self.use_killers = killers
+    self.use_history = history
+    self.clear()
+
+  def clear(self):
+    """Forgets killers and history, e.g. before a new search."""
+    self.killers = {}  # ply -> [move, ...], most recent first
+    self.history = {}  # (piece, to) -> score
+
+  def order(self, position, moves, ply):
+    """Returns moves, a list of position's moves at ply, sorted for searching."""
+    board = position.board
+    killers = self.killers.get(ply, []) if self.use_killers else []
+    history = self.history if self.use_history else {}
+    def key(move):
+      victim = board[move.to]
+      if self.mvv_lva and victim != empty:
+        return (0, -_order_value[victim], _order_value[board[move.fro]])
+      if move in killers:
+        return (1, killers.index(move), 0)
+      return (2, -history.get((board[move.fro], move.to), 0), 0)
+    return sorted(moves, key=key)
+
+  def cutoff(self, move, piece, captured, ply, depth):
+    """Records that piece making move (capturing captured) at ply, with depth
+    left to search, caused a cutoff."""
+    if captured != empty:
+      return
+    killers = self.killers.setdefault(ply, [])
+    if move not in killers:
+      killers.insert(0, move)
+      del killers[self.killers_per_ply:]
+    key = (piece, move.to)
+    self.history[key] = self.history.get(key, 0) + depth * depth
+
+
+_exact, _lower, _upper = range(3)
+
+def _table_key(position):
+  """Returns position's transposition table key.
+
+  Scores are mscores, which depend on the path to a position as well as the
+  position (center scores of captured pieces stay in, and they wrap mod 100),
+  so transpositions only share an entry if their mscores match too.
+  """
+  return position.key * 100 + position.mscore
+
+
+class TranspositionTable(object):
+  """A fixed-size table of search results keyed by position key.
+
+  Entries are (key, depth, score, bound, best_move) tuples where bound says
+  whether score is exact or a lower or upper bound.  Each key maps to one
+  slot, and a new entry only replaces one searched at most as deep.  The
+  table holds about megabytes of entries.
+  """
+  # Rough size of a slot: a list entry and a tuple of five fields.
+  entry_bytes = 150
+
+  def __init__(self, megabytes=16):
+    self.size = max(1, megabytes * 2**20 // TranspositionTable.entry_bytes)
+    self.clear()
+
+  def clear(self):
+    """Forgets all entries and counts, e.g. before a new search."""
+    self.entries = [None] * self.size
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def get(self, key):
+    entry = self.peek(key)
+    if entry:
+      self.hits += 1
+    else:
+      self.misses += 1
+    return entry
+
+  def peek(self, key):
+    """Returns the entry for key like get(), but without counting a lookup."""
+    entry = self.entries[key % self.size]
+    if entry and entry[0] == key:
+      return entry
+    return None
+
+  def put(self, key, depth, score, bound, best_move):
+    i = key % self.size
+    entry = self.entries[i]
+    if entry:
+      if entry[1] > depth:
+        return
+      if entry[0] != key:
+        self.evictions += 1
+    self.entries[i] = (key, depth, score, bound, best_move)
+
+
+def _centipawns(score, player):
+  """Converts a 0..99 score to centipawns for player, where a pawn is 3."""
+  centipawns = (score - 50) * 100 // 3
+  return centipawns if player == 'w' else -centipawns
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Reports the speedup of TestEngine's root split search by worker count.")
+  parser.add_argument("epd", help="EPD file of positions to search")
+  parser.add_argument("--jobs", "-j", type=int, nargs="+", default=[1, 2, 4],
+                      help="worker counts to time, where 1 searches serially")
+  parser.add_argument("--depth", "-d", type=int, default=4)
+  parser.add_argument("--limit", "-n", type=int, default=10,
+                      help="only search the first n positions")
+  args = parser.parse_args()
+
+  positions = list(read_positions(args.epd))[:args.limit]
+  engine = TestEngine()
+  serial = None
+  for jobs in args.jobs:
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    engine.executor = executor
+    engine.split_width = jobs
+    if executor:
+      # Start the workers before timing.
+      list(executor.map(abs, range(jobs)))
+    moves = []
+    nodes = 0
+    start = time.perf_counter()
+    for position in positions:
+      moves.append(engine.evaluate(position, depth=args.depth))
+      nodes += engine.node_count
+    seconds = time.perf_counter() - start
+    if executor:
+      executor.shutdown()
+    serial = serial or (seconds, moves)
+    same = "same moves" if moves == serial[1] else "DIFFERENT MOVES"
+    print(f"{jobs:3} jobs {seconds:8.2f}s {serial[0] / seconds:5.2f}x {nodes:>10} nodes  {same}",
+          flush=True)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import concurrent.futures
+import unittest
+from game import *
+import testengine
+from searchtrace import SearchTrace
+from testengine import MoveOrdering, TranspositionTable
+from uciengine import SearchLimits
+
+
+class TestTestEngine(unittest.TestCase):
+  def setUp(self):
+    self.engine = testengine.TestEngine()
+
+  def search(self, fen, depth):
+    position = Position.fen(fen).with_board_type(MailboxBoard)
+    if self.engine.faithful:
+      return self.engine._search(position, 0, 99, depth)
+    return self.engine._iterative_deepening(position, depth)
+
+  def testFaithfulIgnoresTable(self):
+    self.search("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0", 3)
+    self.assertEqual(self.engine.transposition_table.hits, 0)
+    self.assertEqual(self.engine.transposition_table.misses, 0)
+
+  def testIterativeDeepeningMatchesFaithful(self):
+    for fen in ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0",
+                "1k1r1q1r/pb3ppp/4p3/3p2b1/3P4/PP1B4/KBP2PPP/2R1Q2R b - - 0 1",
+                "2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1"]:
+      self.engine = testengine.TestEngine()
+      _, expected_score = self.search(fen, 4)
+      faithful_nodes = self.engine.node_count
+      for table in (None, TranspositionTable(megabytes=1)):
+        self.engine.node_count = 0
+        self.engine.faithful = False
+        self.engine.transposition_table = table
+        _, score = self.search(fen, 4)
+        self.assertEqual(score, expected_score, fen)
+      # Reusing results should search far fewer leaves.
+      self.assertLess(self.engine.node_count, faithful_nodes, fen)
+
+  def testMoveOrderingMatchesFaithful(self):
+    fen = "2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1"
+    move, score = self.search(fen, 4)
+    faithful_nodes = self.engine.node_count
+    self.assertLess(self.engine.first_move_cutoff_rate, 0.5)
+    self.engine.move_ordering = MoveOrdering()
+    self.engine.node_count = self.engine.cutoffs = self.engine.first_move_cutoffs = 0
+    self.assertEqual(self.search(fen, 4), (move, score))
+    self.assertLess(self.engine.node_count, faithful_nodes / 10)
+    self.assertGreater(self.engine.first_move_cutoff_rate, 0.9)
+
+  def testPvsMatchesFaithful(self):
+    for fen in ["2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1",
+                "1k1r1q1r/pb3ppp/4p3/3p2b1/3P4/PP1B4/KBP2PPP/2R1Q2R b - - 0 1"]:
+      self.engine = testengine.TestEngine()
+      expected = self.search(fen, 4)
+      self.engine.pvs = True
+      self.assertEqual(self.search(fen, 4), expected, fen)
+      self.assertGreater(self.engine.researches, 0)
+      # Null windows save leaves once moves are well ordered.
+      self.engine = testengine.TestEngine()
+      self.engine.move_ordering = MoveOrdering()
+      _, score = self.search(fen, 4)
+      ordered_nodes = self.engine.node_count
+      self.engine.node_count = 0
+      self.engine.pvs = True
+      self.assertEqual(self.search(fen, 4)[1], score, fen)
+      self.assertLess(self.engine.node_count, ordered_nodes, fen)
+
+  def testAspirationMatchesFaithful(self):
+    for fen in ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0",
+                "1k1r1q1r/pb3ppp/4p3/3p2b1/3P4/PP1B4/KBP2PPP/2R1Q2R b - - 0 1",
+                "2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1"]:
+      self.engine = testengine.TestEngine()
+      _, expected_score = self.search(fen, 4)
+      self.engine.faithful = False
+      self.search(fen, 4)
+      deepening_nodes = self.engine.node_count
+      for window in (1, 3):
+        self.engine = testengine.TestEngine()
+        self.engine.faithful = False
+        self.engine.aspiration_window = window
+        self.assertEqual(self.search(fen, 4)[1], expected_score, (fen, window))
+      self.assertLess(self.engine.node_count, deepening_nodes, fen)
+
+  def testSplitSearchMatchesSerial(self):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+      for fen in ["2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1",
+                  "1k1r1q1r/pb3ppp/4p3/3p2b1/3P4/PP1B4/KBP2PPP/2R1Q2R b - - 0 1"]:
+        for width in (None, 2):
+          self.engine = testengine.TestEngine()
+          serial = self.search(fen, 3)
+          self.engine.executor = executor
+          self.engine.split_width = width
+          position = Position.fen(fen).with_board_type(MailboxBoard)
+          self.assertEqual(self.engine._split_search(position, 3), serial, fen)
+
+  def testTracedSearchStaysSerial(self):
+    fen = "1k1r1q1r/pb3ppp/4p3/3p2b1/3P4/PP1B4/KBP2PPP/2R1Q2R b - - 0 1"
+    traces = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+      for engine_executor in (None, executor):
+        self.engine = testengine.TestEngine()
+        self.engine.executor = engine_executor
+        self.engine.search_trace = SearchTrace()
+        moves = []
+        self.engine.trace = lambda depth, move, alpha, beta: moves.append((depth, move))
+        self.engine.evaluate(Position.fen(fen), depth=3)
+        traces.append((list(self.engine.search_trace), moves))
+    self.assertEqual(traces[1], traces[0])
+
+  def testMoveOrder(self):
+    ordering = MoveOrdering()
+    p = Position.fen("4k3/r7/2q4n/1P6/8/8/8/2Q1K2R w - - 0 1")
+    def ordered(ply):
+      moves = [move for move, _ in self.engine.move_gen.legal_moves(p)]
+      return [str(m) for m in ordering.order(p, moves, ply)]
+    self.assertEqual(ordered(2)[:4], ["b5c6", "c1c6", "h1h6", "c1h6"])
+    ordering.cutoff(Move.lan("h1h5"), "R", empty, 2, 2)
+    ordering.cutoff(Move.lan("e1d2"), "K", empty, 1, 3)
+    ordering.cutoff(Move.lan("b5c6"), "P", "q", 2, 2)
+    self.assertEqual(ordered(2)[4:6], ["h1h5", "e1d2"])
+    self.assertEqual(ordered(1)[4:6], ["e1d2", "h1h5"])
+    self.assertEqual(ordering.killers, {2: [Move.lan("h1h5")], 1: [Move.lan("e1d2")]})
+    self.assertEqual(ordering.history, {("R", Square.h5): 4, ("K", Square.d2): 9})
+
+  def testLimits(self):
+    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    self.engine.evaluate(p, depth=2)
+    depth_2_nodes = self.engine.node_count
+    self.engine.evaluate(p, SearchLimits.parse("go depth 2"))
+    self.assertEqual(self.engine.node_count, depth_2_nodes)
+    self.engine.faithful = False
+    move = self.engine.evaluate(p, SearchLimits.parse("go depth 4 nodes 100"))
+    self.assertIsNotNone(move)
+    self.assertLessEqual(self.engine.node_count, 100)
+
+  def testNodeLimitPlaysCompletedSearch(self):
+    fen = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0"
+    completed = []
+    for depth in range(1, 5):
+      position = Position.fen(fen).with_board_type(MailboxBoard)
+      completed.append(testengine.TestEngine()._iterative_deepening(position, depth)[0])
+    for nodes in (100, 700, 1300, 1600, 4600):
+      move = self.engine.evaluate(Position.fen(fen), SearchLimits(depth=4, nodes=nodes))
+      self.assertIn(move, completed, nodes)
+
+  def testStop(self):
+    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    self.engine.stop.set()
+    self.engine.evaluate(p)
+    self.assertEqual(self.engine.node_count, 0)
+
+  def testTableKeyIncludesMscore(self):
+    # The same position reached by different paths can have different
+    # mscores, and so different scores below it.
+    p = Position.fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0")
+    key = testengine._table_key(p)
+    self.assertEqual(testengine._table_key(p), key)
+    p.mscore = 60
+    self.assertNotEqual(testengine._table_key(p), key)
+
+  def testSearchesDontShareTable(self):
+    positions = [Position.fen("2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1"),
+                 Position.fen("1k1r1q1r/pb3ppp/4p3/3p2b1/3P4/PP1B4/KBP2PPP/2R1Q2R b - - 0 1")]
+    fresh = []
+    for position in positions:
+      engine = testengine.TestEngine()
+      engine.faithful = False
+      engine.evaluate(position, depth=4)
+      fresh.append(engine.node_count)
+    self.engine.faithful = False
+    for position, nodes in zip(positions * 2, fresh * 2):
+      self.engine.evaluate(position, depth=4)
+      self.assertEqual(self.engine.node_count, nodes)
+
+  def testReplaceByDepth(self):
+    table = TranspositionTable(megabytes=0)
+    table.put(1, 3, 50, 0, None)
+    table.put(2, 2, 60, 0, None)
+    self.assertEqual(table.get(1)[2], 50)
+    self.assertIsNone(table.get(2))
+    table.put(2, 3, 70, 0, None)
+    self.assertEqual(table.get(2)[2], 70)
+    self.assertEqual(table.evictions, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
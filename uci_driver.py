@@ -9,6 +9,7 @@ import logging
 
 from game import Position, Move, make_move
 from testengine import TestEngine
+from uciengine import SearchLimits
 from eniacengine import EniacEngine
 
 def _uci_driver(engine):
@@ -47,7 +48,8 @@ def _uci_driver(engine):
       logger.debug(f"next position: {str(next_position)}")
     elif command == "go" or command.startswith("go "):
       engine.position = next_position
-      engine.wait_for_stop = "infinite" in command
+      engine.limits = SearchLimits.parse(command)
+      engine.wait_for_stop = engine.limits.infinite
       engine.go.set()
     elif command == "stop":
       engine.stop.set()
@@ -1,13 +1,95 @@
+import functools
 import threading
 import logging
+import time
+
+
+class SearchLimits(object):
+  """Limits on a search, as given by the arguments of a UCI go command.
+
+  Times are in milliseconds and unset limits are None.  infinite means search
+  until told to stop.
+  """
+  # Milliseconds held back from every move for communication delays.
+  move_overhead = 50
+  # Moves left to plan for when the clock isn't given with movestogo.
+  default_moves_to_go = 30
+
+  def __init__(self, wtime=None, btime=None, winc=None, binc=None, movestogo=None,
+               movetime=None, depth=None, nodes=None, infinite=False):
+    self.wtime = wtime
+    self.btime = btime
+    self.winc = winc
+    self.binc = binc
+    self.movestogo = movestogo
+    self.movetime = movetime
+    self.depth = depth
+    self.nodes = nodes
+    self.infinite = infinite
+
+  @staticmethod
+  def parse(command):
+    """Parses limits from a UCI go command, e.g. "go wtime 1000 btime 1000"."""
+    limits = SearchLimits()
+    tokens = command.split()
+    if tokens and tokens[0] == "go":
+      tokens = tokens[1:]
+    i = 0
+    while i < len(tokens):
+      token = tokens[i]
+      if token == "infinite":
+        limits.infinite = True
+      elif token in ("wtime", "btime", "winc", "binc", "movestogo",
+                     "movetime", "depth", "nodes"):
+        # Limits with a missing or malformed value are ignored.
+        try:
+          setattr(limits, token, int(tokens[i + 1]))
+          i += 1
+        except (IndexError, ValueError):
+          pass
+      # Other arguments like ponder and searchmoves are ignored.
+      i += 1
+    return limits
+
+  def time_budget(self, to_move):
+    """Returns seconds to spend on a move for player to_move, or None."""
+    if self.infinite:
+      return None
+    if self.movetime is not None:
+      return max(0, self.movetime - self.move_overhead) / 1000
+    time_left = self.wtime if to_move == "w" else self.btime
+    if time_left is None:
+      return None
+    increment = (self.winc if to_move == "w" else self.binc) or 0
+    moves_to_go = self.movestogo or self.default_moves_to_go
+    budget = time_left / moves_to_go + increment
+    # Never plan to use more time than is left on the clock.
+    budget = min(budget, time_left - self.move_overhead)
+    return max(0, budget) / 1000
+
+  def __str__(self):
+    args = ["infinite"] if self.infinite else []
+    for name in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes"):
+      if getattr(self, name) is not None:
+        args.append(f"{name} {getattr(self, name)}")
+    return " ".join(["go"] + args)
+
 
 class UCIEngine(threading.Thread):
   """Base class for wrapping engines to work over UCI.
 
   Engine wrappers can mostly ignore threading and just implement
-  evaluate(position), but to respect the protocol they should bail with the
-  current best move if self.stop.is_set().
+  evaluate(position, limits), but to respect the protocol they should bail
+  with the current best move if self.stop.is_set().  self.stop is set
+  automatically when the time budget from limits runs out.
+
+  Engines can call info() during a search to report progress.  Info lines
+  go to info_output, a function taking each line, which run() sets to print
+  them; otherwise it is None and they are dropped, so engines can also be
+  searched directly as libraries.
   """
+  # Minimum seconds between info lines not forced out.
+  info_interval = 0.1
 
   def __init__(self, name="name", author="author"):
     super().__init__()
@@ -15,12 +97,18 @@ class UCIEngine(threading.Thread):
     self.name = name
     self.author = author
     self.position = None
+    self.limits = SearchLimits()
     self.wait_for_stop = False
     self.quit = threading.Event()
     self.go = threading.Event()
     self.stop = threading.Event()
+    self.info_output = None
+    self._output_lock = threading.Lock()
+    self._search_start = time.monotonic()
+    self._last_info = None
 
   def run(self):
+    self.info_output = functools.partial(print, flush=True)
     while not self.quit.is_set():
       self.log.debug("waiting for go")
       self.go.wait()
@@ -29,14 +117,59 @@ class UCIEngine(threading.Thread):
         break
       self.stop.clear()
       self.go.clear()
-      self.log.debug("evaluate {}".format(str(self.position)))
-      move = self.evaluate(self.position)
+      self.log.debug("evaluate {} {}".format(str(self.position), self.limits))
+      self._search_start = time.monotonic()
+      self._last_info = None
+      budget = self.limits.time_budget(self.position.to_move)
+      timer = None
+      if budget is not None:
+        timer = threading.Timer(budget, self.stop.set)
+        timer.start()
+      move = self.evaluate(self.position, self.limits)
+      if timer:
+        timer.cancel()
       if self.wait_for_stop:
         self.log.debug("waiting for stop event")
         self.stop.wait()
       self.stop.clear()
-      print("bestmove {}".format(move), flush=True)
+      with self._output_lock:
+        print("bestmove {}".format(move), flush=True)
       self.log.debug("bestmove {}".format(move))
 
-  def evaluate(position):
+  def evaluate(self, position, limits=None):
     raise NotImplementedError
+
+  def info(self, force=False, depth=None, nodes=None, score=None, pv=None, string=None):
+    """Sends a UCI info line reporting search progress to info_output.
+
+    score is in centipawns from the engine's point of view and pv is a list of
+    moves.  time and nps are filled in from the start of the search.  Unless
+    force is set, lines within info_interval seconds of the last one are
+    dropped, so this is cheap enough to call often.  Safe to call from any
+    thread.
+    """
+    output = self.info_output
+    if output is None:
+      return
+    now = time.monotonic()
+    last = self._last_info
+    if not force and last is not None and now - last < self.info_interval:
+      return
+    elapsed = now - self._search_start
+    fields = ["info"]
+    if depth is not None:
+      fields.append(f"depth {depth}")
+    if score is not None:
+      fields.append(f"score cp {score}")
+    if nodes is not None:
+      fields.append(f"nodes {nodes}")
+      if elapsed > 0:
+        fields.append(f"nps {int(nodes / elapsed)}")
+    fields.append(f"time {int(elapsed * 1000)}")
+    if pv:
+      fields.append("pv " + " ".join(str(move) for move in pv))
+    if string is not None:
+      fields.append(f"string {string}")
+    with self._output_lock:
+      self._last_info = now
+      output(" ".join(fields))
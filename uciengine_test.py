@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import unittest
+from game import Move
+from uciengine import SearchLimits, UCIEngine
+
+
+class TestSearchLimits(unittest.TestCase):
+  def testParse(self):
+    limits = SearchLimits.parse("go wtime 60000 btime 50000 winc 1000 binc 500 movestogo 20")
+    self.assertEqual((limits.wtime, limits.btime, limits.winc, limits.binc, limits.movestogo),
+                     (60000, 50000, 1000, 500, 20))
+    self.assertIsNone(limits.movetime)
+    self.assertFalse(limits.infinite)
+
+  def testParseOther(self):
+    limits = SearchLimits.parse("go depth 3 nodes 1000 movetime 200")
+    self.assertEqual((limits.depth, limits.nodes, limits.movetime), (3, 1000, 200))
+    self.assertTrue(SearchLimits.parse("go infinite").infinite)
+    self.assertEqual(str(SearchLimits.parse("go ponder searchmoves e2e4 depth 2")), "go depth 2")
+
+  def testParseMalformed(self):
+    self.assertEqual(str(SearchLimits.parse("go wtime")), "go")
+    self.assertEqual(str(SearchLimits.parse("go movetime x depth 2")), "go depth 2")
+    self.assertEqual(str(SearchLimits.parse("go wtime btime 1000")), "go btime 1000")
+
+  def testTimeBudget(self):
+    self.assertIsNone(SearchLimits.parse("go").time_budget("w"))
+    self.assertIsNone(SearchLimits.parse("go infinite").time_budget("w"))
+    self.assertIsNone(SearchLimits.parse("go wtime 1000").time_budget("b"))
+    self.assertEqual(SearchLimits.parse("go movetime 1050").time_budget("w"), 1.0)
+    self.assertEqual(SearchLimits.parse("go wtime 60000 btime 30000").time_budget("b"), 1.0)
+    self.assertEqual(SearchLimits.parse("go wtime 10000 winc 500 movestogo 5").time_budget("w"), 2.5)
+    # Never more than what's left on the clock.
+    self.assertEqual(SearchLimits.parse("go btime 250 binc 2000").time_budget("b"), 0.2)
+
+
+class TestInfo(unittest.TestCase):
+  def info_lines(self, calls):
+    engine = UCIEngine()
+    lines = []
+    engine.info_output = lines.append
+    for kwargs in calls:
+      engine.info(**kwargs)
+    return lines
+
+  def testFields(self):
+    line, = self.info_lines([dict(depth=3, nodes=1000, score=-33,
+                                  pv=[Move.lan("e2e4"), Move.lan("e7e5")], string="hi")])
+    self.assertRegex(line, r"^info depth 3 score cp -33 nodes 1000 nps \d+ time \d+ pv e2e4 e7e5 string hi$")
+
+  def testThrottled(self):
+    lines = self.info_lines([dict(nodes=n) for n in range(1000)] + [dict(force=True, depth=1)])
+    self.assertEqual(len(lines), 2)
+    self.assertTrue(lines[0].startswith("info nodes 0 "))
+    self.assertTrue(lines[1].startswith("info depth 1 "))
+
+  def testDroppedWithoutOutput(self):
+    engine = UCIEngine()
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+      engine.info(force=True, depth=1)
+    self.assertEqual(out.getvalue(), "")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,761 @@
+#!/usr/bin/env python3
+"""A Python interpreter for the chess VM, following chsim/vm.cc.
+
+VM runs one program instance, and BatchVM runs many instances of the same
+program in lock step using NumPy, for instance to search every position of an
+EPD file at once:
+
+  python vm.py chess.e benchmarks/bk.epd
+
+Cycle and instruction counts match chsim exactly.  See isa.md for the
+instruction set.
+"""
+import argparse
+import re
+import sys
+import time
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+from epd import read_positions
+from game import Move, Square
+
+# VM status bits, as in vm.h
+HALT = 0x01
+BREAK = 0x02
+IO_READ = 0x04
+IO_PRINT = 0x08
+
+# VM errors, as in vm.h
+ERROR_PC_BOUNDS = 1<<10
+ERROR_ILLEGAL_ACC = 1<<17
+ERROR_MEM_BOUNDS = 1<<13
+ERROR_PC_WRAPPED = 1<<14
+ERROR_OPERAND_MISALIGNED = 1<<15
+ERROR_ILLEGAL_BANK = 1<<16
+ERROR_ILLEGAL_FTL = 1<<18
+ERROR_ILLEGAL_ADDRESS = 1<<19
+ERROR_ILLEGAL_OPCODE = 1<<20
+
+# Execution cycles of each opcode, not counting fetch.
+_op_cycles = {
+  0: 4, 1: 4, 2: 4, 3: 4, 4: 4, 10: 11, 11: 13, 12: 5, 14: 7,
+  20: 9, 21: 9, 22: 9, 23: 9, 30: 9, 31: 9, 32: 9, 33: 9, 34: 9,
+  40: 4, 41: 28, 42: 37, 43: 5, 44: 5, 52: 1, 53: 1, 54: 2,
+  70: 5, 71: 2, 72: 5, 73: 2, 74: 6, 80: 6, 81: 10, 82: 10, 84: 6, 85: 6,
+  90: 2, 91: 0, 92: 0, 94: 0, 95: 0, 99: 0,
+}
+_near_ops = (40, 71, 73, 80, 81, 82)
+_far_ops = (74, 84)
+_banks = {9: 100, 90: 200, 99: 300}
+
+
+def read_program(path):
+  """Returns the function table of an isa=v4 .e file written by chasm.py.
+
+  The table is a list of 400 rows of 6 words, where rows 100-399 are ft1-3.
+  """
+  table = [[0] * 6 for _ in range(400)]
+  ft3_signs = set()
+  with open(path) as f:
+    if f.readline() != "# isa=v4\n":
+      raise ValueError(f"{path}: expecting # isa=v4")
+    for line_number, line in enumerate(f, 2):
+      if line.startswith("#") or not line.strip():
+        continue
+      m = re.match(r"s f3\.RB(\d+)S (\S)", line)
+      if m:
+        if m.group(2) == "M":
+          ft3_signs.add(int(m.group(1)) - 2)
+        continue
+      m = re.match(r"s f([1-3])\.R([AB])(\d+)L([1-6]) (\d)\b", line)
+      if not m or not 2 <= int(m.group(3)) <= 101:
+        raise ValueError(f"{path}:{line_number}: unrecognized directive")
+      ft, bank, row, index, digit = m.groups()
+      word_index = (0 if bank == "A" else 3) + (6 - int(index)) // 2
+      shift = 10 if int(index) % 2 == 0 else 1
+      table[100 * int(ft) + int(row) - 2][word_index] += shift * int(digit)
+  for row in ft3_signs:
+    table[300 + row][0] -= 100
+  return table
+
+
+def output_program(out):
+  """Returns the function table of a chasm.Output, like read_program()."""
+  table = [[0] * 6 for _ in range(400)]
+  for (address, word_index), value in out.output.items():
+    table[address][word_index] = value.word
+  return table
+
+
+class Program(object):
+  """A function table decoded for interpretation.
+
+  Rows are only ever entered at their first instruction, so the words an
+  instruction sees (after the operand increments and carries done by earlier
+  operands on its row) are fixed.  decoded[row][index] holds (opcode, arg,
+  next_index, cycles, error) for each instruction, where arg is the operand
+  or jump target and cycles includes fetch.  Operand words are None.
+  """
+  def __init__(self, function_table):
+    self.function_table = function_table
+    self.decoded = [[None] * 6 for _ in range(400)]
+    for row in range(100, 400):
+      self._decode_row(row)
+    self._arrays = None
+
+  @staticmethod
+  def load(path):
+    return Program(read_program(path))
+
+  def _decode_row(self, row):
+    ir = list(self.function_table[row])
+    start = 1 if row >= 300 else 0
+    fetch_cycles = 13 if row >= 300 else 12
+    # PC after fetching this row
+    pc = row + 1
+    i = start
+    while i < 6:
+      index = i
+      opcode = ir[i]
+      i += 1
+      arg = None
+      error = 0
+      if opcode in _near_ops or opcode in _far_ops:
+        arg, i = _consume_operand(ir, i)
+        if arg is None:
+          error = ERROR_OPERAND_MISALIGNED
+        elif opcode in _near_ops and opcode not in (40, 71):
+          arg += 100 * (pc // 100)
+        elif opcode in _far_ops:
+          # chasm always puts the bank on the same row as the address.
+          bank = ir[i] if i < 6 else None
+          i += 1
+          if bank not in _banks:
+            error = ERROR_ILLEGAL_BANK
+          else:
+            arg += _banks[bank]
+      if opcode not in _op_cycles:
+        error = ERROR_ILLEGAL_OPCODE
+      if index == start and pc in (200, 300):
+        # Fetching the last row of ft1 or ft2 halts instead.
+        opcode, arg, error = 95, None, ERROR_PC_WRAPPED
+      if opcode == 99:
+        cycles = 0
+      else:
+        cycles = (fetch_cycles if index == start else 6) + _op_cycles.get(opcode, 0)
+      self.decoded[row][index] = (opcode, arg, min(i, 6), cycles, error)
+      if error == ERROR_PC_WRAPPED:
+        break
+
+  def arrays(self):
+    """Returns decoded as NumPy arrays (opcode, arg, next_index, cycles, error).
+
+    Each has shape (400, 6), and opcode is -1 where there is no instruction.
+    """
+    if self._arrays is None:
+      arrays = [np.full((400, 6), -1 if field == 0 else 0, dtype=np.int64)
+                for field in range(5)]
+      for row in range(100, 400):
+        for index, entry in enumerate(self.decoded[row]):
+          if entry:
+            for field, value in enumerate(entry):
+              arrays[field][row, index] = value or 0
+      self._arrays = tuple(arrays)
+    return self._arrays
+
+
+def _consume_operand(ir, i):
+  """Increments and returns the operand at ir[i] as the VM does.
+
+  Returns (operand, next index), or (None, i) if the row is used up.
+  """
+  if i == 6:
+    return None, i
+  ir[i] += 1
+  sled_start = 6
+  while sled_start > 0 and ir[sled_start - 1] == 99:
+    sled_start -= 1
+  for k in range(i, 6):
+    if ir[k] == 100:
+      ir[k] = 0
+      # Do not carry into sled
+      if k < sled_start - 1:
+        ir[k + 1] += 1
+  return ir[i], i + 1
+
+
+def _drop_sign(a):
+  return a + 100 if a < 0 else a
+
+def _copy_sign(f, a):
+  digits = _drop_sign(a)
+  return digits if f >= 0 else digits - 100
+
+
+def read_deck(text):
+  """Returns the cards of a deck as (f, g, h1) tuples, i.e. AABBC fields."""
+  cards = []
+  for line in text.splitlines():
+    m = re.match(r"\s*(\d\d)(\d\d)(\d+)", line)
+    if not m:
+      raise ValueError(f"invalid card {line!r}")
+    cards.append(tuple(int(field) for field in m.groups()))
+  return cards
+
+
+def position_deck(position):
+  """Returns cards that load position for chess.e, like client.cc.
+
+  Raises ValueError if white has more than two rooks, which chess.e can't
+  track.
+  """
+  memory = [0] * 75
+  piece_code = "??PNBQpnbq"
+  rook = 0
+  for square, piece in position.board:
+    offset = ((square.y - 1) * 8 + (square.x - 1)) // 2
+    shift = 10 if square.x % 2 == 1 else 1
+    if piece in piece_code:
+      memory[offset] += shift * piece_code.index(piece)
+    elif piece != ".":
+      memory[offset] += shift
+      yx = square.y * 10 + square.x
+      if piece == "K":
+        memory[32] = yx
+      elif piece == "k":
+        memory[33] = yx
+      elif piece == "R":
+        if rook == 2:
+          raise ValueError(f"{position} has more than two white rooks")
+        memory[34 + rook] = yx
+        rook += 1
+  memory[36] = 0 if position.to_move == "w" else 10  # fromp
+  memory[37] = 50  # mscore
+  memory[38] = 1   # depth
+  memory[45] = 0 if position.to_move == "w" else 99  # best_score
+  memory[69] = 99  # beta
+  return [(address, data, 0) for address, data in enumerate(memory)] + [(99, 0, 0)]
+
+
+def output_move(position, output):
+  """Returns the Move printed by chess.e as FFTT, or None if it resigned."""
+  if not output or output[-1] == "0000":
+    return None
+  fro = Square(y=int(output[-1][0]), x=int(output[-1][1]))
+  to = Square(y=int(output[-1][2]), x=int(output[-1][3]))
+  piece = position.board[fro]
+  promo = "q" if piece in "pP" and to.y in (1, 8) else ""
+  return Move(fro, to, promo)
+
+
+class VM(object):
+  """One chess VM, with registers and memory named as in vm.h.
+
+  deck is a list of (f, g, h1) cards for read, and output collects what the
+  program prints as FFTT strings.
+  """
+  def __init__(self, program, deck=()):
+    self.program = program
+    self.deck = list(deck)
+    self.card = 0
+    self.output = []
+    self.cycles = 0
+    self.instructions = 0
+    self.status = 0
+    self.error = 0
+    self.pc = 100
+    self.old_pc = 0
+    self.ir_index = 6
+    self.a = self.b = self.c = self.d = self.e = 0
+    self.f = self.g = self.h = self.i = self.j = 0
+    self.mem = [[0] * 5 for _ in range(15)]
+
+  def run(self, max_cycles, until_print=False):
+    """Steps until halt or break, or until max_cycles have run.
+
+    With until_print, also stops after the program prints, like client.cc.
+    """
+    stop = HALT | BREAK | (IO_PRINT if until_print else 0)
+    while self.cycles < max_cycles and not self.status & stop:
+      self.step()
+    return self.status
+
+  def step(self):
+    if self.status & HALT:
+      return
+    self.status &= ~IO_PRINT
+    if self.ir_index == 6:
+      row = self.pc
+      self.ir_index = 1 if row >= 300 else 0
+      self.pc += 1
+    else:
+      row = self.pc - 1
+    opcode, arg, self.ir_index, cycles, error = self.program.decoded[row][self.ir_index]
+    self.cycles += cycles
+    if opcode != 99:
+      self.instructions += 1
+    if error:
+      self._fail(error)
+      return
+    a = self.a
+    if opcode == 0:  # clrall
+      self.a = self.b = self.c = self.d = self.e = 0
+    elif opcode == 1:  # swap A, B
+      self.a, self.b = self.b, _drop_sign(a)
+    elif opcode == 2:  # swap A, C
+      self.a, self.c = self.c, _drop_sign(a)
+    elif opcode == 3:  # swap A, D
+      self.a, self.d = self.d, _drop_sign(a)
+    elif opcode == 4:  # swap A, E
+      self.a, self.e = self.e, _drop_sign(a)
+    elif opcode == 10:  # loadacc A
+      if not 0 <= a < 15:
+        return self._fail(ERROR_ILLEGAL_ACC)
+      self.f, self.g, self.h, self.i, self.j = self.mem[a]
+    elif opcode == 11:  # storeacc A
+      if not 0 <= a < 15:
+        return self._fail(ERROR_ILLEGAL_ACC)
+      self.f = _copy_sign(self.mem[a][0], self.f)
+      self.mem[a] = [self.f, self.g, self.h, self.i, self.j]
+    elif opcode == 12:  # swapall
+      (self.a, self.b, self.c, self.d, self.e,
+       self.f, self.g, self.h, self.i, self.j) = (self.f, self.g, self.h, self.i, self.j,
+                                                  self.a, self.b, self.c, self.d, self.e)
+    elif opcode == 14:  # ftl A
+      offset = _drop_sign(a)
+      if not 6 <= offset <= 99:
+        return self._fail(ERROR_ILLEGAL_FTL)
+      self.a = self.program.function_table[300 + offset][0]
+    elif opcode == 20:  # mov B, A
+      self.a = self.b
+    elif opcode == 21:  # mov C, A
+      self.a = self.c
+    elif opcode == 22:  # mov D, A
+      self.a = self.d
+    elif opcode == 23:  # mov E, A
+      self.a = self.e
+    elif opcode == 34:  # mov F, A
+      self.a = _drop_sign(self.f)
+    elif opcode == 30:  # mov G, A
+      self.a = self.g
+    elif opcode == 31:  # mov H, A
+      self.a = self.h
+    elif opcode == 32:  # mov I, A
+      self.a = self.i
+    elif opcode == 33:  # mov J, A
+      self.a = self.j
+    elif opcode == 40:  # mov imm, A
+      self.a = arg
+    elif opcode == 41:  # mov [B], A
+      if not 0 <= self.b < 75:
+        return self._fail(ERROR_ILLEGAL_ADDRESS)
+      words = self.mem[self.b // 5]
+      self.f, self.g, self.h, self.i, self.j = words
+      self.a = _drop_sign(words[self.b % 5])
+    elif opcode == 42:  # mov A, [B]
+      if not 0 <= self.b < 75:
+        return self._fail(ERROR_ILLEGAL_ADDRESS)
+      words = list(self.mem[self.b // 5])
+      word = self.b % 5
+      words[word] = _copy_sign(words[0], a) if word == 0 else _drop_sign(a)
+      self.mem[self.b // 5] = words
+      self.f, self.g, self.h, self.i, self.j = words
+    elif opcode == 43:  # lodig A
+      self.a = a % 10 if a >= 0 else (100 + a) % 10 - 100
+    elif opcode == 44:  # swapdig A
+      digits = _drop_sign(a)
+      swapped = 10 * (digits % 10) + digits // 10
+      self.a = swapped if a >= 0 else swapped - 100
+    elif opcode == 52:  # inc A
+      self.a = -100 if a == 99 else a + 1
+    elif opcode == 53:  # dec A
+      self.a = 99 if a == -100 else a - 1
+    elif opcode == 54:  # flipn
+      self.a = a + 100 if a < 0 else a - 100
+    elif opcode == 70:  # add D, A
+      self.a = _wrap(a + self.d)
+    elif opcode == 71:  # add imm, A
+      self.a = _wrap(a + arg)
+    elif opcode == 72:  # sub D, A
+      self.a = _wrap(a - self.d)
+    elif opcode == 73:  # jmp
+      self.pc = arg
+      self.ir_index = 6
+    elif opcode == 74:  # jmp far
+      self.pc = arg
+      self._update_bank()
+      self.ir_index = 6
+    elif opcode == 80:  # jn
+      if a < 0:
+        self.pc = arg
+        self.ir_index = 6
+    elif opcode == 81:  # jz
+      if a == 0 or a == -100:
+        self.pc = arg
+        self.ir_index = 6
+    elif opcode == 82:  # jil
+      digits = _drop_sign(a)
+      if digits % 10 in (0, 9) or digits // 10 in (0, 9):
+        self.pc = arg
+        self.ir_index = 6
+    elif opcode == 84:  # jsr
+      self.old_pc = self.pc
+      self.pc = arg
+      self._update_bank()
+      self.ir_index = 6
+    elif opcode == 85:  # ret
+      self.pc = self.old_pc
+      self._update_bank()
+      self.old_pc = 0
+      self.ir_index = 6
+    elif opcode == 90:  # clr A
+      self.a = 0
+    elif opcode == 91:  # read
+      self._read()
+    elif opcode == 92:  # print
+      self.output.append(f"{_drop_sign(a):02}{self.b:02}")
+      self.status |= IO_PRINT
+    elif opcode == 94:  # brk
+      self.status |= BREAK
+    elif opcode == 95:  # halt
+      self.status |= HALT
+    if not 100 <= self.pc < 400:
+      self._fail(ERROR_PC_BOUNDS)
+
+  def _fail(self, error):
+    self.error |= error
+    self.status |= HALT
+
+  def _read(self):
+    if self.card >= len(self.deck):
+      # chsim halts on running out of cards.
+      self.status |= HALT
+      return
+    self.f, self.g, h1 = self.deck[self.card]
+    self.h = 10 * h1 + self.h % 10
+    self.card += 1
+
+  def _update_bank(self):
+    # Signs of a18, a19, and a20 reflect the current ft bank
+    bank = (self.pc // 100) % 10
+    for acc in (12, 13, 14):
+      self.mem[acc][0] = _copy_sign(+1 if bank == acc - 11 else -1, self.mem[acc][0])
+
+
+def _wrap(a):
+  if a >= 100:
+    return a - 200
+  if a < -100:
+    return a + 200
+  return a
+
+
+class BatchVM(object):
+  """Runs n instances of a program in lock step, one per deck.
+
+  Registers are NumPy arrays: rf[:, 0..4] holds ABCDE and ls[:, 0..4] FGHIJ
+  for each instance, mem has shape (n, 15, 5), and cycles, instructions, pc,
+  status and error have shape (n,).  Each step executes one instruction on
+  every running instance, grouped by opcode, so this pays off when n is large.
+  output[k] collects what instance k prints.
+  """
+  def __init__(self, program, decks):
+    if np is None:
+      raise ImportError("BatchVM requires numpy")
+    self.program = program
+    self._opcode, self._arg, self._next_index, self._cycles, self._error = program.arrays()
+    self._ft3 = np.array([row[0] for row in program.function_table[300:400]], dtype=np.int64)
+    n = len(decks)
+    self.n = n
+    width = max([len(deck) for deck in decks] + [1])
+    self.cards = np.zeros((n, width, 3), dtype=np.int64)
+    self.deck_size = np.array([len(deck) for deck in decks], dtype=np.int64)
+    for k, deck in enumerate(decks):
+      if deck:
+        self.cards[k, :len(deck)] = deck
+    self.card = np.zeros(n, dtype=np.int64)
+    self.output = [[] for _ in range(n)]
+    self.cycles = np.zeros(n, dtype=np.int64)
+    self.instructions = np.zeros(n, dtype=np.int64)
+    self.status = np.zeros(n, dtype=np.int64)
+    self.error = np.zeros(n, dtype=np.int64)
+    self.pc = np.full(n, 100, dtype=np.int64)
+    self.old_pc = np.zeros(n, dtype=np.int64)
+    self.ir_index = np.full(n, 6, dtype=np.int64)
+    self.rf = np.zeros((n, 5), dtype=np.int64)
+    self.ls = np.zeros((n, 5), dtype=np.int64)
+    self.mem = np.zeros((n, 15, 5), dtype=np.int64)
+    self.steps = 0
+
+  def run(self, max_cycles, until_print=False):
+    """Steps until every instance has halted, hit a break or run max_cycles.
+
+    With until_print, instances also stop after printing, like client.cc.
+    """
+    stop = HALT | BREAK | (IO_PRINT if until_print else 0)
+    while self.step(max_cycles, stop):
+      pass
+    return self.status
+
+  def step(self, max_cycles=None, stop=HALT | BREAK):
+    """Executes an instruction on every instance whose status has no stop bits.
+
+    Returns the number of instances that were running.
+    """
+    running = (self.status & stop) == 0
+    if max_cycles is not None:
+      running &= self.cycles < max_cycles
+    k = np.flatnonzero(running)
+    if not len(k):
+      return 0
+    self.status[k] &= ~IO_PRINT
+    self.steps += 1
+    pc = self.pc[k]
+    ir_index = self.ir_index[k]
+    fetch = ir_index == 6
+    row = np.where(fetch, pc, pc - 1)
+    index = np.where(fetch, (row >= 300).astype(np.int64), ir_index)
+    self.pc[k] = np.where(fetch, pc + 1, pc)
+    opcode = self._opcode[row, index]
+    arg = self._arg[row, index]
+    self.ir_index[k] = self._next_index[row, index]
+    self.cycles[k] += self._cycles[row, index]
+    self.instructions[k] += opcode != 99
+    error = self._error[row, index]
+    failed = error != 0
+    if failed.any():
+      self._fail(k[failed], error[failed])
+      k, opcode, arg = k[~failed], opcode[~failed], arg[~failed]
+    for code in np.unique(opcode):
+      selected = opcode == code
+      handler = self._handlers.get(int(code))
+      if handler:
+        handler(self, k[selected], arg[selected])
+    pc = self.pc[k]
+    out_of_bounds = (pc < 100) | (pc >= 400)
+    if out_of_bounds.any():
+      self._fail(k[out_of_bounds], ERROR_PC_BOUNDS)
+    return len(k)
+
+  def _fail(self, k, error):
+    self.error[k] |= error
+    self.status[k] |= HALT
+
+  def _clrall(self, k, arg):
+    self.rf[k] = 0
+
+  def _swap(register):
+    def swap(self, k, arg):
+      a = _np_drop_sign(self.rf[k, 0])
+      self.rf[k, 0] = self.rf[k, register]
+      self.rf[k, register] = a
+    return swap
+
+  def _loadacc(self, k, arg):
+    acc = self.rf[k, 0]
+    ok = (acc >= 0) & (acc < 15)
+    self._fail(k[~ok], ERROR_ILLEGAL_ACC)
+    self.ls[k[ok]] = self.mem[k[ok], acc[ok]]
+
+  def _storeacc(self, k, arg):
+    acc = self.rf[k, 0]
+    ok = (acc >= 0) & (acc < 15)
+    self._fail(k[~ok], ERROR_ILLEGAL_ACC)
+    k, acc = k[ok], acc[ok]
+    self.ls[k, 0] = _np_copy_sign(self.mem[k, acc, 0], self.ls[k, 0])
+    self.mem[k, acc] = self.ls[k]
+
+  def _swapall(self, k, arg):
+    self.rf[k], self.ls[k] = self.ls[k], self.rf[k]
+
+  def _ftl(self, k, arg):
+    offset = _np_drop_sign(self.rf[k, 0])
+    ok = (offset >= 6) & (offset <= 99)
+    self._fail(k[~ok], ERROR_ILLEGAL_FTL)
+    self.rf[k[ok], 0] = self._ft3[offset[ok]]
+
+  def _mov(register):
+    def mov(self, k, arg):
+      self.rf[k, 0] = self.rf[k, register]
+    return mov
+
+  def _mov_ls(register):
+    def mov(self, k, arg):
+      self.rf[k, 0] = _np_drop_sign(self.ls[k, register])
+    return mov
+
+  def _mov_imm(self, k, arg):
+    self.rf[k, 0] = arg
+
+  def _load_word(self, k, arg):
+    b = self.rf[k, 1]
+    ok = (b >= 0) & (b < 75)
+    self._fail(k[~ok], ERROR_ILLEGAL_ADDRESS)
+    k, b = k[ok], b[ok]
+    words = self.mem[k, b // 5]
+    self.ls[k] = words
+    self.rf[k, 0] = _np_drop_sign(words[np.arange(len(k)), b % 5])
+
+  def _store_word(self, k, arg):
+    b = self.rf[k, 1]
+    ok = (b >= 0) & (b < 75)
+    self._fail(k[~ok], ERROR_ILLEGAL_ADDRESS)
+    k, b = k[ok], b[ok]
+    words = self.mem[k, b // 5]
+    word = b % 5
+    a = self.rf[k, 0]
+    rows = np.arange(len(k))
+    words[rows, word] = np.where(word == 0, _np_copy_sign(words[:, 0], a), _np_drop_sign(a))
+    self.mem[k, b // 5] = words
+    self.ls[k] = words
+
+  def _lodig(self, k, arg):
+    a = self.rf[k, 0]
+    self.rf[k, 0] = np.where(a >= 0, a % 10, (100 + a) % 10 - 100)
+
+  def _swapdig(self, k, arg):
+    a = self.rf[k, 0]
+    digits = _np_drop_sign(a)
+    swapped = 10 * (digits % 10) + digits // 10
+    self.rf[k, 0] = np.where(a >= 0, swapped, swapped - 100)
+
+  def _inc(self, k, arg):
+    a = self.rf[k, 0]
+    self.rf[k, 0] = np.where(a == 99, -100, a + 1)
+
+  def _dec(self, k, arg):
+    a = self.rf[k, 0]
+    self.rf[k, 0] = np.where(a == -100, 99, a - 1)
+
+  def _flipn(self, k, arg):
+    a = self.rf[k, 0]
+    self.rf[k, 0] = np.where(a < 0, a + 100, a - 100)
+
+  def _add(self, k, arg):
+    self.rf[k, 0] = _np_wrap(self.rf[k, 0] + self.rf[k, 3])
+
+  def _add_imm(self, k, arg):
+    self.rf[k, 0] = _np_wrap(self.rf[k, 0] + arg)
+
+  def _sub(self, k, arg):
+    self.rf[k, 0] = _np_wrap(self.rf[k, 0] - self.rf[k, 3])
+
+  def _jump(self, k, target):
+    self.pc[k] = target
+    self.ir_index[k] = 6
+
+  def _jmp_far(self, k, target):
+    self._jump(k, target)
+    self._update_bank(k)
+
+  def _jump_if(condition):
+    def jump(self, k, target):
+      taken = condition(self.rf[k, 0])
+      self._jump(k[taken], target[taken])
+    return jump
+
+  def _jsr(self, k, target):
+    self.old_pc[k] = self.pc[k]
+    self._jmp_far(k, target)
+
+  def _ret(self, k, arg):
+    self._jmp_far(k, self.old_pc[k])
+    self.old_pc[k] = 0
+
+  def _clr(self, k, arg):
+    self.rf[k, 0] = 0
+
+  def _read(self, k, arg):
+    card = self.card[k]
+    ok = card < self.deck_size[k]
+    # chsim halts on running out of cards.
+    self.status[k[~ok]] |= HALT
+    k, card = k[ok], card[ok]
+    f, g, h1 = self.cards[k, card].T
+    self.ls[k, 0] = f
+    self.ls[k, 1] = g
+    self.ls[k, 2] = 10 * h1 + self.ls[k, 2] % 10
+    self.card[k] += 1
+
+  def _print(self, k, arg):
+    for i in k:
+      self.output[i].append(f"{_drop_sign(int(self.rf[i, 0])):02}{int(self.rf[i, 1]):02}")
+    self.status[k] |= IO_PRINT
+
+  def _brk(self, k, arg):
+    self.status[k] |= BREAK
+
+  def _halt(self, k, arg):
+    self.status[k] |= HALT
+
+  def _update_bank(self, k):
+    # Signs of a18, a19, and a20 reflect the current ft bank
+    bank = (self.pc[k] // 100) % 10
+    for acc in (12, 13, 14):
+      self.mem[k, acc, 0] = _np_copy_sign(np.where(bank == acc - 11, 1, -1), self.mem[k, acc, 0])
+
+  _handlers = {
+    0: _clrall, 1: _swap(1), 2: _swap(2), 3: _swap(3), 4: _swap(4),
+    10: _loadacc, 11: _storeacc, 12: _swapall, 14: _ftl,
+    20: _mov(1), 21: _mov(2), 22: _mov(3), 23: _mov(4),
+    34: _mov_ls(0), 30: _mov_ls(1), 31: _mov_ls(2), 32: _mov_ls(3), 33: _mov_ls(4),
+    40: _mov_imm, 41: _load_word, 42: _store_word, 43: _lodig, 44: _swapdig,
+    52: _inc, 53: _dec, 54: _flipn, 70: _add, 71: _add_imm, 72: _sub,
+    73: _jump, 74: _jmp_far,
+    80: _jump_if(lambda a: a < 0),
+    81: _jump_if(lambda a: (a == 0) | (a == -100)),
+    82: _jump_if(lambda a: np.isin(_np_drop_sign(a) % 10, (0, 9)) |
+                           np.isin(_np_drop_sign(a) // 10, (0, 9))),
+    84: _jsr, 85: _ret, 90: _clr, 91: _read, 92: _print, 94: _brk, 95: _halt,
+  }
+  del _swap, _mov, _mov_ls, _jump_if
+
+
+def _np_drop_sign(a):
+  return np.where(a < 0, a + 100, a)
+
+def _np_copy_sign(f, a):
+  digits = _np_drop_sign(a)
+  return np.where(f >= 0, digits, digits - 100)
+
+def _np_wrap(a):
+  return np.where(a >= 100, a - 200, np.where(a < -100, a + 200, a))
+
+
+def search(program, positions, max_cycles=10**10):
+  """Runs chess.e on each position in one batch.
+
+  Returns the BatchVM and the move played in each position (None if ENIAC
+  resigned or didn't answer).  Like client.cc, each search stops once the
+  move is printed, so cycle counts match the client.
+  """
+  batch = BatchVM(program, [position_deck(position) for position in positions])
+  batch.run(max_cycles, until_print=True)
+  moves = [output_move(position, output) for position, output in zip(positions, batch.output)]
+  return batch, moves
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Runs chess.e on every position of an EPD file.")
+  parser.add_argument("program", help="program assembled by chasm.py, e.g. chess.e")
+  parser.add_argument("epd", help="EPD file of positions to search")
+  parser.add_argument("--max-cycles", type=int, default=10**10,
+                      help="give up on a search after this many cycles")
+  args = parser.parse_args()
+
+  positions = list(read_positions(args.epd))
+  start = time.perf_counter()
+  batch, moves = search(Program.load(args.program), positions, args.max_cycles)
+  wall = time.perf_counter() - start
+  for k, (position, move) in enumerate(zip(positions, moves)):
+    print(f"{k + 1:4} {str(move or 'none'):6} {batch.cycles[k]:>12} cycles "
+          f"{batch.instructions[k]:>11} instructions  {' '.join(str(position).split()[:2])}")
+  print(f"{len(positions)} positions, {batch.steps} steps in {wall:.2f}s")
+
+
+if __name__ == "__main__":
+  sys.exit(main())
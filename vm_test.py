@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from subprocess import run
+
+import vm
+from chasm.chasm import Assembler, print_easm
+from game import Move, Position
+
+
+def assemble(source):
+  return Assembler(print_errors=False).assemble(source)
+
+
+class TestProgram(unittest.TestCase):
+  def testReadProgram(self):
+    out = assemble('asm/chess.asm')
+    with tempfile.TemporaryDirectory() as scratch:
+      path = os.path.join(scratch, 'chess.e')
+      with open(path, 'w') as f:
+        print_easm(out, f)
+      self.assertEqual(vm.read_program(path), vm.output_program(out))
+
+  def testOperandsAreIncremented(self):
+    # chasm emits operands less one, and jump targets are absolute.
+    table = [[0] * 6 for _ in range(400)]
+    table[100] = [40, 39, 84, 49, 90, 99]  # mov 40,A; jsr 250
+    table[101] = [73, 9, 99, 99, 99, 99]     # jmp 110
+    # Operands carry, so 99 encodes mov 0,A and turns the following inc
+    # into dec.
+    table[102] = [40, 99, 52, 99, 99, 99]
+    program = vm.Program(table)
+    self.assertEqual(program.decoded[100][0][:3], (40, 40, 2))
+    self.assertEqual(program.decoded[100][2][:3], (84, 250, 5))
+    self.assertEqual(program.decoded[101][0][:3], (73, 110, 2))
+    self.assertEqual(program.decoded[102][0][:3], (40, 0, 2))
+    self.assertEqual(program.decoded[102][2][0], 53)
+
+
+class TestVM(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.movegen = vm.Program(vm.output_program(assemble('asm/movegen_test.asm')))
+    cls.chess = vm.Program(vm.output_program(assemble('asm/chess_test.asm')))
+
+  def testMateIn1(self):
+    position = Position.fen('4k3/4P3/3PK3/8/8/8/8/8 w - - 0 1')
+    machine = vm.VM(self.chess, vm.position_deck(position))
+    self.assertEqual(machine.run(10**9), vm.HALT)
+    self.assertEqual(machine.error, 0)
+    self.assertEqual(machine.output, ['6474'])
+    self.assertEqual(vm.output_move(position, machine.output), Move.lan('d6d7'))
+
+  def testPositionDeckRejectsThirdRook(self):
+    vm.position_deck(Position.fen('4k3/8/8/8/8/8/8/R3K2R w - - 0 1'))
+    with self.assertRaises(ValueError):
+      vm.position_deck(Position.fen('4k3/8/8/8/8/8/8/RR2K2R w - - 0 1'))
+
+  def testSameCyclesAsChsim(self):
+    run('make -C chsim chsim', shell=True, check=True)
+    position = Position.fen('8/8/8/8/8/3pk3/4p3/4K3 w - - 0 1')
+    deck = vm.position_deck(position)
+    machine = vm.VM(self.chess, deck)
+    machine.run(10**9)
+    with tempfile.TemporaryDirectory() as scratch:
+      path = os.path.join(scratch, 'chess_test.e')
+      with open(path, 'w') as f:
+        print_easm(assemble('asm/chess_test.asm'), f)
+      cards = ''.join(f'{f:02}{g:02}{h}\n' for f, g, h in deck)
+      result = run(['./chsim/chsim', '-b', path], input=f'{cards}run 1000000000\n',
+                   capture_output=True, text=True, check=True)
+    *output, done = result.stdout.split('\n')[:-1]
+    self.assertEqual(output, machine.output)
+    self.assertEqual(done, f'done halt {machine.cycles} {machine.instructions}')
+
+  def testRunsOutOfCards(self):
+    machine = vm.VM(self.movegen, [])
+    self.assertEqual(machine.run(10**6), vm.HALT)
+    self.assertEqual(machine.error, 0)
+    self.assertEqual(machine.card, 0)
+
+  def testUntilPrint(self):
+    position = Position.fen('8/8/8/8/8/8/1P6/8 w - - 0 1')
+    machine = vm.VM(self.movegen, vm.position_deck(position))
+    machine.run(10**6, until_print=True)
+    self.assertEqual(machine.status, vm.IO_PRINT)
+    self.assertEqual(machine.output, ['2232'])
+    machine.run(10**6)
+    self.assertEqual(machine.output, ['2232', '2242'])
+
+
+@unittest.skipIf(vm.np is None, 'needs numpy')
+class TestBatchVM(unittest.TestCase):
+  def testSameAsVM(self):
+    program = vm.Program(vm.output_program(assemble('asm/movegen_test.asm')))
+    fens = [
+      'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+      'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR b KQkq - 0 1',
+      '8/8/8/8/8/8/1P6/8 w - - 0 1',
+      '4k3/8/8/3q4/8/8/8/R3K2R w - - 0 1',
+    ]
+    decks = [vm.position_deck(Position.fen(fen)) for fen in fens] + [[]]
+    batch = vm.BatchVM(program, decks)
+    batch.run(10**6)
+    for k, deck in enumerate(decks):
+      machine = vm.VM(program, deck)
+      machine.run(10**6)
+      self.assertEqual(batch.output[k], machine.output)
+      self.assertEqual(batch.cycles[k], machine.cycles)
+      self.assertEqual(batch.instructions[k], machine.instructions)
+      self.assertEqual(batch.status[k], machine.status)
+      self.assertEqual(batch.mem[k].tolist(), machine.mem)
+      self.assertEqual(batch.rf[k].tolist(),
+                       [machine.a, machine.b, machine.c, machine.d, machine.e])
+      self.assertEqual(batch.ls[k].tolist(),
+                       [machine.f, machine.g, machine.h, machine.i, machine.j])
+
+  def testMaxCycles(self):
+    program = vm.Program(vm.output_program(assemble('asm/chess_test.asm')))
+    position = Position.fen('4k3/4P3/3PK3/8/8/8/8/8 w - - 0 1')
+    batch = vm.BatchVM(program, [vm.position_deck(position)] * 2)
+    batch.run(20000)
+    self.assertEqual(batch.status.tolist(), [0, 0])
+    self.assertTrue(all(20000 <= cycles < 20100 for cycles in batch.cycles))
+
+
+if __name__ == '__main__':
+  unittest.main()